@@ -0,0 +1,80 @@
+# Imports
+import pandas as pd
+
+# How partial results of each aggregation are combined with each other
+COMBINE = {'sum': 'sum', 'count': 'sum', 'min': 'min', 'max': 'max',
+           'first': 'first', 'last': 'last'}
+
+
+class RunningAggregate:
+    """
+    Grouped aggregation that is updated one chunk at a time.
+
+    Only the aggregated groups are kept between chunks, so memory is bounded
+    by the number of groups rather than by the number of rows. Chunks must
+    arrive in order for 'first' and 'last' to be meaningful.
+
+    Example, monthly consumption per municipality:
+        agg = RunningAggregate(['Month', 'MunicipalityNo'],
+                               {'TotalCon': ('TotalCon', 'sum')})
+        for chunk in api.iter_sql(query, order_by='"Month"'):
+            agg.update(chunk)
+        df = agg.result()
+    """
+
+    def __init__(self, by, aggs):
+        '''
+        by: list of columns to group by.
+        aggs: output column -> (input column, function), where function is
+            one of sum, count, min, max, first, last or mean.
+        '''
+        self.by = list(by)
+        self.aggs = dict(aggs)
+        self.partials = {}
+        for name, (column, func) in self.aggs.items():
+            if func == 'mean':
+                self.partials[f'{name}__sum'] = (column, 'sum')
+                self.partials[f'{name}__count'] = (column, 'count')
+            elif func in COMBINE:
+                self.partials[name] = (column, func)
+            else:
+                raise ValueError(f'Unsupported aggregation: {func}')
+        self.state = None
+
+    def update(self, chunk):
+        '''
+        Folds one chunk of rows into the running aggregate.
+        '''
+        if chunk.empty:
+            return self
+        part = chunk.groupby(self.by, sort=False).agg(**self.partials)
+        if self.state is None:
+            self.state = part
+        else:
+            combined = pd.concat([self.state, part])
+            self.state = combined.groupby(level=list(range(len(self.by))), sort=False).agg(
+                {name: COMBINE[func] for name, (_, func) in self.partials.items()})
+        return self
+
+    def result(self):
+        '''
+        Returns the aggregate so far as a DataFrame sorted by the group keys.
+        '''
+        if self.state is None:
+            return pd.DataFrame(columns=self.by + list(self.aggs))
+        df = self.state.sort_index().copy()
+        for name, (_, func) in self.aggs.items():
+            if func == 'mean':
+                df[name] = df.pop(f'{name}__sum') / df.pop(f'{name}__count')
+        return df[list(self.aggs)].reset_index()
+
+
+def fold_chunks(chunks, by, aggs):
+    '''
+    Folds an iterable of DataFrame chunks, e.g. from EnergiAPI.iter_sql,
+    into a single grouped aggregate. See RunningAggregate.
+    '''
+    agg = RunningAggregate(by, aggs)
+    for chunk in chunks:
+        agg.update(chunk)
+    return agg.result()
@@ -1,6 +1,7 @@
 # Imports
 from dash import Dash
 import dash_bootstrap_components as dbc
+from flask_compress import Compress
 
 
 # App Setup
@@ -10,4 +11,10 @@ app = Dash(__name__, external_stylesheets=external_stylesheets,
 
 server = app.server
 
+## Compress callback responses and assets, brotli where the browser accepts it
+server.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+server.config['COMPRESS_MIMETYPES'] = ['application/json', 'text/html', 'text/css',
+    'application/javascript', 'text/javascript']
+Compress(server)
+
 app.config.suppress_callback_exceptions = True
@@ -0,0 +1,35 @@
+/* Decoding of the compact store payloads written by encoding.py.
+ * Typed arrays arrive as {dtype, bdata} with little-endian base64 data;
+ * evenly spaced time axes arrive as {x0, dx} with dx in milliseconds. */
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    encoding: {
+        decode: function(values) {
+            if (!values || Array.isArray(values) || !values.bdata) {
+                return values;
+            }
+            var binary = atob(values.bdata);
+            var bytes = new Uint8Array(binary.length);
+            for (var i = 0; i < binary.length; i++) {
+                bytes[i] = binary.charCodeAt(i);
+            }
+            var array = values.dtype === 'f8' ? new Float64Array(bytes.buffer) : new Float32Array(bytes.buffer);
+            return Array.prototype.map.call(array, function(v) {
+                return isNaN(v) ? null : v;
+            });
+        },
+        axis: function(axis) {
+            // Scatter and bar traces take an evenly spaced axis as is
+            return axis.x ? {x: axis.x} : {x0: axis.x0, dx: axis.dx};
+        },
+        trace: function(template, axis, y) {
+            // Any x of the template goes, as plotly takes even an empty x
+            // over x0/dx and would draw nothing
+            var trace = Object.assign({}, template);
+            delete trace.x;
+            delete trace.x0;
+            delete trace.dx;
+            return Object.assign(trace, window.dash_clientside.encoding.axis(axis),
+                                 {y: window.dash_clientside.encoding.decode(y)});
+        }
+    }
+});
@@ -0,0 +1,19 @@
+/* Data-only map updates for the municipality view.
+ * The server sends the geometry once with the page; afterwards it only
+ * sends {z, zmin, zmax, title}, which is patched into the figure here. */
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    mapview: {
+        apply_values: function(values, figure) {
+            if (!values || !figure) {
+                return window.dash_clientside.no_update;
+            }
+            var trace = Object.assign({}, figure.data[0], {
+                z: window.dash_clientside.encoding.decode(values.z),
+                zmin: values.zmin,
+                zmax: values.zmax,
+                colorbar: Object.assign({}, figure.data[0].colorbar, {title: {text: values.title}})
+            });
+            return Object.assign({}, figure, {data: [trace].concat(figure.data.slice(1))});
+        }
+    }
+});
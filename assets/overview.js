@@ -0,0 +1,18 @@
+/* Energy balance graph of the overview page.
+ * The server stores the 7-day balance of DK1, DK2 and DK once per refresh,
+ * so switching the price area only rebuilds the figure in the browser. */
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    overview: {
+        balance_figure: function(pricearea, store) {
+            if (!store) {
+                return window.dash_clientside.no_update;
+            }
+            var encoding = window.dash_clientside.encoding;
+            var area = store.areas[pricearea] || store.areas.DK;
+            var data = store.template.data.map(function(trace, i) {
+                return encoding.trace(trace, area, area.y[i]);
+            });
+            return Object.assign({}, store.template, {data: data});
+        }
+    }
+});
@@ -0,0 +1,54 @@
+# Decoding Benchmark
+import sys
+import json
+import time
+import pandas as pd
+from collections import defaultdict
+
+from utils import decode_response
+from benchmarks import fixtures
+
+'''
+Compares the columnar decoder in utils against the original per-record
+implementation of EnergiAPI.sql_to_df on fixture payloads.
+
+Run from the repository root:
+    python -m benchmarks.bench_decode
+'''
+
+
+def legacy_decode(content):
+    '''
+    The decoding of EnergiAPI.sql_to_df before the columnar decoder.
+    '''
+    raw = json.loads(content)
+    records = raw["result"]["records"]
+    _dict = defaultdict(list)
+    for record in records:
+        for key in list(records[0].keys()):
+            _dict[key].append(record[key])
+    return pd.DataFrame.from_dict(_dict)
+
+def best_of(func, arg, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(arg)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main(repeat=5):
+    cases = [
+        ('elspotprices, 1 month', fixtures.payload(fixtures.elspotprices, 24 * 30)),
+        ('elspotprices, 1 year', fixtures.payload(fixtures.elspotprices, 24 * 365)),
+        ('consumptionpermunicipalityde35, 12 months',
+            fixtures.payload(fixtures.consumptionpermunicipalityde35, 12)),
+    ]
+    print(f"{'payload':<45}{'MB':>8}{'legacy (s)':>12}{'columnar (s)':>14}{'speedup':>9}")
+    for name, content in cases:
+        legacy = best_of(legacy_decode, content, repeat)
+        columnar = best_of(decode_response, content, repeat)
+        print(f"{name:<45}{len(content) / 1e6:>8.2f}{legacy:>12.3f}{columnar:>14.3f}{legacy / columnar:>8.1f}x")
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
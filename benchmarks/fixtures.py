@@ -0,0 +1,424 @@
+# Fixture Payloads
+import os
+import re
+import gzip
+import json
+import threading
+import numpy as np
+import pandas as pd
+from urllib.parse import unquote_plus
+from utils import dataset_of
+
+'''
+Builds datastore_search_sql responses shaped like the ones returned by
+energidataservice.dk, so the decoding and transform code can be measured
+without a network connection. Values are deterministic for a given size;
+timestamps end at the current hour so retention windows keep them.
+
+FixtureTransport answers each query by running it on the fixture of its
+dataset (see answer()): the projection, aliases, WHERE conditions (also
+on the current time and store watermarks), GROUP BY aggregation, ORDER
+BY and LIMIT/OFFSET of the statements query.Query and EnergiAPI.iter_sql
+build. Other SQL is rejected with a ValueError instead of being answered
+with the whole dataset.
+'''
+
+GEOJSON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'assets', 'geo_municipalities.json')
+RECORDED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recorded')
+
+with open(GEOJSON) as j:
+    MUNICIPALITIES = sorted({int(f['properties']['lau_1']) for f in json.load(j)['features']})
+INDUSTRIES = [str(code) for code in range(1, 37)]
+PRICE_AREAS = ['DK1', 'DK2', 'NO2', 'SE3', 'SE4', 'DE']
+
+
+def _now():
+    return pd.Timestamp.utcnow().tz_localize(None).floor('60min')
+
+def _iso(index):
+    return [ts.strftime('%Y-%m-%dT%H:%M:%S') for ts in index]
+
+def _months(n):
+    return pd.date_range(end=_now().floor('D'), periods=n, freq='MS')
+
+def response(records, fields):
+    '''
+    Wraps records in the CKAN datastore_search_sql envelope.
+    '''
+    return {'help': 'https://www.energidataservice.dk/api/3/action/help_show?name=datastore_search_sql',
+            'success': True,
+            'result': {'records': records,
+                       'fields': [{'id': name, 'type': type_} for name, type_ in fields],
+                       'sql': ''}}
+
+
+# Datasets
+def elspotprices(hours=24 * 365):
+    '''
+    Hourly spot prices for every price area.
+    '''
+    rng = np.random.default_rng(1)
+    utc = pd.date_range(end=_now(), periods=hours, freq='60min')
+    records = []
+    _id = 0
+    for area in PRICE_AREAS:
+        prices = 30 + 10 * rng.standard_normal(hours)
+        for hour_utc, hour_dk, price in zip(_iso(utc), _iso(utc + pd.Timedelta(hours=1)), prices):
+            _id += 1
+            records.append({'_id': _id, '_full_text': f"'{area}'", 'HourUTC': hour_utc,
+                'HourDK': hour_dk, 'PriceArea': area, 'SpotPriceDKK': round(price * 7.44, 2),
+                'SpotPriceEUR': round(price, 2)})
+    fields = [('_id', 'int4'), ('_full_text', 'tsvector'), ('HourUTC', 'timestamp'),
+        ('HourDK', 'timestamp'), ('PriceArea', 'text'), ('SpotPriceDKK', 'float8'),
+        ('SpotPriceEUR', 'float8')]
+    return response(records, fields)
+
+def consumptionpermunicipalityde35(months=12):
+    '''
+    Monthly consumption per municipality and DE35 industry code.
+    '''
+    rng = np.random.default_rng(2)
+    records = []
+    _id = 0
+    for month in _iso(_months(months)):
+        for municipality in MUNICIPALITIES:
+            for industry in INDUSTRIES:
+                _id += 1
+                records.append({'_id': _id, '_full_text': f"'{municipality}'", 'Month': month,
+                    'MunicipalityNo': municipality, 'Industrycode_DE35': industry,
+                    'TotalCon': round(float(rng.uniform(0, 5e6)), 3),
+                    'MeasurementPoints': int(rng.integers(1, 5000))})
+    fields = [('_id', 'int4'), ('_full_text', 'tsvector'), ('Month', 'timestamp'),
+        ('MunicipalityNo', 'int4'), ('Industrycode_DE35', 'text'), ('TotalCon', 'float8'),
+        ('MeasurementPoints', 'int4')]
+    return response(records, fields)
+
+def communityproduction(months=12):
+    '''
+    Monthly production per municipality and source.
+    '''
+    rng = np.random.default_rng(3)
+    sources = ['OnshoreWindPower', 'OffshoreWindPower', 'SolarPower', 'CentralPower', 'DecentralPower']
+    records = []
+    _id = 0
+    for month in _iso(_months(months)):
+        for municipality in MUNICIPALITIES:
+            _id += 1
+            record = {'_id': _id, '_full_text': f"'{municipality}'", 'Month': month,
+                'MunicipalityNo': municipality}
+            record.update({source: round(float(rng.uniform(0, 5e4)), 3) for source in sources})
+            records.append(record)
+    fields = [('_id', 'int4'), ('_full_text', 'tsvector'), ('Month', 'timestamp'),
+        ('MunicipalityNo', 'int4')] + [(source, 'float8') for source in sources]
+    return response(records, fields)
+
+def industrycodes_de35(codes=len(INDUSTRIES)):
+    '''
+    DE35 industry codes with their English labels, aliased as in mapview.
+    '''
+    records = [{'ind_code': code, 'ind_label': f'Industry {code}'} for code in INDUSTRIES[:codes]]
+    return response(records, [('ind_code', 'text'), ('ind_label', 'text')])
+
+def powersystemrightnow(minutes=24 * 60):
+    '''
+    Minute resolution production and CO2 emission, newest first.
+    '''
+    rng = np.random.default_rng(4)
+    times = pd.date_range(end=pd.Timestamp.utcnow().tz_localize(None).floor('min'),
+        periods=minutes, freq='1min')[::-1]
+    walk = lambda scale: np.abs(np.cumsum(rng.standard_normal(minutes)) * scale + 20 * scale)
+    columns = {'CO2Emission': walk(2), 'ProductionGe100MW': walk(30), 'ProductionLt100MW': walk(20),
+        'SolarPower': walk(5), 'OffshoreWindPower': walk(40), 'OnshoreWindPower': walk(50)}
+    records = []
+    for i, (utc, dk) in enumerate(zip(_iso(times), _iso(times + pd.Timedelta(hours=1)))):
+        record = {'Minutes1UTC': utc, 'Minutes1DK': dk}
+        record.update({name: round(float(values[i]), 4) for name, values in columns.items()})
+        records.append(record)
+    fields = [('Minutes1UTC', 'timestamp'), ('Minutes1DK', 'timestamp')] + \
+        [(name, 'float8') for name in columns]
+    return response(records, fields)
+
+def co2emisprog(steps=72):
+    '''
+    5-minute CO2 emission prognosis for DK1.
+    '''
+    rng = np.random.default_rng(5)
+    times = pd.date_range(start=pd.Timestamp.utcnow().tz_localize(None).ceil('5min'),
+        periods=steps, freq='5min')
+    records = [{'Minutes5UTC': utc, 'Minutes5DK': dk, 'PriceArea': 'DK1',
+                'CO2Emission': round(float(value), 2)}
+               for utc, dk, value in zip(_iso(times), _iso(times + pd.Timedelta(hours=1)),
+                                         rng.uniform(50, 250, steps))]
+    fields = [('Minutes5UTC', 'timestamp'), ('Minutes5DK', 'timestamp'), ('PriceArea', 'text'),
+        ('CO2Emission', 'float8')]
+    return response(records, fields)
+
+def electricitybalancenonv(hours=24 * 7):
+    '''
+    Hourly production by source and total load for DK1 and DK2.
+    '''
+    rng = np.random.default_rng(6)
+    columns = ['TotalLoad', 'Biomass', 'FossilGas', 'FossilHardCoal', 'FossilOil', 'HydroPower',
+        'OtherRenewable', 'SolarPower', 'Waste', 'OnshoreWindPower', 'OffshoreWindPower']
+    utc = pd.date_range(end=_now(), periods=hours, freq='60min')
+    records = []
+    _id = 0
+    for area in ['DK1', 'DK2']:
+        for hour_utc, hour_dk in zip(_iso(utc), _iso(utc + pd.Timedelta(hours=1))):
+            _id += 1
+            record = {'_id': _id, '_full_text': f"'{area}'", 'HourUTC': hour_utc,
+                'HourDK': hour_dk, 'PriceArea': area}
+            record.update({column: round(float(rng.uniform(0, 2000)), 3) for column in columns})
+            record['HydroPower'] = None
+            records.append(record)
+    fields = [('_id', 'int4'), ('_full_text', 'tsvector'), ('HourUTC', 'timestamp'),
+        ('HourDK', 'timestamp'), ('PriceArea', 'text')] + [(column, 'float8') for column in columns]
+    return response(records, fields)
+
+
+BUILDERS = {
+    'elspotprices': elspotprices,
+    'consumptionpermunicipalityde35': consumptionpermunicipalityde35,
+    'communityproduction': communityproduction,
+    'industrycodes_de35': industrycodes_de35,
+    'powersystemrightnow': powersystemrightnow,
+    'co2emisprog': co2emisprog,
+    'electricitybalancenonv': electricitybalancenonv,
+}
+
+def payload(builder, *args):
+    '''
+    Returns the response of a fixture builder as raw JSON bytes.
+    '''
+    return json.dumps(builder(*args)).encode('utf-8')
+
+
+def recorded_path(dataset, root=RECORDED_DIR):
+    return os.path.join(root, f'{dataset}.json.gz')
+
+def recorded(dataset, root=RECORDED_DIR):
+    '''
+    The response recorded for a dataset by benchmarks.record.
+    '''
+    path = recorded_path(dataset, root)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'No recorded response of {dataset} at {path}; '
+                                'record one with python -m benchmarks.record')
+    with gzip.open(path, 'rb') as f:
+        return f.read()
+
+
+# Queries
+STATEMENT = re.compile(r'^SELECT (?P<select>.+?) FROM "(?P<dataset>\w+)"(?: WHERE (?P<where>.+?))?'
+                       r'(?: GROUP BY (?P<group>.+?))?(?: ORDER BY (?P<order>.+?))?'
+                       r'(?: LIMIT (?P<limit>\d+))?(?: OFFSET (?P<offset>\d+))?$', re.DOTALL)
+## The pages of EnergiAPI.iter_sql
+PAGE = re.compile(r'^SELECT \* FROM \((?P<inner>.+)\) AS page (?:WHERE (?P<where>.+?) )?'
+                  r'ORDER BY (?P<order>.+?) LIMIT (?P<limit>\d+)(?: OFFSET (?P<offset>\d+))?$', re.DOTALL)
+COLUMN = re.compile(r'^"(?P<column>[^"]+)"(?: AS "(?P<alias>[^"]+)")?$')
+AGGREGATE = re.compile(r'^(?P<func>SUM|COUNT|MIN|MAX|AVG)\("(?P<column>[^"]+)"\) AS "(?P<alias>[^"]+)"$')
+CONDITION = re.compile(r'^"(?P<column>[^"]+)" (?P<op>NOT IN|IS NOT|IN|IS|>=|<=|!=|=|>|<) (?P<value>.+)$')
+NOW = re.compile(r"^\(+current_timestamp at time zone 'UTC'\)(?: ([+-]) INTERVAL '(\d+) (\w+?)s'\))?$")
+LITERAL = re.compile(r"'(?:[^']|'')*'|[-+]?\d+(?:\.\d+)?")
+FUNCS = {'SUM': 'sum', 'COUNT': 'count', 'MIN': 'min', 'MAX': 'max', 'AVG': 'mean'}
+OPS = {'=': '__eq__', '!=': '__ne__', '<': '__lt__', '<=': '__le__', '>': '__gt__', '>=': '__ge__'}
+
+def _literal(text):
+    if text.startswith("'"):
+        return text[1:-1].replace("''", "'")
+    return float(text) if '.' in text else int(text)
+
+def _value(text):
+    '''
+    A condition value: NULL, the current time (shifted by an interval),
+    a list or a single literal.
+    '''
+    if text == 'NULL':
+        return None
+    now = NOW.match(text)
+    if now is not None:
+        value = pd.Timestamp.utcnow().tz_localize(None)
+        sign, amount, unit = now.groups()
+        if sign is not None:
+            offset = pd.DateOffset(**{f'{unit}s': int(amount)})
+            value = value + offset if sign == '+' else value - offset
+        return value
+    if text.startswith('('):
+        return [_literal(item) for item in LITERAL.findall(text)]
+    return _literal(text)
+
+def _filter(df, where, types):
+    for condition in re.split(r' AND (?=")', where):
+        match = CONDITION.match(condition)
+        if match is None:
+            raise ValueError(f'Unsupported condition: {condition}')
+        column, op, value = match.group('column'), match.group('op'), _value(match.group('value'))
+        values = df[column]
+        if types.get(column) == 'timestamp':
+            values = pd.to_datetime(values)
+            value = [pd.Timestamp(v) for v in value] if isinstance(value, list) else \
+                value if value is None else pd.Timestamp(value)
+        if op in ('IN', 'NOT IN'):
+            mask = values.isin(value)
+            mask = ~mask if op == 'NOT IN' else mask
+        elif op in ('IS', 'IS NOT'):
+            mask = values.isna() if op == 'IS' else values.notna()
+        else:
+            mask = getattr(values, OPS[op])(value)
+        df = df[mask.values]
+    return df
+
+def _order(df, order, limit, offset):
+    if order:
+        keys = [(item.split('"')[1], not item.endswith(' DESC')) for item in order.split(', ')]
+        df = df.sort_values([key for key, _ in keys], ascending=[asc for _, asc in keys], kind='stable')
+    start = int(offset or 0)
+    return df.iloc[start:start + int(limit)] if limit else df.iloc[start:]
+
+def _select(df, select, group, types):
+    '''
+    Projection, aliases and aggregation; returns (df, field types).
+    '''
+    if select == '*':
+        return df, types
+    columns, aggregates = [], []
+    for item in select.split(', '):
+        match = COLUMN.match(item) or AGGREGATE.match(item)
+        if match is None:
+            raise ValueError(f'Unsupported column: {item}')
+        if 'func' in match.groupdict():
+            aggregates.append((match.group('alias'), match.group('column'), FUNCS[match.group('func')]))
+        else:
+            column, alias = match.group('column'), match.group('alias') or match.group('column')
+            # Responses recorded upstream already carry the alias
+            columns.append((column if column in df else alias, alias))
+    if aggregates:
+        by = [column for column, _ in columns]
+        if group is None and by:
+            raise ValueError('Columns next to an aggregate need a GROUP BY')
+        aggs = {f'__{alias}': (column, func) for alias, column, func in aggregates}
+        df = df.groupby(by, sort=False).agg(**aggs).reset_index() if by else \
+            pd.DataFrame({name: [df[column].agg(func)] for name, (column, func) in aggs.items()})
+        df = df.rename(columns={f'__{alias}': alias for alias, _, _ in aggregates})
+        types = dict(types, **{alias: 'int8' if func == 'count' else types.get(column, 'float8')
+                               for alias, column, func in aggregates})
+        df = df[[alias for _, alias in columns] + [alias for alias, _, _ in aggregates]]
+    else:
+        df = df[[column for column, _ in columns]]
+        df.columns = [alias for _, alias in columns]
+    types = dict(types, **{alias: types.get(column, types.get(alias)) for column, alias in columns})
+    return df, {name: types.get(name, 'text') for name in df.columns}
+
+def run_query(frame, types, sql):
+    '''
+    Runs a statement on the rows of a dataset; returns (df, field types).
+    '''
+    page = PAGE.match(sql)
+    if page is not None:
+        df, types = run_query(frame, types, page.group('inner'))
+        if page.group('where'):
+            df = _filter(df, page.group('where'), types)
+        return _order(df, page.group('order'), page.group('limit'), page.group('offset')), types
+    statement = STATEMENT.match(sql.strip())
+    if statement is None:
+        raise ValueError(f'Unsupported statement: {sql}')
+    df = frame
+    if statement.group('where'):
+        df = _filter(df, statement.group('where'), types)
+    df, types = _select(df, statement.group('select'), statement.group('group'), types)
+    return _order(df, statement.group('order'), statement.group('limit'), statement.group('offset')), types
+
+
+# Replay
+class FixtureResponse:
+    def __init__(self, content):
+        self.content = content
+        self.status_code = 200
+
+
+class FixtureTransport:
+    """
+    Stand-in for utils.Transport that answers every query from fixtures:
+    the query is run on the fixture of the dataset named in its FROM clause.
+
+    sizes: dataset -> size argument of its builder, to scale payloads.
+    recorded: replay the responses recorded by benchmarks.record instead;
+        a dataset without a recording raises FileNotFoundError.
+    """
+
+    def __init__(self, sizes=None, recorded=False):
+        self.sizes = sizes or {}
+        self.recorded = recorded
+        self.requests = 0
+        self.queries = {}
+        self._payloads = {}
+        self._frames = {}
+        self._answers = {}
+        self._lock = threading.Lock()
+
+    def resize(self, sizes=None, recorded=False):
+        '''
+        Switches to another payload size, dropping the built payloads.
+        '''
+        with self._lock:
+            self.sizes = sizes or {}
+            self.recorded = recorded
+            self._payloads.clear()
+            self._frames.clear()
+            self._answers.clear()
+
+    def content(self, dataset):
+        '''
+        The whole fixture of a dataset, as raw response bytes.
+        '''
+        with self._lock:
+            if dataset not in self._payloads:
+                if self.recorded:
+                    content = recorded(dataset)
+                else:
+                    builder = BUILDERS[dataset]
+                    args = (self.sizes[dataset],) if dataset in self.sizes else ()
+                    content = payload(builder, *args)
+                self._payloads[dataset] = content
+            return self._payloads[dataset]
+
+    def frame(self, dataset):
+        '''
+        (rows, field types) of the fixture of a dataset.
+        '''
+        content = self.content(dataset)
+        with self._lock:
+            if dataset not in self._frames:
+                result = json.loads(content)['result']
+                columns = [field['id'] for field in result['fields']]
+                self._frames[dataset] = (pd.DataFrame.from_records(result['records'], columns=columns),
+                                         {field['id']: field['type'] for field in result['fields']})
+            return self._frames[dataset]
+
+    def answer(self, sql):
+        '''
+        The response to a query, run on the fixture of its dataset. Answers
+        are kept per statement, so repeated queries cost no more than the
+        request itself.
+        '''
+        with self._lock:
+            if sql in self._answers:
+                return self._answers[sql]
+        df, types = run_query(*self.frame(dataset_of(sql)), sql)
+        records = df.astype(object).where(df.notna(), None).to_dict('records')
+        content = json.dumps(response(records, list(types.items()))).encode('utf-8')
+        with self._lock:
+            self._answers[sql] = content
+        return content
+
+    def get(self, url, **kwargs):
+        sql = kwargs.get('params', {}).get('sql') or unquote_plus(url.split('sql=', 1)[-1])
+        dataset = dataset_of(sql)
+        with self._lock:
+            self.requests += 1
+            self.queries[dataset] = sql
+        return FixtureResponse(self.answer(sql))
+
+    def close(self):
+        pass
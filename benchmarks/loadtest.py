@@ -0,0 +1,354 @@
+# Load Test
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import numpy as np
+import requests
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+'''
+Measures how many open dashboards one worker can serve.
+
+Starts a stand-in of the energidataservice SQL endpoint that answers from
+benchmarks.fixtures, runs index.app in a separate worker process pointed
+at it (ENERGIDATASERVICE_URL), and simulates browser sessions against the
+worker's callback endpoint:
+
+- overview sessions fire the Interval callbacks on every tick,
+- mapview sessions move the month sliders (maps and industry bar),
+- elmarket sessions switch price area and candle size.
+
+Each session waits --think seconds between actions, which stands in for
+the 60 s update interval of a real browser. Reports p50/p95/p99 callback
+latency, callback throughput, upstream requests per second and the RSS
+of the worker.
+
+Run from the repository root:
+    python -m benchmarks.loadtest --sessions 50 --duration 60
+'''
+
+from benchmarks import fixtures
+from benchmarks.suite import SIZES
+
+# Globals
+PAGES = {'overview': 0.5, 'mapview': 0.3, 'elmarket': 0.2}
+PRICE_AREAS = ['DK1', 'DK2']
+BUCKETS = ['day', 'week', 'month']
+SOURCES = ['Total Production', 'Onshore Wind Power', 'Offshore Wind Power', 'Solar Power']
+
+
+# Stand-in Upstream
+class Upstream:
+    """
+    Local HTTP server answering datastore_search_sql from fixtures.
+    """
+
+    def __init__(self, sizes, latency=0):
+        self.transport = fixtures.FixtureTransport(sizes)
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                sql = parse_qs(urlparse(self.path).query).get('sql', [''])[0]
+                time.sleep(upstream.latency)
+                try:
+                    body = upstream.transport.answer(sql)
+                    status = 200
+                except (KeyError, ValueError, AttributeError):
+                    body, status = b'{"success": false}', 400
+                with upstream._lock:
+                    upstream.requests += 1
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='upstream', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+# Worker
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def serve(port):
+    '''
+    Runs index.app in this process, as the worker under test.
+    '''
+    import index
+    index.app.run_server(host='127.0.0.1', port=port, debug=False, threaded=True)
+
+def start_worker(upstream_url, port, cache_dir=None):
+    env = dict(os.environ, ENERGIDATASERVICE_URL=upstream_url,
+               DATA_CACHE_DIR=cache_dir or tempfile.mkdtemp(prefix='loadtest-'))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.Popen([sys.executable, '-W', 'ignore', '-m', 'benchmarks.loadtest', 'serve', str(port)],
+                            cwd=root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def wait_ready(url, worker=None, timeout=120):
+    '''
+    Waits until the worker answers and every page dataset is loaded.
+    '''
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if worker is not None and worker.poll() is not None:
+            raise RuntimeError(f'Worker exited with code {worker.returncode}')
+        try:
+            status = requests.get(f'{url}/status', timeout=2).json()
+            if all(state == 'ready' for state in status['datasets'].values()):
+                return status
+        except (requests.RequestException, ValueError):
+            pass
+        time.sleep(0.5)
+    raise RuntimeError('Worker did not become ready in time')
+
+def rss(pid):
+    '''
+    Resident set size of a process in MB, from /proc (Linux only).
+    '''
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+
+
+# Sessions
+def callback(output, inputs, changed, state=()):
+    '''
+    Body of a Dash callback request. output is 'id.property'; inputs and
+    state are (id, property, value) tuples.
+    '''
+    output_id, output_prop = output.split('.', 1)
+    return {'output': output,
+            'outputs': {'id': output_id, 'property': output_prop},
+            'inputs': [{'id': i, 'property': p, 'value': v} for i, p, v in inputs],
+            'changedPropIds': changed,
+            'state': [{'id': i, 'property': p, 'value': v} for i, p, v in state]}
+
+def overview_tick(n, rng):
+    return [
+        ('prod-graph-1.figure', callback('prod-graph-1.figure',
+            [('prodgraph-update', 'n_intervals', n), ('prod-graph-1', 'relayoutData', None)],
+            ['prodgraph-update.n_intervals'])),
+        ('prod-pie-1.figure', callback('prod-pie-1.figure',
+            [('prodgraph-update', 'n_intervals', n)], ['prodgraph-update.n_intervals'])),
+        ('co2emi-gauge-1.figure', callback('co2emi-gauge-1.figure',
+            [('co2gauge-update', 'n_intervals', n)], ['co2gauge-update.n_intervals'])),
+        ('co2emi-graph-1.figure', callback('co2emi-graph-1.figure',
+            [('co2graph-update', 'n_intervals', n), ('co2emi-graph-1', 'relayoutData', None)],
+            ['co2graph-update.n_intervals'])),
+        ('balance-store.data', callback('balance-store.data',
+            [('balance-update', 'n_intervals', n)], ['balance-update.n_intervals'])),
+    ]
+
+def mapview_slide(n, rng):
+    month = int(rng.integers(0, 12))
+    return [
+        ('mapview-prod-values.data', callback('mapview-prod-values.data',
+            [('crossfilter-sources', 'value', SOURCES[int(rng.integers(len(SOURCES)))]),
+             ('crossfilter-month-prod--slider', 'value', month)],
+            ['crossfilter-month-prod--slider.value'])),
+        ('mapview-cons-values.data', callback('mapview-cons-values.data',
+            [('crossfilter-month-cons--slider', 'value', month)], ['crossfilter-month-cons--slider.value'])),
+        ('industries-bar-chart.figure', callback('industries-bar-chart.figure',
+            [('crossfilter-month-cons--slider', 'value', month), ('mapview-cons', 'clickData', None)],
+            ['crossfilter-month-cons--slider.value'])),
+    ]
+
+def elmarket_switch(n, rng):
+    return [
+        ('candlestick-price.figure', callback('candlestick-price.figure',
+            [('crossfilter-pricearea', 'value', PRICE_AREAS[n % 2]),
+             ('crossfilter-bucket', 'value', BUCKETS[int(rng.integers(len(BUCKETS)))]),
+             ('candlestick-price', 'relayoutData', None)],
+            ['crossfilter-pricearea.value'])),
+    ]
+
+ACTIONS = {'overview': overview_tick, 'mapview': mapview_slide, 'elmarket': elmarket_switch}
+
+def page_request(page):
+    output = '..page-content.children...page-loading.disabled..'
+    body = callback('page-content.children', [('url', 'pathname', f'/pages/{page}'),
+        ('page-loading', 'n_intervals', None)], ['url.pathname'])
+    body['output'] = output
+    body['outputs'] = [{'id': 'page-content', 'property': 'children'},
+                       {'id': 'page-loading', 'property': 'disabled'}]
+    return 'page-content.children', body
+
+
+class Session(threading.Thread):
+    """
+    One simulated browser: opens a page, then repeats its action every
+    think seconds (with jitter) until stopped.
+    """
+
+    def __init__(self, url, page, think, seed, record, stop):
+        super().__init__(daemon=True)
+        self.url = f'{url}/_dash-update-component'
+        self.page = page
+        self.think = think
+        self.rng = np.random.default_rng(seed)
+        self.record = record
+        self.stop = stop
+        self.http = requests.Session()
+
+    def call(self, name, body):
+        start = time.perf_counter()
+        try:
+            ok = self.http.post(self.url, json=body, timeout=60).status_code == 200
+        except requests.RequestException:
+            ok = False
+        self.record(name, time.perf_counter() - start, ok)
+
+    def run(self):
+        # Sessions join at random times within the first think period
+        if self.stop.wait(self.rng.uniform(0, self.think)):
+            return
+        self.call(*page_request(self.page))
+        n = 0
+        while not self.stop.is_set():
+            for name, body in ACTIONS[self.page](n, self.rng):
+                self.call(name, body)
+            n += 1
+            self.stop.wait(self.think * self.rng.uniform(0.8, 1.2))
+
+
+# Report
+class Recorder:
+    def __init__(self):
+        self.calls = []
+        self.measuring = False
+        self._lock = threading.Lock()
+
+    def __call__(self, name, seconds, ok):
+        if self.measuring:
+            with self._lock:
+                self.calls.append((name, seconds, ok))
+
+def percentiles(seconds):
+    p50, p95, p99 = np.percentile(np.asarray(seconds) * 1e3, [50, 95, 99])
+    return {'p50': p50, 'p95': p95, 'p99': p99}
+
+def report(calls, duration, upstream_requests, rss_samples, sessions):
+    latencies = [s for _, s, ok in calls if ok]
+    errors = sum(1 for _, _, ok in calls if not ok)
+    result = {'sessions': sessions, 'duration': duration, 'callbacks': len(calls), 'errors': errors,
+              'throughput': len(calls) / duration, 'upstream_rps': upstream_requests / duration,
+              'rss_mb': {'start': rss_samples[0], 'peak': max(rss_samples), 'end': rss_samples[-1]}
+                        if rss_samples and None not in rss_samples else None,
+              'latency_ms': percentiles(latencies) if latencies else None, 'per_callback': {}}
+    for name in sorted({name for name, _, _ in calls}):
+        seconds = [s for n, s, ok in calls if n == name and ok]
+        if seconds:
+            result['per_callback'][name] = dict(percentiles(seconds), calls=len(seconds))
+    return result
+
+def print_report(result):
+    print(f"\n{result['sessions']} sessions, {result['duration']:.0f} s: "
+          f"{result['callbacks']} callbacks, {result['errors']} errors")
+    if result['latency_ms']:
+        latency = result['latency_ms']
+        print(f"latency      p50 {latency['p50']:.1f} ms  p95 {latency['p95']:.1f} ms  p99 {latency['p99']:.1f} ms")
+    print(f"throughput   {result['throughput']:.1f} callbacks/s")
+    print(f"upstream     {result['upstream_rps']:.2f} requests/s")
+    if result['rss_mb']:
+        rss_mb = result['rss_mb']
+        print(f"worker RSS   {rss_mb['start']:.0f} MB at start, {rss_mb['peak']:.0f} MB peak, "
+              f"{rss_mb['end']:.0f} MB at end")
+    print(f"\n{'callback':<34}{'calls':>7}{'p50':>10}{'p95':>10}{'p99':>10}  ms")
+    for name, stats in result['per_callback'].items():
+        print(f"{name:<34}{stats['calls']:>7}{stats['p50']:>10.1f}{stats['p95']:>10.1f}{stats['p99']:>10.1f}")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['serve']:
+        return serve(int(argv[1]))
+
+    parser = argparse.ArgumentParser(description='Load test of the Dash callbacks of one worker.')
+    parser.add_argument('--sessions', type=int, default=20, help='simulated browser sessions')
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=5, help='unmeasured seconds first')
+    parser.add_argument('--think', type=float, default=2.0, help='seconds between actions of a session')
+    parser.add_argument('--size', default='medium', choices=list(SIZES), help='fixture payload size')
+    parser.add_argument('--upstream-latency', type=float, default=0.1,
+        help='seconds the stand-in endpoint waits before answering')
+    parser.add_argument('--url', help='test a running worker instead of starting one')
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args(argv)
+
+    upstream = Upstream(SIZES[args.size], args.upstream_latency).start()
+    worker = None
+    url = args.url
+    if url is None:
+        port = free_port()
+        url = f'http://127.0.0.1:{port}'
+        worker = start_worker(upstream.url, port)
+    try:
+        wait_ready(url, worker)
+        recorder = Recorder()
+        stop = threading.Event()
+        weights = np.array(list(PAGES.values()))
+        rng = np.random.default_rng(0)
+        pages = rng.choice(list(PAGES), size=args.sessions, p=weights / weights.sum())
+        sessions = [Session(url, page, args.think, seed, recorder, stop) for seed, page in enumerate(pages)]
+        for session in sessions:
+            session.start()
+
+        time.sleep(args.warmup)
+        recorder.measuring = True
+        upstream_start = upstream.requests
+        rss_samples = []
+        start = time.monotonic()
+        while time.monotonic() - start < args.duration:
+            if worker is not None:
+                rss_samples.append(rss(worker.pid))
+            time.sleep(max(0, min(1.0, args.duration - (time.monotonic() - start))))
+        duration = time.monotonic() - start
+        recorder.measuring = False
+        upstream_requests = upstream.requests - upstream_start
+        stop.set()
+        for session in sessions:
+            session.join(timeout=5)
+    finally:
+        if worker is not None:
+            worker.terminate()
+            worker.wait()
+        upstream.stop()
+
+    result = report(recorder.calls, duration, upstream_requests, rss_samples, args.sessions)
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=1)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,47 @@
+# Memory Report
+import time
+
+import schema
+from utils import decode_response
+from benchmarks import fixtures
+
+'''
+Reports the memory held by the DataFrame of every dataset the pages keep
+at module level (live snapshots, stored tables and the industry labels),
+decoded untyped as before schema.py and with the dataset schemas, along
+with the decode time of both.
+
+Run from the repository root:
+    python -m benchmarks.memory
+'''
+
+
+def memory(df):
+    return int(df.memory_usage(deep=True).sum())
+
+def decode(content, dataset, typed):
+    '''
+    (DataFrame, seconds) of a payload decoded with or without its schema.
+    Untyped decoding keeps the internal columns, as the decoder used to.
+    '''
+    schema.TYPED_SCHEMAS = typed
+    start = time.perf_counter()
+    df = decode_response(content, dataset, keep=() if typed else schema.INTERNAL_COLUMNS)
+    return df, time.perf_counter() - start
+
+def main():
+    print(f"{'dataset':<34}{'rows':>8}{'before MB':>11}{'after MB':>10}{'saved':>8}"
+          f"{'before s':>10}{'after s':>9}")
+    totals = [0, 0]
+    for dataset, builder in fixtures.BUILDERS.items():
+        content = fixtures.payload(builder)
+        before, before_time = decode(content, dataset, False)
+        after, after_time = decode(content, dataset, True)
+        totals[0] += memory(before)
+        totals[1] += memory(after)
+        print(f'{dataset:<34}{len(after):>8}{memory(before) / 1e6:>11.2f}{memory(after) / 1e6:>10.2f}'
+              f'{1 - memory(after) / memory(before):>8.0%}{before_time:>10.3f}{after_time:>9.3f}')
+    print(f'\ntotal {totals[0] / 1e6:.2f} MB -> {totals[1] / 1e6:.2f} MB')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# Payload Size Report
+import os
+import json
+import gzip
+import tempfile
+from inspect import unwrap
+
+'''
+Reports the size of every dashboard callback response before and after
+the compact encoding in encoding.py, uncompressed and with the gzip and
+brotli compression applied by the server.
+
+"before" is the callback output with ENCODING_ENABLED off: full precision
+numbers and plain ISO timestamps. "after" is what the callbacks return.
+
+Run from the repository root, with TYPED_ARRAYS=1 to compare typed arrays
+in the stores:
+    python -m benchmarks.payload_sizes
+'''
+
+os.environ.setdefault('DATA_CACHE_DIR', tempfile.mkdtemp(prefix='payload-sizes-'))
+
+import utils
+import encoding
+from figcache import serialize
+from benchmarks import fixtures
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def dumps(value):
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+def sizes(content):
+    compressed = [len(gzip.compress(content, 6))]
+    compressed.append(len(brotli.compress(content, quality=4)) if brotli else None)
+    return [len(content)] + compressed
+
+def kb(size):
+    return f'{size / 1e3:>9.1f}' if size is not None else f"{'-':>9}"
+
+
+def main():
+    utils._default_transport = fixtures.FixtureTransport()
+    import overview, mapview, elmarket
+
+    month = len(mapview.prod.get().months) - 1
+    click = {'points': [{'location': mapview.mun_ids[0]}]}
+    figures = [
+        ('overview.upd_prod_graph', overview.upd_prod_graph, (1, None)),
+        ('overview.prod_pie_graph', overview.prod_pie_graph, (1,)),
+        ('overview.upd_co2_gauge', overview.upd_co2_gauge, (1,)),
+        ('overview.upd_co2_graph', overview.upd_co2_graph, (1, None)),
+        ('mapview.base_map', mapview.base_map, (mapview.PROD_ZOOM, 'Total Production')),
+        ('mapview.update_bar', mapview.update_bar, (month, None)),
+        ('mapview.update_bar (click)', mapview.update_bar, (month, click)),
+        ('elmarket.update_candle (day)', elmarket.update_candle, ('DK1', 'day', None)),
+        ('elmarket.update_candle (week)', elmarket.update_candle, ('DK1', 'week', None)),
+    ]
+    stores = [
+        ('overview.bal_data', overview.bal_data, (1,)),
+        ('mapview.update_prod_map', mapview.update_prod_map, ('Total Production', month)),
+        ('mapview.update_cons_map', mapview.update_cons_map, (month,)),
+    ]
+
+    rows = []
+    for name, callback, args in figures + stores:
+        encoding.ENCODING_ENABLED = False
+        before = serialize(unwrap(callback)(*args))
+        encoding.ENCODING_ENABLED = True
+        rows.append((name, sizes(dumps(before)), sizes(dumps(callback(*args)))))
+
+    print(f"{'callback (kB)':<32}{'before':>9}{'gzip':>9}{'br':>9}{'after':>9}{'gzip':>9}{'br':>9}")
+    for name, before, after in rows:
+        print(f'{name:<32}' + ''.join(kb(size) for size in before + after))
+    total = [sum(row[1][0] for row in rows), sum(row[2][0] for row in rows),
+             sum(row[2][2] or row[2][1] for row in rows)]
+    print(f'\ntotal {total[0] / 1e3:.1f} kB raw -> {total[1] / 1e3:.1f} kB compact '
+          f'-> {total[2] / 1e3:.1f} kB compressed')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# Record Upstream Responses
+import os
+import gzip
+import tempfile
+import threading
+from urllib.parse import unquote_plus
+
+'''
+Records one live datastore_search_sql response per dataset for the
+benchmarks to replay offline. Every dataset of the app is loaded once
+through a transport that saves what energidataservice.dk returns to
+benchmarks/recorded/<dataset>.json.gz.
+
+Run from the repository root (needs network access):
+    python -m benchmarks.record
+'''
+
+os.environ.setdefault('DATA_CACHE_DIR', tempfile.mkdtemp(prefix='record-'))
+
+import utils
+from benchmarks.fixtures import RECORDED_DIR, recorded_path
+
+
+class RecordingTransport:
+    """
+    Wraps a transport and keeps the largest response seen per dataset.
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.responses = {}
+        self._lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        response = self.transport.get(url, **kwargs)
+        sql = kwargs.get('params', {}).get('sql') or unquote_plus(url.split('sql=', 1)[-1])
+        dataset = utils.dataset_of(sql)
+        with self._lock:
+            if len(response.content) > len(self.responses.get(dataset, b'')):
+                self.responses[dataset] = response.content
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+def main():
+    transport = RecordingTransport(utils.default_transport())
+    utils._default_transport = transport
+    import index
+    import datasets
+    from scheduler import scheduler
+
+    for dataset in datasets.registry.values():
+        dataset.get()
+    for dataset in scheduler.datasets.values():
+        dataset.refresh()
+
+    os.makedirs(RECORDED_DIR, exist_ok=True)
+    for dataset, content in sorted(transport.responses.items()):
+        with gzip.open(recorded_path(dataset), 'wb') as f:
+            f.write(content)
+        print(f'{dataset:<34}{len(content) / 1e6:>8.2f} MB  {recorded_path(dataset)}')
+
+if __name__ == '__main__':
+    main()
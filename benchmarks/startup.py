@@ -0,0 +1,146 @@
+# Startup Benchmark
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+import requests
+
+'''
+Measures how fast a dashboard worker starts, for autoscaled replicas and
+worker restarts.
+
+Each run starts index.app in a fresh worker process against the stand-in
+upstream of benchmarks.loadtest and reports, as medians over the runs:
+
+- the startup phases the worker records itself (metrics.startup_report on
+  /status): imports of dash, the app and every page, and the whole
+  import of index,
+- serving: seconds from starting the process until /status answers,
+- ready: seconds until every page dataset is loaded and every live
+  dataset has its first snapshot.
+
+Runs use an empty cache directory (a new host), or with --warm-cache a
+shared one filled by a first, unmeasured run (a worker restart).
+--budget fails the run (exit 1) when the median import of index exceeds
+the given seconds, for use in CI.
+
+--profile instead prints the modules that take longest to import
+(python -X importtime).
+
+Run from the repository root:
+    python -m benchmarks.startup --runs 5 --budget 1.5
+    python -m benchmarks.startup --profile
+'''
+
+from benchmarks.loadtest import Upstream, start_worker, free_port
+from benchmarks.suite import SIZES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Cold Start
+def start_once(upstream, cache_dir=None, timeout=120):
+    '''
+    Starts one worker and returns its timings in seconds.
+    '''
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    start = time.monotonic()
+    worker = start_worker(upstream.url, port, cache_dir)
+    serving = None
+    try:
+        while time.monotonic() - start < timeout:
+            if worker.poll() is not None:
+                raise RuntimeError(f'Worker exited with code {worker.returncode}')
+            try:
+                status = requests.get(f'{url}/status', timeout=2).json()
+            except (requests.RequestException, ValueError):
+                time.sleep(0.02)
+                continue
+            serving = serving or time.monotonic() - start
+            live = status['live']['datasets'].values()
+            if all(state == 'ready' for state in status['datasets'].values()) and \
+                    all(dataset['version'] >= 1 for dataset in live):
+                timings = dict(status['startup'])
+                timings.update(serving=serving, ready=time.monotonic() - start)
+                return timings
+            time.sleep(0.02)
+        raise RuntimeError(f'Worker was not ready after {timeout}s')
+    finally:
+        worker.kill()
+        worker.wait()
+
+def measure(runs=5, warm_cache=False, size='small', latency=0.1):
+    '''
+    Median timings of several worker starts.
+    '''
+    upstream = Upstream(SIZES[size], latency).start()
+    cache_dir = None
+    if warm_cache:
+        cache_dir = tempfile.mkdtemp(prefix='startup-')
+        start_once(upstream, cache_dir)
+    results = [start_once(upstream, cache_dir) for _ in range(runs)]
+    return {phase: statistics.median(result[phase] for result in results if phase in result)
+            for phase in results[0]}
+
+
+# Import Profile
+def profile(top=25):
+    '''
+    Modules of `import index` by cumulative and by own import time.
+    '''
+    env = dict(os.environ, DATA_CACHE_DIR=os.environ.get('DATA_CACHE_DIR', tempfile.mkdtemp(prefix='startup-')),
+               ENERGIDATASERVICE_URL='http://127.0.0.1:9')
+    # A first import fills the bytecode and geometry caches
+    subprocess.run([sys.executable, '-W', 'ignore', '-c', 'import index'], cwd=ROOT, env=env,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = subprocess.run([sys.executable, '-W', 'ignore', '-X', 'importtime', '-c', 'import index'],
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((name.rstrip(), int(own) / 1e6, int(cumulative) / 1e6))
+
+    print(f"{'module (cumulative)':<52}{'s':>8}     {'module (own)':<40}{'s':>8}")
+    by_cumulative = sorted(rows, key=lambda row: -row[2])[:top]
+    by_own = sorted(rows, key=lambda row: -row[1])[:top]
+    for (name, _, cumulative), (own_name, own, _) in zip(by_cumulative, by_own):
+        print(f'{name:<52}{cumulative:>8.3f}     {own_name.strip():<40}{own:>8.3f}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Startup time of a dashboard worker.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--warm-cache', action='store_true',
+                        help='reuse a filled cache directory, as on a worker restart')
+    parser.add_argument('--size', default='small', choices=list(SIZES), help='fixture payload size')
+    parser.add_argument('--upstream-latency', type=float, default=0.1,
+                        help='seconds the stand-in upstream waits before answering')
+    parser.add_argument('--budget', type=float,
+                        help='fail when the median import of index takes longer (seconds)')
+    parser.add_argument('--profile', action='store_true', help='print an import time profile instead')
+    args = parser.parse_args(argv)
+
+    if args.profile:
+        profile()
+        return
+
+    timings = measure(args.runs, args.warm_cache, args.size, args.upstream_latency)
+    print(f"{'phase (median of %d runs)' % args.runs:<32}{'s':>8}")
+    for phase, seconds in timings.items():
+        print(f'{phase:<32}{seconds:>8.3f}')
+
+    if args.budget is not None:
+        spent = timings['import index']
+        if spent > args.budget:
+            print(f'\nimport index took {spent:.3f}s, over the budget of {args.budget:.3f}s')
+            sys.exit(1)
+        print(f'\nimport index took {spent:.3f}s, within the budget of {args.budget:.3f}s')
+
+if __name__ == '__main__':
+    main()
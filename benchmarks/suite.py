@@ -0,0 +1,222 @@
+# Benchmark Suite
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from inspect import unwrap
+
+'''
+Offline benchmarks of the data and figure code paths. Every upstream
+query is run on the fixtures of benchmarks.fixtures at several payload
+sizes (or on the responses recorded by benchmarks.record, which fails
+for datasets that have no recording), so runs need no network and are
+comparable between commits.
+
+Results are written to benchmarks/results/<time>-<commit>.json. Compare a
+run with an earlier one, failing on cases that got slower than the
+threshold:
+    python -m benchmarks.suite
+    python -m benchmarks.suite --compare latest
+    python -m benchmarks.suite --sizes small --repeat 3 --compare benchmarks/results/<file>.json
+'''
+
+os.environ.setdefault('DATA_CACHE_DIR', tempfile.mkdtemp(prefix='benchmarks-'))
+
+import utils
+from ohlc import OHLCEngine, BUCKETS
+from benchmarks import fixtures
+
+# Globals
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+## Size -> dataset -> size argument of its fixture builder
+SIZES = {
+    'small': {
+        'powersystemrightnow': 60,
+        'co2emisprog': 72,
+        'electricitybalancenonv': 24,
+        'elspotprices': 24 * 30,
+        'communityproduction': 3,
+        'consumptionpermunicipalityde35': 3,
+    },
+    'medium': {
+        'powersystemrightnow': 24 * 60,
+        'co2emisprog': 72,
+        'electricitybalancenonv': 24 * 7,
+        'elspotprices': 24 * 365,
+        'communityproduction': 12,
+        'consumptionpermunicipalityde35': 12,
+    },
+    'large': {
+        'powersystemrightnow': 7 * 24 * 60,
+        'co2emisprog': 288,
+        'electricitybalancenonv': 24 * 30,
+        'elspotprices': 2 * 24 * 365,
+        'communityproduction': 24,
+        'consumptionpermunicipalityde35': 24,
+    },
+}
+
+# Timing
+def measure(func, repeat, setup=None):
+    '''
+    Runs func repeat times after one warm-up run and returns the timings
+    in seconds. setup runs untimed before every run.
+    '''
+    timings = []
+    for i in range(repeat + 1):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        if i:
+            timings.append(time.perf_counter() - start)
+    return timings
+
+def summary(timings):
+    return {'min': min(timings), 'median': statistics.median(timings), 'runs': len(timings)}
+
+
+# Cases
+def clear_store():
+    from store import store
+    shutil.rmtree(store.root, ignore_errors=True)
+
+def cases(api, transport):
+    '''
+    (name, func, setup) of every benchmark, for the data currently served
+    by the fixture transport.
+    '''
+    import overview, mapview, elmarket
+
+    for dataset in (overview.rightnow, overview.co2prog, overview.balance, elmarket.prices):
+        dataset.refresh()
+    for dataset in (mapview.indust, mapview.prod, mapview.cons):
+        clear_store()
+        dataset.reload()
+
+    # Every query the pages issued while loading, one per dataset
+    queries = dict(transport.queries)
+    prices = api.fetch(queries['elspotprices'])
+    month = len(mapview.prod.get().months) - 1
+    click = {'points': [{'location': mapview.mun_ids[0]}]}
+
+    def ohlc():
+        for size in BUCKETS:
+            OHLCEngine(size).update(prices)
+
+    items = [(f'sql_to_df {dataset}', lambda query=query: api.fetch(query), None)
+             for dataset, query in sorted(queries.items())]
+    items += [
+        ('ohlc (get_el_prices)', ohlc, None),
+        ('elmarket.load_prices', elmarket.load_prices, clear_store),
+        ('overview.prod_graph', overview.prod_graph, None),
+        ('overview.co2_graph', overview.co2_graph, None),
+        ('overview.bal_data (bal_graph)', lambda: unwrap(overview.bal_data)(1), None),
+        ('elmarket.update_candle', lambda: unwrap(elmarket.update_candle)('DK1', 'day', None), None),
+        ('mapview.load_prod', mapview.load_prod, clear_store),
+        ('mapview.load_cons', mapview.load_cons, clear_store),
+        ('mapview.base_map', lambda: unwrap(mapview.base_map)(mapview.PROD_ZOOM, 'Total Production'), None),
+        ('mapview.update_prod_map', lambda: unwrap(mapview.update_prod_map)('Total Production', month), None),
+        ('mapview.update_cons_map', lambda: unwrap(mapview.update_cons_map)(month), None),
+        ('mapview.update_bar', lambda: unwrap(mapview.update_bar)(month, None), None),
+        ('mapview.update_bar (click)', lambda: unwrap(mapview.update_bar)(month, click), None),
+    ]
+    return items
+
+def run(sizes, repeat):
+    # Installed before the pages and the store create their EnergiAPI
+    transport = fixtures.FixtureTransport()
+    utils._default_transport = transport
+    # Benchmarks measure the work behind a cache miss
+    api = utils.EnergiAPI(transport=transport)
+
+    results = {}
+    for size in sizes:
+        transport.resize(SIZES.get(size), recorded=(size == 'recorded'))
+        results[size] = {}
+        for name, func, setup in cases(api, transport):
+            results[size][name] = summary(measure(func, repeat, setup))
+            print(f"{size:<10}{name:<46}{results[size][name]['median'] * 1e3:>10.1f} ms", flush=True)
+    return results
+
+
+# Results
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, cwd=os.path.dirname(RESULTS_DIR)).stdout.strip() or 'unknown'
+    except OSError:
+        return 'unknown'
+
+def save(results, repeat):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    meta = {'commit': commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'repeat': repeat,
+            'python': platform.python_version(), 'machine': platform.node()}
+    path = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{meta['commit']}.json")
+    with open(path, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=1)
+    return path
+
+def latest(exclude=None):
+    if not os.path.isdir(RESULTS_DIR):
+        return None
+    runs = sorted(os.path.join(RESULTS_DIR, f) for f in os.listdir(RESULTS_DIR) if f.endswith('.json'))
+    runs = [run for run in runs if run != exclude]
+    return runs[-1] if runs else None
+
+def compare(results, baseline_path, threshold):
+    '''
+    Prints the change of every case against a baseline run and returns
+    the cases that got slower by more than threshold (e.g. 0.2 = 20%).
+    '''
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} ({baseline['meta']['commit']})")
+    regressions = []
+    for size, cases_ in results.items():
+        for name, result in cases_.items():
+            before = baseline['results'].get(size, {}).get(name)
+            if before is None:
+                continue
+            change = result['median'] / before['median'] - 1
+            flag = ''
+            if change > threshold:
+                flag = '  SLOWER'
+                regressions.append((size, name, change))
+            print(f"{size:<10}{name:<46}{before['median'] * 1e3:>10.1f}{result['median'] * 1e3:>10.1f} ms"
+                  f"{change:>+9.0%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks of the dashboard data and figure code.')
+    parser.add_argument('--sizes', nargs='+', default=list(SIZES),
+        help='payload sizes to run: small, medium, large or recorded (record them first with benchmarks.record)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--compare', help="results file to compare with, or 'latest'")
+    parser.add_argument('--threshold', type=float, default=0.2,
+        help='relative slowdown reported as a regression')
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.repeat)
+    path = save(results, args.repeat)
+    print(f'\nSaved {path}')
+
+    if args.compare:
+        baseline = latest(exclude=path) if args.compare == 'latest' else args.compare
+        if baseline is None:
+            print('No earlier results to compare with')
+            return 0
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+# Imports
+import numpy as np
+import pandas as pd
+
+
+class Cube:
+    """
+    Dense municipality × category × month array of a measure.
+
+    Built once from a long or wide DataFrame, after which slices for a
+    month, totals and per-municipality series are plain numpy indexing.
+    Cells without any source rows are NaN.
+    """
+
+    def __init__(self, values, municipalities, categories, months):
+        self.values = values
+        self.municipalities = list(municipalities)
+        self.categories = list(categories)
+        self.months = list(months)
+        self._municipality_index = {key: i for i, key in enumerate(self.municipalities)}
+        self._category_index = {key: i for i, key in enumerate(self.categories)}
+
+    @classmethod
+    def from_long(cls, df, municipality, category, month, value, municipalities=None):
+        '''
+        Builds a cube from one row per (municipality, category, month),
+        summing duplicate rows. municipalities fixes the row order and
+        includes municipalities without any data.
+        '''
+        return cls._build(df, municipality, df[category], df[value].to_numpy(dtype='float64'),
+                          month, municipalities)
+
+    @classmethod
+    def from_wide(cls, df, municipality, columns, month, municipalities=None):
+        '''
+        Builds a cube from one row per (municipality, month) with one column
+        per category, e.g. one column per production source.
+        '''
+        n = len(df)
+        category = pd.Series(np.repeat(columns, n))
+        values = df[columns].to_numpy(dtype='float64').T.reshape(-1)
+        stacked = pd.concat([df[[municipality, month]]] * len(columns), ignore_index=True)
+        return cls._build(stacked, municipality, category, values, month, municipalities,
+                          categories=columns)
+
+    @classmethod
+    def _build(cls, df, municipality, category, values, month, municipalities=None, categories=None):
+        months = pd.Index(sorted(df[month].dropna().unique()))
+        if municipalities is None:
+            municipalities = sorted(df[municipality].dropna().unique())
+        if categories is None:
+            categories = sorted(pd.Series(category).dropna().unique())
+
+        mun_idx = pd.Index(municipalities).get_indexer(df[municipality])
+        cat_idx = pd.Index(categories).get_indexer(category)
+        month_idx = months.get_indexer(df[month])
+        keep = (mun_idx >= 0) & (cat_idx >= 0) & (month_idx >= 0) & ~np.isnan(values)
+
+        shape = (len(municipalities), len(categories), len(months))
+        cube = np.zeros(shape)
+        present = np.zeros(shape, dtype=bool)
+        index = (mun_idx[keep], cat_idx[keep], month_idx[keep])
+        np.add.at(cube, index, values[keep])
+        present[index] = True
+        cube[~present] = np.nan
+        return cls(cube, municipalities, categories, months)
+
+    def to_arrays(self):
+        '''
+        The cube as (arrays, metadata), the layout used by shared.arrays.
+        '''
+        meta = {'municipalities': [str(key) for key in self.municipalities],
+                'categories': [str(key) for key in self.categories],
+                'months': [str(key) for key in self.months]}
+        return {'values': self.values}, meta
+
+    @classmethod
+    def from_arrays(cls, arrays, meta):
+        '''
+        Rebuilds a cube from to_arrays() output. The values are used as
+        given, e.g. as a read-only memory map.
+        '''
+        return cls(arrays['values'], meta['municipalities'], meta['categories'], meta['months'])
+
+    def month(self, key):
+        '''
+        Index of a month key, or of the latest month for an index out of range.
+        '''
+        if isinstance(key, str):
+            return self.months.index(key)
+        return key if 0 <= key < len(self.months) else len(self.months) - 1
+
+    def slice(self, category, month):
+        '''
+        Values of one category for every municipality in one month.
+        '''
+        return self.values[:, self._category_index[category], self.month(month)]
+
+    def total(self, month):
+        '''
+        Sum over all categories for every municipality in one month.
+        '''
+        plane = self.values[:, :, self.month(month)]
+        total = np.nansum(plane, axis=1)
+        total[np.isnan(plane).all(axis=1)] = np.nan
+        return total
+
+    def by_category(self, month, municipality=None):
+        '''
+        Sum over all municipalities (or the value of one municipality) for
+        every category in one month.
+        '''
+        if municipality is not None:
+            return self.values[self._municipality_index[municipality], :, self.month(month)]
+        return np.nansum(self.values[:, :, self.month(month)], axis=0)
+
+    def series(self, municipality, category=None):
+        '''
+        Monthly values of one municipality, for one category or summed over all.
+        '''
+        row = self.values[self._municipality_index[municipality]]
+        if category is not None:
+            return row[self._category_index[category]]
+        return np.nansum(row, axis=0)
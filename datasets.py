@@ -0,0 +1,239 @@
+# Imports
+import time
+import logging
+import threading
+import dash_core_components as dcc
+import dash_html_components as html
+from utils import ConcurrentCalls
+import metrics
+
+# Globals
+RETRY_INTERVAL = 30
+
+logger = logging.getLogger(__name__)
+
+# States
+PENDING = 'pending'
+LOADING = 'loading'
+READY = 'ready'
+FAILED = 'failed'
+
+
+class ServedDataset:
+    """
+    Age and refresh failures of a dataset served from memory, shared by
+    LazyDataset and scheduler.LiveDataset. A failed refresh keeps serving
+    the last good value, marked stale, and is retried after at most
+    RETRY_INTERVAL seconds. Subclasses provide loaded_at and stale_after.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.error = None
+        self.failures = 0
+        self.last_failure = None
+        self.retry_at = 0
+
+    @property
+    def age(self):
+        '''
+        Seconds since the value was loaded, or None before the first load.
+        '''
+        loaded_at = self.loaded_at
+        return time.time() - loaded_at if loaded_at else None
+
+    @property
+    def stale(self):
+        '''
+        True while the value is served past a failed refresh or is older
+        than stale_after seconds.
+        '''
+        age = self.age
+        return age is not None and (self.failures > 0 or (self.stale_after is not None and age > self.stale_after))
+
+    @property
+    def last_error(self):
+        return repr(self.error) if self.error is not None else None
+
+    def _succeeded(self):
+        self.error = None
+        self.failures = 0
+
+    def _failed(self, error, retry_after=RETRY_INTERVAL):
+        self.error = error
+        self.failures += 1
+        self.last_failure = time.time()
+        self.retry_at = time.monotonic() + retry_after
+
+
+class LazyDataset(ServedDataset):
+    """
+    A page dataset that is loaded on first use, or ahead of time in a
+    background thread by warm(). Concurrent callers of get() wait for a
+    single load instead of each running the loader.
+
+    With max_age, a loaded dataset older than that is still returned at
+    once while it is reloaded in the background (stale-while-revalidate);
+    a failed reload keeps the last good value.
+    """
+
+    def __init__(self, name, loader, max_age=None):
+        super().__init__(name)
+        self.loader = loader
+        self.max_age = max_age
+        self.state = PENDING
+        self.loaded_at = None
+        self.version = 0
+        self._value = None
+        self._revalidating = False
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    @property
+    def stale_after(self):
+        return self.max_age
+
+    def get(self):
+        '''
+        Returns the dataset, loading it first if needed.
+        '''
+        if self.state != READY:
+            with self._lock:
+                if self.state != READY:
+                    self._load()
+        elif self.max_age is not None and self.age > self.max_age and time.monotonic() >= self.retry_at:
+            self._revalidate()
+        return self._value
+
+    def reload(self):
+        '''
+        Loads the dataset again, e.g. after its source changed.
+        '''
+        with self._lock:
+            self._load()
+        return self._value
+
+    def _load(self):
+        # A reload keeps serving the loaded value, so only a first load shows as loading
+        if self.version == 0:
+            self.state = LOADING
+        start = time.perf_counter()
+        try:
+            value = self.loader()
+        except Exception as e:
+            self._failed(e)
+            if self.version == 0:
+                self.state = FAILED
+            raise
+        self._value = value
+        self._succeeded()
+        self.version += 1
+        self.loaded_at = time.time()
+        self.state = READY
+        logger.info('Loaded %s in %.2fs', self.name, time.perf_counter() - start)
+
+    def _revalidate(self):
+        with self._lock:
+            if self._revalidating:
+                return
+            self._revalidating = True
+        threading.Thread(target=self._reload_stale, name=f'revalidate-{self.name}', daemon=True).start()
+
+    def _reload_stale(self):
+        try:
+            with self._lock:
+                if self.age > self.max_age:
+                    self._load()
+        except Exception as e:
+            logger.warning('Reloading %s failed, serving the data of %.0fs ago: %r', self.name, self.age, e)
+        finally:
+            self._revalidating = False
+
+    def warm(self):
+        '''
+        Starts loading the dataset in a background thread.
+        '''
+        if self.state in (PENDING, FAILED):
+            threading.Thread(target=self._warm, name=f'warm-{self.name}', daemon=True).start()
+
+    def _warm(self):
+        try:
+            self.get()
+        except Exception:
+            logger.exception('Warming %s failed', self.name)
+
+
+registry = {}
+
+def register(name, loader, max_age=None):
+    '''
+    Registers a lazily loaded dataset under a unique name, reloaded in the
+    background once older than max_age seconds.
+    '''
+    dataset = LazyDataset(name, loader, max_age)
+    registry[name] = dataset
+    return dataset
+
+def warm_all(calls=None):
+    '''
+    Starts loading every registered dataset in the background, all at once
+    within the concurrency limit, so warming takes as long as the slowest
+    dataset. Datasets that miss the deadline go on loading on their own.
+    '''
+    pending = [dataset for dataset in registry.values() if dataset.state in (PENDING, FAILED)]
+    threading.Thread(target=_warm_all, args=(pending, calls or ConcurrentCalls()),
+                     name='warm-all', daemon=True).start()
+
+def _warm_all(pending, calls):
+    start = time.perf_counter()
+    results = calls.run([dataset.get for dataset in pending], return_exceptions=True)
+    for dataset, result in zip(pending, results):
+        if isinstance(result, Exception):
+            logger.warning('Warming %s failed: %r', dataset.name, result)
+    metrics.record_startup('warmup', time.perf_counter() - start)
+
+def status():
+    return {name: dataset.state for name, dataset in registry.items()}
+
+
+# Layout
+def loading_layout(*datasets):
+    '''
+    Placeholder shown by a page while its datasets are loading.
+    '''
+    failed = [ds for ds in datasets if ds.state == FAILED]
+    if failed:
+        text = 'Could not load ' + ', '.join(f'{ds.name} ({ds.error})' for ds in failed) + \
+            '. Retrying in the background.'
+        for ds in failed:
+            ds.warm()
+    else:
+        text = 'Loading data: ' + ', '.join(f'{ds.name} ({ds.state})' for ds in datasets) + ' ...'
+    return html.Div(dcc.Markdown(text), className='page-loading',
+        style={'font-size': '1.4rem', 'margin-top': '15px', 'text-align': 'center'})
+
+def age_text(seconds):
+    if seconds < 120:
+        return f'{seconds:.0f} seconds'
+    if seconds < 2 * 3600:
+        return f'{seconds / 60:.0f} minutes'
+    return f'{seconds / 3600:.0f} hours'
+
+def stale_notice(*datasets):
+    '''
+    Age indicator for datasets served stale while they are refreshed, or
+    None while every dataset is current.
+    '''
+    stale = [ds for ds in datasets if ds.stale]
+    if not stale:
+        return None
+    text = 'Showing data from ' + ', '.join(f'{ds.name} ({age_text(ds.age)} old)' for ds in stale)
+    if any(ds.error is not None for ds in stale):
+        text += '. energidataservice.dk is not responding; the data is refreshed once it is back.'
+    else:
+        text += ', refreshing in the background.'
+    return html.Div(dcc.Markdown(text), className='stale-notice',
+        style={'font-size': '1.0rem', 'margin-top': '5px', 'text-align': 'center', 'color': '#ffc107'})
@@ -0,0 +1,102 @@
+# Imports
+import os
+import numpy as np
+import pandas as pd
+
+# Globals
+POINT_BUDGET = int(os.environ.get("POINT_BUDGET", 500))
+## Above a year of day candles, so the default view is never merged
+CANDLE_BUDGET = int(os.environ.get("CANDLE_BUDGET", 400))
+
+
+def lttb(x, y, n):
+    '''
+    Indices of the n points picked by Largest-Triangle-Three-Buckets.
+    x must be increasing. The first and last points are always kept.
+    '''
+    size = len(x)
+    if n >= size or n < 3:
+        return np.arange(size)
+    x = np.asarray(x, dtype='float64')
+    y = np.nan_to_num(np.asarray(y, dtype='float64'))
+
+    every = (size - 2) / (n - 2)
+    bounds = (np.floor(np.arange(n - 1) * every) + 1).astype(int)
+    bounds[-1] = size - 1
+
+    index = np.empty(n, dtype=int)
+    index[0], index[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        start, end = bounds[i], bounds[i + 1]
+        # Average of the next bucket (the last point for the last bucket)
+        next_end = bounds[i + 2] if i + 2 < len(bounds) else size
+        next_x = x[end:next_end].mean()
+        next_y = y[end:next_end].mean()
+        area = np.abs((x[a] - next_x) * (y[start:end] - y[a]) -
+                      (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(area))
+        index[i + 1] = a
+    return index
+
+
+def relayout_window(relayout):
+    '''
+    The (start, end) x-range of a graph's relayoutData after the user zoomed
+    or panned, or None when the graph shows its full range.
+    '''
+    if not relayout or relayout.get('xaxis.autorange'):
+        return None
+    if 'xaxis.range[0]' in relayout and 'xaxis.range[1]' in relayout:
+        return relayout['xaxis.range[0]'], relayout['xaxis.range[1]']
+    if 'xaxis.range' in relayout:
+        return tuple(relayout['xaxis.range'][:2])
+    return None
+
+
+def select(times, y, relayout=None, budget=POINT_BUDGET):
+    '''
+    Row positions to plot for a time series: the whole series reduced to
+    the point budget, plus every row inside the zoomed window (itself
+    reduced to the budget when the window is still too large).
+
+    times: datetime-like Series sorted in increasing order.
+    y: values used to pick the points (e.g. the top of a stack).
+    '''
+    x = pd.to_datetime(times).values.astype('int64')
+    index = lttb(x, y, budget)
+
+    window = relayout_window(relayout)
+    if window is not None:
+        start, end = (pd.Timestamp(bound).value for bound in window)
+        inside = np.flatnonzero((x >= start) & (x <= end))
+        if len(inside):
+            detail = inside[lttb(x[inside], np.asarray(y)[inside], budget)]
+            index = np.union1d(index, detail)
+    return index
+
+
+def candles(df, relayout=None, budget=CANDLE_BUDGET):
+    '''
+    Merges runs of consecutive candles so that at most budget candles are
+    plotted, except inside a zoomed window, which is served at full detail.
+    Merged candles are labelled with the period they cover in a Period
+    column, as their Date is only the start of the first one.
+    '''
+    window = relayout_window(relayout)
+    if window is not None:
+        start, end = (pd.Timestamp(bound) for bound in window)
+        inside = (df['Date'] >= start) & (df['Date'] <= end)
+        if inside.any() and inside.sum() <= budget:
+            return pd.concat([candles(df[df['Date'] < start], None, budget // 2),
+                              df[inside],
+                              candles(df[df['Date'] > end], None, budget // 2)], ignore_index=True)
+    if len(df) <= budget:
+        return df
+    group = np.arange(len(df)) // int(np.ceil(len(df) / budget))
+    merged = df.groupby(group).agg(Date=('Date', 'first'), Open=('Open', 'first'), Close=('Close', 'last'),
+                                   High=('High', 'max'), Low=('Low', 'min'), Last=('Date', 'last'),
+                                   Count=('Date', 'size')).reset_index(drop=True)
+    merged['Period'] = (merged['Count'].astype(str) + ' candles, ' + merged['Date'].dt.strftime('%Y-%m-%d') +
+                        ' to ' + merged['Last'].dt.strftime('%Y-%m-%d'))
+    return merged.drop(columns=['Last', 'Count'])
@@ -1,46 +1,56 @@
 # Imports
-import os
-import dash
 import dash_core_components as dcc
-import dash_bootstrap_components as dbc
 import dash_html_components as html
 from dash.dependencies import Input, Output
 import pandas as pd
 import plotly.graph_objects as go
-from utils import EnergiAPI
+from query import Query
+from store import store
+import datasets
+from figcache import figures
+import downsample
+import metrics
 from app import app, server
-from datetime import datetime
+from scheduler import scheduler
+from ohlc import OHLCEngine, BUCKETS
 from overview import colors
 
 #Globals
-api = EnergiAPI()
+PRICES_INTERVAL = 3600
 
 # Data
-elprices = api.sql_to_df("SELECT * FROM \"elspotprices\" WHERE \"HourUTC\" >= ((current_timestamp at time zone 'UTC') - INTERVAL '1 year')")
+## Candles for every bucket size, updated with new hours on each refresh
+engines = {size: OHLCEngine(size) for size in BUCKETS}
 
-# Cleaning
-def get_el_prices(pricearea):
-    pd.options.mode.chained_assignment = None  # SettingWithCopyWarning option
+## Only the Danish price areas and the EUR price are stored
+prices_query = (Query('elspotprices')
+    .select('HourUTC', 'HourDK', 'PriceArea', 'SpotPriceEUR')
+    .where('PriceArea', 'in', ['DK1', 'DK2']))
 
-    pa = elprices[elprices['PriceArea'] == f'{pricearea}']
-    pa['Day'] = pa['HourDK'].apply(lambda row: datetime.strptime(row[:10], '%Y-%m-%d'))
-    pa = pa.sort_values(by='HourDK')
+def load_prices():
+    # The stored copy is saved a little after the scheduler set the next
+    # refresh due, so a max_age of a full interval would skip every other one
+    elprices = store.refresh('elspotprices', 'HourUTC', pd.DateOffset(years=1), max_age=PRICES_INTERVAL / 2,
+                             query=prices_query)
+    for engine in engines.values():
+        engine.update(elprices)
+        engine.trim(elprices['HourDK'].min())
+    return {(size, pricearea): engine.area(pricearea)
+            for size, engine in engines.items() for pricearea in ['DK1', 'DK2']}
 
-    ls_col = ['Date','Open', 'Close', 'High', 'Low']
-    ls = []
-    for date in pa['Day'].unique():
-        df_ = pa[pa['Day'] == date]
-        ls.append([date, df_['SpotPriceEUR'].iloc[0],df_['SpotPriceEUR'].iloc[-1],df_['SpotPriceEUR'].max(),df_['SpotPriceEUR'].min()])
-    
-    dff = pd.DataFrame(ls, columns=ls_col)
-
-    return dff
-
-dk1_df = get_el_prices('DK1')
-dk2_df = get_el_prices('DK2')
+prices = scheduler.register('elspotprices', load_prices, interval=PRICES_INTERVAL)
 
 
 # Page Layout
+def serve_layout():
+    '''
+    Returns the page, or a loading placeholder until its data is ready.
+    Data served past its refresh comes with its age.
+    '''
+    if not prices.ready:
+        return datasets.loading_layout(prices)
+    return html.Div([datasets.stale_notice(prices), layout])
+
 layout = html.Div([
     html.Div([
         html.Span(dcc.Markdown('Electricity Spot Prices.'), style ={'font-size': '1.4rem', 'margin-top':'15px', 'text-align':'center'}),
@@ -52,6 +62,14 @@ layout = html.Div([
                 value='DK1'
             ),
         ], style={'display': 'inline-block'}),
+
+        html.Div([
+            dcc.RadioItems(
+                id='crossfilter-bucket',
+                options=[{'label': i.capitalize(), 'value': i} for i in BUCKETS],
+                value='day'
+            ),
+        ], style={'display': 'inline-block', 'margin-left': '30px'}),
     ], style={
         'borderBottom': 'thin lightgrey solid',
         'backgroundColor': colors['background'],
@@ -68,30 +86,36 @@ layout = html.Div([
 
 @app.callback(
     Output('candlestick-price','figure'),
-    [Input('crossfilter-pricearea','value')]
+    [Input('crossfilter-pricearea','value'),
+    Input('crossfilter-bucket','value'),
+    Input('candlestick-price','relayoutData')]
 )
-def update_candle(pricearea):
-    if pricearea == 'DK1':
-        df_ = dk1_df
-    elif pricearea == 'DK2':
-        df_ = dk2_df
-    
-    fig = go.Figure(data=[go.Candlestick(x=df_['Date'],
-        open=df_['Open'],
-        high=df_['High'],
-        low=df_['Low'],
-        close=df_['Close'])])
+@metrics.timed()
+@figures.cached(prices)
+def update_candle(pricearea, bucket, relayout):
+    with metrics.phase('transform'):
+        df_ = downsample.candles(prices.get()[(bucket, pricearea)], relayout)
+
+    with metrics.phase('figure'):
+        fig = go.Figure(data=[go.Candlestick(x=df_['Date'],
+            open=df_['Open'],
+            high=df_['High'],
+            low=df_['Low'],
+            close=df_['Close'],
+            # Merged candles name the period they cover
+            hovertext=df_['Period'].fillna('') if 'Period' in df_ else None)])
     
-    fig.update_layout(
-        # Colors
-        plot_bgcolor=colors['plot_background'],
-        paper_bgcolor=colors['background'],
-        font_color=colors['text'],
-        hoverlabel_bgcolor = colors['infobox'],
-        # Graph
-        title="<b>Candlestick Chart of Elspot Prices (€)</b>",
-        xaxis_title="<b>Date</b>",
-        yaxis_title="<b>€ per MWh</b>",
-    )
+        fig.update_layout(
+            # Colors
+            plot_bgcolor=colors['plot_background'],
+            paper_bgcolor=colors['background'],
+            font_color=colors['text'],
+            hoverlabel_bgcolor = colors['infobox'],
+            # Graph
+            title="<b>Candlestick Chart of Elspot Prices (€)</b>",
+            xaxis_title="<b>Date</b>",
+            yaxis_title="<b>€ per MWh</b>",
+            uirevision='candlestick'
+        )
 
     return fig
\ No newline at end of file
@@ -0,0 +1,167 @@
+# Imports
+import os
+import re
+import base64
+import numpy as np
+import pandas as pd
+
+'''
+Compact encoding of the figures and stores sent by callbacks.
+
+Figures go straight to dcc.Graph, so they stay plain plotly JSON: numeric
+arrays are rounded to display precision (five significant digits, but
+never fewer decimals than the hovertemplate shows, or than
+DISPLAY_DECIMALS without one), timestamps lose their zero
+seconds (or their time when all of them are midnight) and evenly spaced
+time axes of scatter and bar traces are replaced by x0 + dx.
+
+Stores are read by the clientside callbacks in assets/. Their numeric
+arrays are rounded lists, or typed arrays ({'dtype': 'f4', 'bdata':
+<base64>}) with TYPED_ARRAYS=1, decoded by
+window.dash_clientside.encoding.decode. Base64 float32 is about a third
+smaller than rounded text uncompressed but compresses worse, so rounded
+lists are the default behind the brotli/gzip compression in app.py.
+'''
+
+# Globals
+ENCODING_ENABLED = os.environ.get("ENCODING_ENABLED", "1") == "1"
+SIGNIFICANT_DIGITS = int(os.environ.get("SIGNIFICANT_DIGITS", 5))
+DISPLAY_DECIMALS = int(os.environ.get("DISPLAY_DECIMALS", 2))
+TYPED_ARRAYS = os.environ.get("TYPED_ARRAYS", "0") == "1"
+
+NUMERIC_KEYS = ['x', 'y', 'z', 'open', 'high', 'low', 'close', 'values']
+EVEN_AXIS_TYPES = ['scatter', 'scattergl', 'bar']
+## A fixed point format of a value in a template, e.g. %{y:.2f}
+FORMAT_PATTERN = re.compile(r'%\{(\w+):[^}]*?\.(\d+)f\}')
+## Trace keys named differently in templates
+TEMPLATE_NAMES = {'values': 'value'}
+
+
+# Numbers
+def decimals(values, significant=SIGNIFICANT_DIGITS, minimum=DISPLAY_DECIMALS):
+    '''
+    Decimals that keep the given number of significant digits for the
+    largest value of an array, and at least the minimum decimals the values
+    are displayed with.
+    '''
+    largest = np.nanmax(np.abs(values)) if np.isfinite(values).any() else 0
+    if largest == 0:
+        return 0
+    return max(minimum, significant - 1 - int(np.floor(np.log10(largest))))
+
+def round_array(values, significant=SIGNIFICANT_DIGITS, minimum=DISPLAY_DECIMALS):
+    '''
+    Rounds a list of numbers (None allowed) to display precision. Lists
+    with anything else, e.g. strings or dates, are returned unchanged.
+    '''
+    if not values or not all(v is None or isinstance(v, (int, float)) and not isinstance(v, bool)
+                             for v in values):
+        return values
+    array = np.array([np.nan if v is None else v for v in values], dtype='float64')
+    rounded = np.round(array, decimals(array, significant, minimum))
+    finite = rounded[~np.isnan(rounded)]
+    if (finite == np.floor(finite)).all():
+        return [None if np.isnan(v) else int(v) for v in rounded]
+    return [None if np.isnan(v) else float(v) for v in rounded]
+
+def display_decimals(trace, key):
+    '''
+    Decimals a trace displays the values of key with, from a fixed point
+    format in its hover or text template, e.g. 2 for '%{y:.2f}', or None.
+    '''
+    places = [int(n) for template in (trace.get('hovertemplate'), trace.get('texttemplate'))
+              if isinstance(template, str)
+              for name, n in FORMAT_PATTERN.findall(template) if name == TEMPLATE_NAMES.get(key, key)]
+    return max(places) if places else None
+
+def typed(values, dtype='f4'):
+    '''
+    Typed array of numbers for the stores read in the browser. Missing
+    values are sent as NaN.
+    '''
+    array = np.asarray(pd.to_numeric(pd.Series(values), errors='coerce'), dtype=f'<{dtype}')
+    return {'dtype': dtype, 'bdata': base64.b64encode(array.tobytes()).decode('ascii')}
+
+def array(values):
+    '''
+    Numeric array for a store, typed or rounded depending on TYPED_ARRAYS.
+    '''
+    values = pd.Series(values, dtype='float64')
+    if ENCODING_ENABLED and TYPED_ARRAYS:
+        return typed(values)
+    values = [None if pd.isna(v) else v for v in values.tolist()]
+    return round_array(values) if ENCODING_ENABLED else values
+
+
+# Time axes
+def compact_times(values):
+    '''
+    Shortens ISO timestamps: '2020-12-15T10:23:00' -> '2020-12-15 10:23',
+    or '2020-12-15' when every timestamp is at midnight. Returns None if
+    the list is not all timestamps.
+    '''
+    if not values or not all(isinstance(v, str) and len(v) >= 10 and v[4:5] == '-' and v[7:8] == '-'
+                             for v in values):
+        return None
+    try:
+        times = pd.to_datetime(pd.Series(values))
+    except (ValueError, TypeError):
+        return None
+    if (times == times.dt.normalize()).all():
+        return times.dt.strftime('%Y-%m-%d').tolist()
+    if (times.dt.second == 0).all() and (times.dt.microsecond == 0).all():
+        return times.dt.strftime('%Y-%m-%d %H:%M').tolist()
+    return times.dt.strftime('%Y-%m-%d %H:%M:%S').tolist()
+
+def even_axis(values):
+    '''
+    (x0, dx in milliseconds) when the timestamps are evenly spaced,
+    otherwise None.
+    '''
+    if not values or len(values) < 3:
+        return None
+    times = pd.to_datetime(pd.Series(values)).values.astype('int64')
+    steps = np.diff(times)
+    if steps[0] <= 0 or (steps != steps[0]).any():
+        return None
+    return compact_times([values[0]])[0], int(steps[0] // 10**6)
+
+def time_axis(values):
+    '''
+    Encoding of a time axis for a store: {'x0', 'dx'} when evenly spaced,
+    otherwise {'x': compact timestamps}.
+    '''
+    values = [str(v) if not isinstance(v, str) else v for v in values]
+    if not ENCODING_ENABLED:
+        return {'x': values}
+    even = even_axis(values)
+    if even is not None:
+        return {'x0': even[0], 'dx': even[1]}
+    return {'x': compact_times(values) or values}
+
+
+# Figures
+def compact_figure(figure, significant=SIGNIFICANT_DIGITS):
+    '''
+    Compacts the traces of a serialized figure in place and returns it.
+    '''
+    if not ENCODING_ENABLED or not isinstance(figure, dict):
+        return figure
+    for trace in figure.get('data', []):
+        for key in NUMERIC_KEYS:
+            values = trace.get(key)
+            if not isinstance(values, list):
+                continue
+            times = compact_times(values)
+            if times is None:
+                minimum = display_decimals(trace, key)
+                trace[key] = round_array(values, significant,
+                                         DISPLAY_DECIMALS if minimum is None else minimum)
+                continue
+            even = even_axis(values) if key == 'x' else None
+            if even is not None and trace.get('type', 'scatter') in EVEN_AXIS_TYPES:
+                del trace['x']
+                trace['x0'], trace['dx'] = even
+            else:
+                trace[key] = times
+    return figure
@@ -0,0 +1,99 @@
+# Imports
+import os
+import json
+import functools
+import threading
+from collections import OrderedDict
+import plotly.io as pio
+from encoding import compact_figure
+import metrics
+
+# Globals
+FIGURE_CACHE_SIZE = int(os.environ.get("FIGURE_CACHE_SIZE", 256))
+
+
+def serialize(figure):
+    '''
+    Converts a figure to the plain JSON structure Dash sends to the browser.
+    Validation, numpy conversion and compaction happen once here instead of
+    on every response.
+    '''
+    if hasattr(figure, 'to_plotly_json'):
+        with metrics.phase('serialize'):
+            return compact_figure(json.loads(pio.to_json(figure, validate=False)))
+    return figure
+
+
+class FigureCache:
+    """
+    LRU cache of serialized callback figures.
+
+    Entries are keyed by the callback, its input values and the version of
+    every dataset the figure is built from. A dataset refresh bumps its
+    version, so stale figures are never served and simply age out.
+    """
+
+    def __init__(self, max_entries=FIGURE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+    def cached(self, *datasets, inputs=True):
+        '''
+        Decorator for figure callbacks.
+
+        datasets: objects with a version attribute (LazyDataset, LiveDataset)
+            that the figure is built from.
+        inputs: True to key on all inputs, False for Interval driven
+            callbacks, whose per-browser tick counter does not change the
+            figure, or the positions of the inputs to key on.
+        '''
+        def decorator(func):
+            name = f'{func.__module__}.{func.__qualname__}'
+
+            @functools.wraps(func)
+            def wrapper(*args):
+                if inputs is True:
+                    keyed = args
+                elif inputs is False:
+                    keyed = None
+                else:
+                    keyed = [args[i] for i in inputs]
+                key = (name, json.dumps(keyed, sort_keys=True, default=str),
+                       tuple(dataset.version for dataset in datasets))
+                value = self.get(key)
+                if value is None:
+                    value = serialize(func(*args))
+                    self.put(key, value)
+                return value
+            return wrapper
+        return decorator
+
+
+figures = FigureCache()
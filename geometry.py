@@ -0,0 +1,265 @@
+# Imports
+import os
+import sys
+import json
+import pickle
+import numpy as np
+from store import CACHE_DIR, host_lock
+
+'''
+Multi-resolution municipality geometry for the map view.
+
+The source GeoJSON is simplified once per level, quantized and regrouped
+into one feature per municipality keyed by its integer lau_1 code, and the
+results are cached as pickle files, which load faster than JSON. Borders
+shared by two municipalities are split into arcs at their junctions and
+every arc is simplified exactly once, so neighbours keep identical borders
+(no gaps or overlaps) at every level. The municipality labels are cached
+on their own, so starting the app loads no geometry at all.
+
+Build all levels ahead of time with:
+    python geometry.py
+'''
+
+# Globals
+SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets', 'geo_municipalities.json')
+
+## Level -> (Douglas-Peucker tolerance in degrees, decimals kept)
+LEVELS = {
+    'low': (0.005, 3),
+    'medium': (0.0015, 4),
+    'high': (0.0003, 5),
+}
+
+## Highest map zoom each level is used for
+ZOOM_LEVELS = [(6.5, 'low'), (8.5, 'medium'), (float('inf'), 'high')]
+
+
+# Simplification
+def douglas_peucker(points, tolerance):
+    '''
+    Indices of the points kept by Douglas-Peucker simplification of an open
+    line. The first and last points are always kept.
+    '''
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = points[start], points[end]
+        segment = points[start + 1:end]
+        ab = b - a
+        length = np.hypot(*ab)
+        if length == 0:
+            dist = np.hypot(*(segment - a).T)
+        else:
+            dist = np.abs(ab[0] * (segment[:, 1] - a[1]) - ab[1] * (segment[:, 0] - a[0])) / length
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            mid = start + 1 + i
+            keep[mid] = True
+            stack.append((start, mid))
+            stack.append((mid, end))
+    return np.flatnonzero(keep)
+
+
+def _key(point):
+    return (round(point[0], 9), round(point[1], 9))
+
+
+def split_arcs(ring, junctions):
+    '''
+    Splits a closed ring into arcs at its junction vertices. A ring without
+    junctions is returned as a single arc from its first vertex.
+    '''
+    ring = ring[:-1] if _key(ring[0]) == _key(ring[-1]) else ring
+    cuts = [i for i, point in enumerate(ring) if _key(point) in junctions]
+    if not cuts:
+        return [ring + [ring[0]]]
+    # Rotate the ring so it starts at a junction
+    ring = ring[cuts[0]:] + ring[:cuts[0]]
+    cuts = [i - cuts[0] for i in cuts] + [len(ring)]
+    ring = ring + [ring[0]]
+    return [ring[start:end + 1] for start, end in zip(cuts, cuts[1:])]
+
+
+def simplify_rings(rings, tolerance):
+    '''
+    Simplifies a list of rings so that arcs shared between rings are
+    simplified identically.
+    '''
+    # A vertex is a junction where the set of rings sharing it changes
+    owners = {}
+    for n, ring in enumerate(rings):
+        for point in ring:
+            owners.setdefault(_key(point), set()).add(n)
+    junctions = set()
+    for ring in rings:
+        for prev, point in zip(ring[-2:-1] + ring[:-1], ring):
+            if owners[_key(prev)] != owners[_key(point)]:
+                junctions.add(_key(prev))
+                junctions.add(_key(point))
+
+    done = {}
+    simplified = []
+    for ring in rings:
+        out = []
+        for arc in split_arcs(ring, junctions):
+            keys = tuple(_key(point) for point in arc)
+            # Shared arcs run in opposite directions in the two rings
+            reverse = keys[::-1] < keys
+            canonical = keys[::-1] if reverse else keys
+            if canonical not in done:
+                points = np.array(canonical)
+                if canonical[0] == canonical[-1]:
+                    # Closed arc, keep the vertex farthest from the start as well
+                    far = int(np.argmax(np.hypot(*(points - points[0]).T)))
+                    first = douglas_peucker(points[:far + 1], tolerance)
+                    second = douglas_peucker(points[far:], tolerance) + far
+                    index = np.concatenate([first, second[1:]])
+                else:
+                    index = douglas_peucker(points, tolerance)
+                done[canonical] = points[index].tolist()
+            part = done[canonical][::-1] if reverse else done[canonical]
+            out.extend(part if not out else part[1:])
+        if len(out) < 4:
+            out = [list(point[:2]) for point in ring]
+        simplified.append(out)
+    return simplified
+
+
+def quantize(ring, decimals):
+    '''
+    Rounds coordinates and drops the consecutive duplicates this creates.
+    '''
+    out = []
+    for x, y in ring:
+        point = [round(x, decimals), round(y, decimals)]
+        if not out or point != out[-1]:
+            out.append(point)
+    return out
+
+
+# Pipeline
+def build(level, source=SOURCE):
+    '''
+    Builds the GeoJSON of one level: one MultiPolygon feature per
+    municipality with the integer lau_1 code as feature id.
+    '''
+    tolerance, decimals = LEVELS[level]
+    with open(source) as j:
+        features = json.load(j)['features']
+
+    rings, owners = [], []
+    for feature in features:
+        for i, ring in enumerate(feature['geometry']['coordinates']):
+            rings.append([point[:2] for point in ring])
+            owners.append((feature, i))
+    simplified = simplify_rings(rings, tolerance)
+
+    municipalities = {}
+    polygon = None
+    for (feature, i), ring in zip(owners, simplified):
+        no = int(feature['properties']['lau_1'])
+        entry = municipalities.setdefault(no, {'type': 'Feature', 'id': no,
+            'properties': {'name': feature['properties']['label_en']},
+            'geometry': {'type': 'MultiPolygon', 'coordinates': []}})
+        ring = quantize(ring, decimals)
+        # The first ring of a source polygon is its exterior, the rest are holes
+        if i == 0:
+            polygon = None
+            if len(ring) >= 4:
+                polygon = [ring]
+                entry['geometry']['coordinates'].append(polygon)
+        elif polygon is not None and len(ring) >= 4:
+            polygon.append(ring)
+
+    return {'type': 'FeatureCollection', 'features': list(municipalities.values())}
+
+
+def path(name):
+    return os.path.join(CACHE_DIR, f'geo_municipalities.{name}.pickle')
+
+
+def _save(name, value):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = f'{path(name)}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path(name))
+    return value
+
+def write(level, source=SOURCE):
+    return _save(level, build(level, source))
+
+
+def build_labels(source=SOURCE):
+    '''
+    Municipality numbers and names in the order of the built features,
+    read from the source without simplifying any geometry.
+    '''
+    with open(source) as j:
+        features = json.load(j)['features']
+    names = {}
+    for feature in features:
+        names.setdefault(int(feature['properties']['lau_1']), feature['properties']['label_en'])
+    return [(str(no), name) for no, name in names.items()]
+
+
+_loaded = {}
+
+def _cached(name, build):
+    '''
+    Returns a cached geometry product, building it once per host if the
+    cached file is missing or older than the source file.
+    '''
+    if name not in _loaded:
+        if not _fresh(name):
+            # One worker builds it, the others wait and read its file
+            with host_lock(f'geometry-{name}'):
+                if not _fresh(name):
+                    _loaded[name] = _save(name, build())
+        if name not in _loaded:
+            with open(path(name), 'rb') as f:
+                _loaded[name] = pickle.load(f)
+    return _loaded[name]
+
+def _fresh(name):
+    cached = path(name)
+    return os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(SOURCE)
+
+
+def load(level):
+    '''
+    Returns the GeoJSON of a level.
+    '''
+    return _cached(level, lambda: build(level))
+
+
+def level_for_zoom(zoom):
+    for max_zoom, level in ZOOM_LEVELS:
+        if zoom <= max_zoom:
+            return level
+
+
+def for_zoom(zoom):
+    '''
+    The smallest geometry that still looks right at a map zoom level.
+    '''
+    return load(level_for_zoom(zoom))
+
+
+def labels():
+    '''
+    Municipality numbers and names, in the order of the features.
+    '''
+    return _cached('labels', build_labels)
+
+
+if __name__ == '__main__':
+    for level in (sys.argv[1:] or LEVELS):
+        size = len(json.dumps(write(level), separators=(',', ':')))
+        print(f'{level:<8}{size / 1e3:>10.0f} kB  {path(level)}')
+    _save('labels', build_labels())
@@ -1,15 +1,34 @@
 # Imports
-import dash
-import dash_core_components as dcc
-import dash_bootstrap_components as dbc
-import dash_html_components as html
-from dash.dependencies import Input, Output
+import time
+import metrics
+started = time.perf_counter()
+
+with metrics.startup('import dash'):
+    import dash
+    import dash_core_components as dcc
+    import dash_bootstrap_components as dbc
+    import dash_html_components as html
+    from dash.dependencies import Input, Output
+    from flask import jsonify
 
 # App Connection
-from app import app
+with metrics.startup('import app'):
+    from app import app, server
 
 # Subpages
-import overview, mapview, elmarket
+with metrics.startup('import overview'):
+    import overview
+with metrics.startup('import mapview'):
+    import mapview
+with metrics.startup('import elmarket'):
+    import elmarket
+import datasets
+import utils
+from scheduler import scheduler
+
+# Page data is loaded in the background, so the server binds right away
+datasets.warm_all()
+scheduler.start()
 
 #
 app.layout = html.Div([
@@ -38,20 +57,42 @@ app.layout = html.Div([
             ], id='tabs', className='row tabs', style={'width':'98%','display':'inline-block'}
         ),
         html.Div(id='page-content', children=[]),
+        dcc.Interval(id='page-loading', interval=1000, disabled=True),
         html.Hr(style={'border':' white'}, className='hr')
 ])
 
-@app.callback(Output('page-content','children'),
-    [Input('url', 'pathname')])
-def display_page(pathname):
+@app.callback([Output('page-content','children'),
+    Output('page-loading', 'disabled')],
+    [Input('url', 'pathname'),
+    Input('page-loading', 'n_intervals')])
+@metrics.timed()
+def display_page(pathname, n_intervals):
     if pathname == '/pages/overview':
-        return overview.layout
+        page = overview.layout
     elif pathname == '/pages/mapview':
-        return mapview.layout
+        page = mapview.serve_layout()
     elif pathname == '/pages/elmarket':
-        return elmarket.layout
+        page = elmarket.serve_layout()
     else:
-        return overview.layout
+        page = overview.layout
+    # Keep polling while the page only shows its loading placeholder
+    loading = getattr(page, 'className', None) == 'page-loading'
+    return page, not loading
+
+@server.route('/status')
+def status():
+    '''
+    Readiness of the page datasets, state of the live data refreshes, of
+    the upstream circuit breaker and of the shared query cache.
+    '''
+    return jsonify({'datasets': datasets.status(), 'live': scheduler.status(),
+                    'upstream': utils.default_breaker.status(), 'query_cache': utils.default_cache.stats(),
+                    'startup': metrics.startup_report()})
+
+## Callback and query timings on /metrics
+metrics.instrument_server(server)
+
+metrics.record_startup('import index', time.perf_counter() - started)
 
 if __name__ == '__main__':
     app.run_server(debug=True)
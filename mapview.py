@@ -1,188 +1,267 @@
 # Imports
+import os
 from app import app
 from utils import EnergiAPI
-import json
+from query import Query
+from store import store
+import datasets
+from figcache import figures
+from cube import Cube
+import shared
+import geometry
+import encoding
+import metrics
 import dash
 import dash_core_components as dcc
 import dash_bootstrap_components as dbc
 import dash_html_components as html
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ClientsideFunction
+import numpy as np
 import pandas as pd
-import plotly.express as px
+import plotly.graph_objects as go
 from overview import colors
 
 # Globals
 api = EnergiAPI()
 
 # Data & Cleaning
-## GEOJSON Data File
-with open('../energy_dashboard/assets/geo_municipalities.json') as j:
-    municipalities = json.load(j)
+## Map Zoom, which also picks the geometry resolution
+PROD_ZOOM = 5.5
+CONS_ZOOM = 6
 
 ## Labels
-ls = []
-for i in range(len(municipalities['features'])):
-    ls.append([value for key, value in municipalities['features'][i]['properties'].items() if key == 'lau_1' or key=='label_en'])
-labels = pd.DataFrame(ls, columns=['MunicipalityNo', 'Municipality']).drop_duplicates().sort_values(by='MunicipalityNo')
-labels = labels.astype(str)
+labels = pd.DataFrame(geometry.labels(), columns=['MunicipalityNo', 'Municipality']).sort_values(by='MunicipalityNo')
 
 ## Mapbox Style Token
-with open('../energy_dashboard/assets/token.txt') as f:
-    token = f.read()
+## From MAPBOX_TOKEN or the untracked assets/token.txt. Without a token the
+## maps fall back to a base map that needs none.
+TOKEN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets', 'token.txt')
+MAPBOX_STYLE = 'mapbox://styles/nbvanting/ckionk34c4y7x17qvx8dusod8'
+FALLBACK_STYLE = 'carto-positron'
+
+def read_token():
+    token = os.environ.get('MAPBOX_TOKEN')
+    if not token and os.path.exists(TOKEN_FILE):
+        with open(TOKEN_FILE) as f:
+            token = f.read()
+    return token.strip() if token and token.strip() else None
+
+token = read_token()
+
+## Municipality order shared by all cubes
+mun_numbers = labels['MunicipalityNo'].tolist()
+mun_names = labels['Municipality'].tolist()
+mun_ids = [int(no) for no in mun_numbers]
+mun_name_by_id = dict(zip(mun_ids, mun_names))
 
 ## Production Data
 prod_sources = ['Total Production', 'Onshore Wind Power', 'Offshore Wind Power', 'Solar Power', 'Central Power Plants', 'Decentral Power Plants']
-df_prod = api.sql_to_df("SELECT * from \"communityproduction\" WHERE \"Month\" > (CURRENT_DATE - INTERVAL '12 month')")
-df_prod.drop(columns=['_full_text', '_id'], inplace=True)
-df_prod.rename(columns={'OnshoreWindPower':'Onshore Wind Power', 'OffshoreWindPower':'Offshore Wind Power', \
-    'SolarPower':'Solar Power', 'CentralPower':'Central Power Plants', 'DecentralPower':'Decentral Power Plants'}, inplace=True)
-df_prod['Month'] = df_prod['Month'].apply(lambda row: row[:7])
-df_prod['MunicipalityNo'] = df_prod['MunicipalityNo'].astype(str)
-df_prod['Total Production'] = df_prod['Central Power Plants'] + df_prod['Onshore Wind Power'] + \
-    df_prod['Offshore Wind Power'] + df_prod['Solar Power'] + df_prod['Decentral Power Plants']
-df_prod['Total Production'] = df_prod['Total Production'].round(2)
-df_prod = df_prod.merge(labels, on='MunicipalityNo', how='outer')
+
+prod_query = (Query('communityproduction')
+    .select('Month', 'MunicipalityNo', 'OnshoreWindPower', 'OffshoreWindPower', 'SolarPower',
+            'CentralPower', 'DecentralPower'))
+
+def build_prod():
+    '''
+    Municipality × production source × month cube.
+    '''
+    df_prod = store.refresh('communityproduction', 'Month', pd.DateOffset(months=12), max_age=12*3600,
+        query=prod_query)
+    df_prod.rename(columns={'OnshoreWindPower':'Onshore Wind Power', 'OffshoreWindPower':'Offshore Wind Power', \
+        'SolarPower':'Solar Power', 'CentralPower':'Central Power Plants', 'DecentralPower':'Decentral Power Plants'}, inplace=True)
+    df_prod['Month'] = pd.to_datetime(df_prod['Month']).dt.strftime('%Y-%m')
+    df_prod['MunicipalityNo'] = df_prod['MunicipalityNo'].astype(str)
+    df_prod['Total Production'] = df_prod['Central Power Plants'] + df_prod['Onshore Wind Power'] + \
+        df_prod['Offshore Wind Power'] + df_prod['Solar Power'] + df_prod['Decentral Power Plants']
+    return Cube.from_wide(df_prod, 'MunicipalityNo', prod_sources, 'Month', municipalities=mun_numbers)
+
+def load_prod():
+    return shared.cube('communityproduction', build_prod, max_age=12*3600)
+
+prod = datasets.register('communityproduction', load_prod, max_age=12*3600)
 
 
 ## Industry Label / Codes
-df_indust = api.sql_to_df("SELECT \"ConsumerType_DE35\" as ind_code, \"DE35_UK\" as ind_label FROM \"industrycodes_de35\"")
-df_indust.rename(columns={'ind_label':'Industry'}, inplace=True)
-industries = df_indust['Industry'].unique().tolist()
+def load_indust():
+    df_indust = api.sql_to_df(Query('industrycodes_de35').select(ind_code='ConsumerType_DE35', ind_label='DE35_UK'))
+    df_indust.rename(columns={'ind_label':'Industry'}, inplace=True)
+    return df_indust
+
+indust = datasets.register('industrycodes_de35', load_indust, max_age=24*3600)
 
 ## Consumption Data with Industries
-df_cons = api.sql_to_df("SELECT * FROM \"consumptionpermunicipalityde35\" WHERE \"Month\" > (CURRENT_DATE - INTERVAL '12 month')")
-df_cons.drop(columns=['_id', '_full_text'], inplace=True)
-df_cons['Month'] = df_cons['Month'].apply(lambda row: row[:7])
-df_cons.rename(columns={'Industrycode_DE35':'ind_code'}, inplace=True)
-df_cons['MunicipalityNo'] = df_cons['MunicipalityNo'].astype(str)
-df_cons['Total Consumption'] = df_cons['TotalCon'] / 1000 # kwh to mwh
-df_cons['Total Consumption'] = df_cons['Total Consumption'].round(2)
-df_cons['Consumption per Measurement Point'] = df_cons['TotalCon'] / df_cons['MeasurementPoints']
-df_cons = df_cons.merge(df_indust, on='ind_code', how='outer')
-df_cons = df_cons.merge(labels, on='MunicipalityNo', how='outer')
-mun_codes = df_cons['ind_code'].astype(str).unique().tolist()
+## Summed per municipality, industry code and month by the datastore
+cons_query = (Query('consumptionpermunicipalityde35')
+    .group_by('Month', 'MunicipalityNo', 'Industrycode_DE35')
+    .agg(TotalCon=('TotalCon', 'sum')))
+
+def build_cons():
+    '''
+    Municipality × industry × month cube of consumption in MWh.
+    '''
+    df_cons = store.refresh('consumptionpermunicipalityde35', 'Month', pd.DateOffset(months=12), max_age=12*3600,
+        query=cons_query)
+    df_cons['Month'] = pd.to_datetime(df_cons['Month']).dt.strftime('%Y-%m')
+    df_cons.rename(columns={'Industrycode_DE35':'ind_code'}, inplace=True)
+    df_cons['MunicipalityNo'] = df_cons['MunicipalityNo'].astype(str)
+    df_cons['Total Consumption'] = df_cons['TotalCon'] / 1000 # kwh to mwh
+    df_cons = df_cons.merge(indust.get(), on='ind_code', how='inner')
+    return Cube.from_long(df_cons, 'MunicipalityNo', 'Industry', 'Month', 'Total Consumption',
+        municipalities=mun_numbers)
+
+def load_cons():
+    return shared.cube('consumptionpermunicipalityde35', build_cons, max_age=12*3600)
+
+cons = datasets.register('consumptionpermunicipalityde35', load_cons, max_age=12*3600)
+
+
+def month_slider(id, cube, width):
+    '''
+    Slider over the months present in a cube, starting at the latest one.
+    '''
+    return html.Div(dcc.Slider(
+        id=id,
+        min=0,
+        max=len(cube.months) - 1,
+        value=len(cube.months) - 1,
+        marks={i: month for i, month in enumerate(cube.months)},
+        step=None
+    ), style={'width': width})
 
 
 # Page Layout
-layout = html.Div([
-    # Production Row
-    html.Div([
-        html.Span(dcc.Markdown('Production divided by each Municipality.'), style ={'font-size': '1.4rem', 'margin-top':'15px', 'text-align':'center'}),
+def serve_layout():
+    '''
+    Returns the page, or a loading placeholder until its data is ready.
+    Data served past its refresh comes with its age.
+    '''
+    if not (prod.ready and cons.ready):
+        return datasets.loading_layout(prod, indust, cons)
+    return html.Div([datasets.stale_notice(prod, indust, cons), page_layout(prod.get(), cons.get())])
+
+def page_layout(prod_cube, cons_cube):
+    return html.Div([
+        # Production Row
+        html.Div([
+            html.Span(dcc.Markdown('Production divided by each Municipality.'), style ={'font-size': '1.4rem', 'margin-top':'15px', 'text-align':'center'}),
+
+            html.Div([
+                dcc.RadioItems(
+                    id='crossfilter-sources',
+                    options=[{'label': i, 'value': i} for i in prod_sources],
+                    value=prod_sources[0]
+                ),
+            ], style={'display': 'inline-block'}),
+        ], style={
+            'borderBottom': 'thin lightgrey solid',
+            'backgroundColor': colors['background'],
+            'padding': '10px 5px'
+        }),
 
         html.Div([
-            dcc.RadioItems(
-                id='crossfilter-sources',
-                options=[{'label': i, 'value': i} for i in prod_sources],
-                value=prod_sources[0]
+            dcc.Graph(
+                id='mapview-prod',
+                figure=base_map(PROD_ZOOM, prod_sources[0])
             ),
-        ], style={'display': 'inline-block'}),
-    ], style={
-        'borderBottom': 'thin lightgrey solid',
-        'backgroundColor': colors['background'],
-        'padding': '10px 5px'
-    }),
-
-    html.Div([
-        dcc.Graph(
-            id='mapview-prod'
-        )
-    ], style={'width': '100%', 'display': 'inline-block'}),
-
-    html.Div(dcc.Slider(
-        id='crossfilter-month-prod--slider',
-        min=1,
-        max=12,
-        value=11,
-        marks={str(month): str(month) for month in df_prod['Month'].unique()},
-        step=None
-    ), style={'width': '100%'}),
+            dcc.Store(id='mapview-prod-values'),
+        ], style={'width': '100%', 'display': 'inline-block'}),
+
+        month_slider('crossfilter-month-prod--slider', prod_cube, '100%'),
 
-    html.Hr(),
-    # Consumption Row
+        html.Hr(),
+        # Consumption Row
     
-    html.Div([
-        html.Span(dcc.Markdown('Consumption divided by each Municipality and Industry.'), style ={'font-size': '1.4rem', 'margin-top':'15px', 'text-align':'center'}),
-    ], style={
-        'borderBottom': 'thin lightgrey solid',
-        'backgroundColor': colors['background'],
-        'padding': '10px 5px'}),
-
-    html.Div([
-
-        dcc.Graph(
-            id='mapview-cons',
-            style={'width':'49vw','height':'100vh'}
-        )
-    ], style={'width': '49%', 'height':'100%', 'display': 'inline-block'}),
-
-    html.Div([
-        dcc.Graph(id='industries-bar-chart', style={'width':'49vw','height':'100vh'}),
-    ], style={'display': 'inline-block', 'width': '49%', 'height':'100%'}),
-
-    html.Div(dcc.Slider(
-        id='crossfilter-month-cons--slider',
-        min=1,
-        max=12,
-        value=11,
-        marks={str(month): str(month) for month in df_cons['Month'].unique()},
-        step=None
-    ), style={'width': '60%'})
-])
+        html.Div([
+            html.Span(dcc.Markdown('Consumption divided by each Municipality and Industry.'), style ={'font-size': '1.4rem', 'margin-top':'15px', 'text-align':'center'}),
+        ], style={
+            'borderBottom': 'thin lightgrey solid',
+            'backgroundColor': colors['background'],
+            'padding': '10px 5px'}),
 
+        html.Div([
 
-# Callbacks
-@app.callback(
-    Output('mapview-prod', 'figure'),
-    [Input('crossfilter-sources', 'value'),
-    Input('crossfilter-month-prod--slider', 'value')]
-)
-def update_prod_map(source, month_value):
+            dcc.Graph(
+                id='mapview-cons',
+                figure=base_map(CONS_ZOOM, 'Total Consumption'),
+                style={'width':'49vw','height':'100vh'}
+            ),
+            dcc.Store(id='mapview-cons-values'),
+        ], style={'width': '49%', 'height':'100%', 'display': 'inline-block'}),
 
-    df_ = df_prod[df_prod['Month'] == f'2020-{month_value}']
-    df_ = df_[['Month', 'Municipality', f'{source}']]
-    fig = px.choropleth_mapbox(df_, geojson=municipalities, locations='Municipality',
-        featureidkey='properties.label_en', color=f'{source}', color_continuous_scale='teal',
-        range_color=(df_[f'{source}'].min(), df_[f'{source}'].max()),
-        center={'lat': 56.087814, 'lon': 11.780559}, zoom=5.5,
-        title='Production per Municipality',
-        labels={f'{source}': f'{source}'})
+        html.Div([
+            dcc.Graph(id='industries-bar-chart', style={'width':'49vw','height':'100vh'}),
+        ], style={'display': 'inline-block', 'width': '49%', 'height':'100%'}),
+
+        month_slider('crossfilter-month-cons--slider', cons_cube, '60%')
+    ])
+
+
+# Maps
+## The geometry is sent once with the page; slider and source changes only
+## ship the value vector, which assets/mapview.js patches into the figure.
+@figures.cached()
+def base_map(zoom, title):
+    '''
+    Choropleth with the municipality geometry and no values yet.
+    '''
+    fig = go.Figure(go.Choroplethmapbox(geojson=geometry.for_zoom(zoom), locations=mun_ids,
+        z=[None] * len(mun_ids), text=mun_names, colorscale='teal',
+        colorbar={'title': {'text': title}},
+        hovertemplate='<b>%{text}</b><br>%{z:.2f}<extra></extra>'))
 
     fig.update_layout(
-        margin={"r":0,"t":0,"l":0,"b":0}, mapbox_style='mapbox://styles/nbvanting/ckionk34c4y7x17qvx8dusod8',
+        margin={"r":0,"t":0,"l":0,"b":0}, mapbox_style=MAPBOX_STYLE if token else FALLBACK_STYLE,
         mapbox_accesstoken=token,
+        mapbox_center={'lat': 56.087814, 'lon': 11.780559}, mapbox_zoom=zoom,
         plot_bgcolor=colors['plot_background'],
         paper_bgcolor=colors['background'],
-        font_color=colors['text'],)
+        font_color=colors['text'],
+        uirevision='mapview')
 
     return fig
 
+def map_values(values, title):
+    '''
+    The part of a map that changes between months and sources.
+    '''
+    present = values[~np.isnan(values)]
+    return {'z': encoding.array(values),
+            'zmin': float(present.min()) if present.size else None,
+            'zmax': float(present.max()) if present.size else None,
+            'title': title}
+
+
+# Callbacks
 @app.callback(
-    Output('mapview-cons', 'figure'),
+    Output('mapview-prod-values', 'data'),
+    [Input('crossfilter-sources', 'value'),
+    Input('crossfilter-month-prod--slider', 'value')]
+)
+@metrics.timed()
+@figures.cached(prod)
+def update_prod_map(source, month_value):
+    return map_values(prod.get().slice(source, month_value), source)
+
+@app.callback(
+    Output('mapview-cons-values', 'data'),
     [Input('crossfilter-month-cons--slider', 'value')]
 )
+@metrics.timed()
+@figures.cached(cons)
 def update_cons_map(month_value):
-
-    df_ = df_cons[df_cons['Month'] == f'2020-{month_value}']
-    df_ = df_.groupby(by=['Municipality']).agg({'Total Consumption': 'sum'}).reset_index()
-
-    fig = px.choropleth_mapbox(df_, geojson=municipalities, locations='Municipality',
-        featureidkey='properties.label_en', color='Total Consumption', color_continuous_scale='teal',
-        range_color=(df_['Total Consumption'].min(), df_['Total Consumption'].max()),
-        center={'lat': 56.087814, 'lon': 11.780559}, zoom=6,
-        title='Consumption per Municipality',
-        labels={'Total Consumption': 'Total Consumption'})
-    
-    fig.update_layout(
-        margin={"r":0,"t":0,"l":0,"b":0}, mapbox_style='mapbox://styles/nbvanting/ckionk34c4y7x17qvx8dusod8',
-        mapbox_accesstoken=token,
-        plot_bgcolor=colors['plot_background'],
-        paper_bgcolor=colors['background'],
-        font_color=colors['text'],)
-
-    return fig
+    return map_values(cons.get().total(month_value), 'Total Consumption')
+
+for graph in ['mapview-prod', 'mapview-cons']:
+    app.clientside_callback(
+        ClientsideFunction(namespace='mapview', function_name='apply_values'),
+        Output(graph, 'figure'),
+        [Input(f'{graph}-values', 'data')],
+        [State(graph, 'figure')]
+    )
 
 def industry_bar(df, title):
-
+    # Imported on first use, it is only needed once a figure is drawn
+    import plotly.express as px
     fig = px.bar(df, x='Industry', y='Total Consumption', barmode='group',
         hover_data=['Industry', 'Total Consumption'],
         color='Total Consumption', 
@@ -201,11 +280,26 @@ def industry_bar(df, title):
 @app.callback(
     Output('industries-bar-chart', 'figure'),
     [Input('crossfilter-month-cons--slider', 'value'),
+    Input('mapview-cons', 'clickData')
     ]
 )
-def update_bar(month_value):
-    df_ = df_cons[df_cons['Month'] == f'2020-{month_value}']
-    df_ = df_.groupby(by=['Industry']).agg({'Total Consumption':'sum'}).reset_index()
-    title = f'<b>Consumption per Industry for 2020-{month_value}</b>'
-
-    return industry_bar(df_, title)
+@metrics.timed()
+@figures.cached(cons)
+def update_bar(month_value, click):
+    with metrics.phase('transform'):
+        cube = cons.get()
+        month = cube.months[cube.month(month_value)]
+        # Drill down into a municipality clicked on the consumption map
+        location = click['points'][0].get('location') if click else None
+        if location in mun_name_by_id:
+            name = mun_name_by_id[location]
+            values = cube.by_category(month_value, str(location))
+            title = f'<b>Consumption per Industry in {name} for {month}</b>'
+        else:
+            values = cube.by_category(month_value)
+            title = f'<b>Consumption per Industry for {month}</b>'
+        df_ = pd.DataFrame({'Industry': cube.categories, 'Total Consumption': values}).dropna()
+        df_['Total Consumption'] = df_['Total Consumption'].round(2)
+
+    with metrics.phase('figure'):
+        return industry_bar(df_, title)
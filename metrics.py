@@ -0,0 +1,287 @@
+# Imports
+import os
+import time
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+
+'''
+Timings of callbacks and upstream queries, exposed in the Prometheus text
+format on /metrics.
+
+Callbacks decorated with @metrics.timed() record their total duration and
+the phases run inside them: network and decode of EnergiAPI queries,
+transform and figure blocks marked with metrics.phase() and figure
+serialization in figcache. With SLOW_CALL_SECONDS set, callbacks and
+queries slower than that are logged together with their SQL.
+
+Startup phases (page imports, warmup) are timed with metrics.startup()
+and reported on /status and as dashboard_startup_seconds.
+'''
+
+# Globals
+SLOW_CALL_SECONDS = float(os.environ.get("SLOW_CALL_SECONDS", 0))
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+ROW_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+BYTE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    """
+    Prometheus style histogram with labels: cumulative bucket counts, sum
+    and count per label combination.
+    """
+
+    def __init__(self, name, help, labelnames, buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            series = sorted((key, list(counts), total, count)
+                            for key, (counts, total, count) in self._series.items())
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for key, counts, total, count in series:
+            labels = [f'{name}="{value}"' for name, value in zip(self.labelnames, key)]
+            for bound, n in zip(self.buckets, counts):
+                le = _labels(labels + ['le="%g"' % bound])
+                lines.append(f'{self.name}_bucket{le} {n}')
+            le = _labels(labels + ['le="+Inf"'])
+            lines.append(f'{self.name}_bucket{le} {count}')
+            lines.append(f'{self.name}_sum{_labels(labels)} {total:.6f}')
+            lines.append(f'{self.name}_count{_labels(labels)} {count}')
+        return '\n'.join(lines)
+
+
+class Gauge:
+    """
+    Prometheus style gauge with labels: the last value set per label
+    combination.
+    """
+
+    def __init__(self, name, help, labelnames):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        for key, value in sorted(self.values().items()):
+            labels = [f'{name}="{v}"' for name, v in zip(self.labelnames, key)]
+            lines.append(f'{self.name}{_labels(labels)} {value:.6f}')
+        return '\n'.join(lines)
+
+
+class Collected:
+    """
+    Prometheus counter or gauge read at scrape time from counters kept
+    elsewhere, e.g. the hits and misses of utils.QueryCache. read returns
+    a number, or label value -> number with labelname.
+    """
+
+    def __init__(self, name, help, type, read, labelname=None):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.read = read
+        self.labelname = labelname
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        values = self.read()
+        if self.labelname is None:
+            lines.append(f'{self.name} {values}')
+        else:
+            for key, value in sorted(values.items()):
+                label = _labels([f'{self.labelname}="{key}"'])
+                lines.append(f'{self.name}{label} {value}')
+        return '\n'.join(lines)
+
+
+def _labels(labels):
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+## Registry
+callback_seconds = Histogram('dashboard_callback_seconds',
+    'Duration of Dash callbacks by phase (total covers the whole call).', ['callback', 'phase'])
+query_seconds = Histogram('dashboard_query_seconds',
+    'Duration of upstream SQL queries by phase.', ['dataset', 'phase'])
+query_rows = Histogram('dashboard_query_rows',
+    'Rows returned by upstream SQL queries.', ['dataset'], ROW_BUCKETS)
+query_bytes = Histogram('dashboard_query_bytes',
+    'Response bytes of upstream SQL queries.', ['dataset'], BYTE_BUCKETS)
+request_seconds = Histogram('dashboard_http_request_seconds',
+    'Duration of HTTP requests to the server.', ['path', 'status'])
+response_bytes = Histogram('dashboard_http_response_bytes',
+    'Uncompressed response bytes of HTTP requests.', ['path'], BYTE_BUCKETS)
+startup_seconds = Gauge('dashboard_startup_seconds',
+    'Duration of the startup phases of this process.', ['phase'])
+
+circuit_state = Gauge('dashboard_upstream_circuit_state',
+    'State of the upstream circuit breaker: 0 closed, 1 half-open, 2 open.', ['upstream'])
+
+registry = [callback_seconds, query_seconds, query_rows, query_bytes, request_seconds, response_bytes,
+            startup_seconds, circuit_state]
+
+def collect(name, help, type, read, labelname=None):
+    '''
+    Adds a metric read at scrape time to /metrics.
+    '''
+    metric = Collected(name, help, type, read, labelname)
+    registry.append(metric)
+    return metric
+
+def render():
+    return '\n'.join(metric.render() for metric in registry) + '\n'
+
+
+# Recording
+_local = threading.local()
+
+def _current():
+    return getattr(_local, 'call', None)
+
+@contextmanager
+def phase(name):
+    '''
+    Times a block as a phase of the callback running in this thread.
+    Outside a timed callback the block runs untimed.
+    '''
+    call = _current()
+    if call is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        call['phases'][name] = call['phases'].get(name, 0) + time.perf_counter() - start
+
+def timed(name=None):
+    '''
+    Decorator recording the duration and phases of a callback.
+    '''
+    def decorator(func):
+        callback = name or f'{func.__module__}.{func.__qualname__}'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            outer = _current()
+            call = _local.call = {'phases': {}, 'queries': []}
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                total = time.perf_counter() - start
+                _local.call = outer
+                callback_seconds.observe(total, callback=callback, phase='total')
+                for phase_name, seconds in call['phases'].items():
+                    callback_seconds.observe(seconds, callback=callback, phase=phase_name)
+                if SLOW_CALL_SECONDS and total >= SLOW_CALL_SECONDS:
+                    phases = ', '.join(f'{k} {v:.3f}s' for k, v in call['phases'].items())
+                    logger.warning('Slow callback %s: %.3fs (%s)%s', callback, total, phases,
+                                   ''.join(f'\n  {sql}' for sql in call['queries']))
+        return wrapper
+    return decorator
+
+def observe_query(dataset, sql, network, decode, rows, size):
+    '''
+    Records an upstream query, also as phases of the current callback.
+    '''
+    query_seconds.observe(network, dataset=dataset, phase='network')
+    query_seconds.observe(decode, dataset=dataset, phase='decode')
+    query_rows.observe(rows, dataset=dataset)
+    query_bytes.observe(size, dataset=dataset)
+    call = _current()
+    if call is not None:
+        call['phases']['network'] = call['phases'].get('network', 0) + network
+        call['phases']['decode'] = call['phases'].get('decode', 0) + decode
+        call['queries'].append(sql)
+    if SLOW_CALL_SECONDS and network + decode >= SLOW_CALL_SECONDS:
+        logger.warning('Slow query on %s: network %.3fs, decode %.3fs, %d rows, %d bytes\n  %s',
+                       dataset, network, decode, rows, size, sql)
+
+
+# Startup
+_startup_order = []
+
+@contextmanager
+def startup(phase):
+    '''
+    Times a startup phase of the process, e.g. importing a page module.
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_startup(phase, time.perf_counter() - start)
+
+def record_startup(phase, seconds):
+    if phase not in _startup_order:
+        _startup_order.append(phase)
+    startup_seconds.set(seconds, phase=phase)
+    logger.info('Startup: %s took %.3fs', phase, seconds)
+
+def startup_report():
+    '''
+    (phase, seconds) of every startup phase, in the order they ran.
+    '''
+    values = startup_seconds.values()
+    return [(phase, round(values[(phase,)], 4)) for phase in _startup_order]
+
+
+# Server
+def instrument_server(server):
+    '''
+    Times every request to a Flask server and adds the /metrics route.
+    '''
+    from flask import Response, g, request
+
+    @server.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @server.after_request
+    def _observe_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            # Route patterns rather than raw paths keep the label set small
+            path = request.url_rule.rule if request.url_rule else 'other'
+            request_seconds.observe(time.perf_counter() - start, path=path, status=response.status_code)
+            if not response.is_streamed:
+                response_bytes.observe(response.calculate_content_length() or 0, path=path)
+        return response
+
+    @server.route('/metrics')
+    def _metrics():
+        return Response(render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,97 @@
+# Imports
+import numpy as np
+import pandas as pd
+from aggregate import RunningAggregate
+
+# Bucket sizes
+BUCKETS = ['day', 'week', 'month']
+
+
+def bucket_start(times, size):
+    '''
+    Returns the start of the day, week (Monday) or month of each timestamp.
+    '''
+    if size == 'day':
+        return times.dt.floor('D')
+    if size == 'week':
+        return times.dt.to_period('W-SUN').dt.start_time
+    if size == 'month':
+        return times.dt.to_period('M').dt.start_time
+    raise ValueError(f'Unknown bucket size: {size}')
+
+
+class OHLCEngine:
+    """
+    Open/High/Low/Close candles of a price series for every price area at
+    once, computed in a single grouped pass.
+
+    update() only folds in the rows of the last bucket seen and newer ones,
+    so feeding it the full (refreshed) price table every hour costs as much
+    as the current bucket, not the whole year.
+    """
+
+    def __init__(self, size='day', time_col='HourDK', price_col='SpotPriceEUR', area_col='PriceArea'):
+        self.size = size
+        self.time_col = time_col
+        self.price_col = price_col
+        self.area_col = area_col
+        self.high_water = None
+        self.aggregate = RunningAggregate([area_col, 'Date'], {
+            'Open': (price_col, 'first'),
+            'Close': (price_col, 'last'),
+            'High': (price_col, 'max'),
+            'Low': (price_col, 'min')})
+
+    def update(self, prices):
+        '''
+        Folds the rows of prices from the last bucket seen on into the
+        candles. That bucket is rebuilt from its rows in prices, as its
+        newest hour may have been only partly published when it was seen
+        (the store fetches that hour again). Returns the number of rows
+        folded in.
+        '''
+        times = pd.to_datetime(prices[self.time_col])
+        if self.high_water is not None:
+            last = bucket_start(pd.Series([self.high_water]), self.size).iloc[0]
+            new = (times >= last).values
+            if not new.any():
+                return 0
+            prices, times = prices[new], times[new]
+            state = self.aggregate.state
+            self.aggregate.state = state[state.index.get_level_values('Date') < last]
+        if prices.empty:
+            return 0
+
+        # Plain keys, as grouping by a categorical adds every unseen combination
+        rows = pd.DataFrame({self.area_col: np.asarray(prices[self.area_col], dtype=object),
+                             self.price_col: prices[self.price_col].values,
+                             'Time': times.values})
+        rows = rows.sort_values(by='Time', kind='mergesort')
+        rows['Date'] = bucket_start(rows['Time'], self.size)
+        self.aggregate.update(rows)
+        self.high_water = rows['Time'].iloc[-1]
+        return len(rows)
+
+    def trim(self, start):
+        '''
+        Drops candles of buckets that end before start, e.g. when they have
+        left the retention window of the price table.
+        '''
+        state = self.aggregate.state
+        if state is not None:
+            first = bucket_start(pd.Series([pd.Timestamp(start)]), self.size).iloc[0]
+            self.aggregate.state = state[state.index.get_level_values('Date') >= first]
+
+    def candles(self):
+        '''
+        Returns all candles with columns PriceArea, Date, Open, Close, High, Low.
+        '''
+        return self.aggregate.result()
+
+    def area(self, pricearea):
+        '''
+        Returns the candles of one price area.
+        '''
+        df = self.candles()
+        df = df[df[self.area_col] == pricearea]
+        return df.drop(columns=[self.area_col]).reset_index(drop=True)
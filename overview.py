@@ -4,17 +4,52 @@ import dash
 import dash_core_components as dcc
 import dash_bootstrap_components as dbc
 import dash_html_components as html
-from dash.dependencies import Input, Output, State
-import pandas as pd
-import plotly.express as px
+from dash.dependencies import Input, Output, State, ClientsideFunction
 import plotly.graph_objects as go
 from app import app, server
 from utils import EnergiAPI
+from query import Query, utc_now
+from scheduler import scheduler
+from figcache import figures, serialize
+import datasets
+import downsample
+import encoding
+import metrics
 
 # Globals
 UPDATE_INTERVAL = os.environ.get("UPDATE_INTERVAL", 60000)
 api = EnergiAPI()
 
+# Live Data
+## Refreshed server-side by the scheduler; callbacks only read the snapshots.
+rightnow_query = (Query('powersystemrightnow')
+    .select('Minutes1DK', 'Minutes1UTC', 'ProductionGe100MW', 'ProductionLt100MW', 'SolarPower',
+            'OffshoreWindPower', 'OnshoreWindPower', 'CO2Emission')
+    .where('Minutes1UTC', '>=', utc_now('-1 day')))
+
+co2prog_query = (Query('co2emisprog')
+    .select('Minutes5UTC', 'Minutes5DK', 'PriceArea', 'CO2Emission')
+    .where('Minutes5UTC', '>=', utc_now())
+    .where('Minutes5UTC', '<', utc_now('+6 hours'))
+    .where('PriceArea', '=', 'DK1')
+    .order_by('Minutes5DK'))
+
+## Only the columns drawn by the balance graph, of both price areas
+balance_query = (Query('electricitybalancenonv')
+    .select('HourDK', 'PriceArea', 'TotalLoad', 'Biomass', 'FossilGas', 'FossilHardCoal', 'FossilOil',
+            'HydroPower', 'OtherRenewable', 'SolarPower', 'Waste', 'OnshoreWindPower', 'OffshoreWindPower')
+    .where('HourUTC', '>=', utc_now('-7 days'))
+    .order_by('HourDK'))
+
+rightnow = scheduler.register('powersystemrightnow', lambda: api.fetch(rightnow_query),
+    interval=int(UPDATE_INTERVAL) / 1000, shared=True)
+
+co2prog = scheduler.register('co2emisprog', lambda: api.fetch(co2prog_query),
+    interval=int(UPDATE_INTERVAL) * 5 / 1000, shared=True)
+
+balance = scheduler.register('electricitybalancenonv', lambda: api.fetch(balance_query),
+    interval=15 * 60, shared=True)
+
 # Styling
 colors = {
     'background': '#303030',
@@ -31,122 +66,140 @@ colors = {
 # Graphing
 
 ## Production Sources Graph
-def prod_graph():
+def prod_graph(relayout=None):
     '''
     Generates the Production and Sources Graph.
+    The area chart is downsampled to the point budget, except inside the
+    window the user zoomed into (relayout).
     '''
 
-    df = api.sql_to_df("SELECT \"Minutes1DK\", \"Minutes1UTC\", \"ProductionGe100MW\", \"ProductionLt100MW\", \"SolarPower\", \"OffshoreWindPower\", \"OnshoreWindPower\" FROM \"powersystemrightnow\" WHERE \"Minutes1UTC\" >= ((current_timestamp at time zone 'UTC') - INTERVAL '1 day')")
-
-    hovertemp = '<b>Production: </b> %{y:.2f} MWh/h'+'<br>'+'<b>Time: </b> %{x}'
-
-    x = df['Minutes1DK']
-    df['ProductionPlant'] = df['ProductionGe100MW'] + df['ProductionLt100MW']
-
-    fig = px.area(df, x=x, y=df['ProductionPlant'])
-    fig.update_traces(name='Power Stations', line=dict(color=colors['fossil']), stackgroup='one',
-        hoverinfo='y+x', hovertemplate=hovertemp)
-
-    fig.add_scatter(x=x, y=df['SolarPower'], mode='lines', line=dict(color=colors['solar']),
-        showlegend=False, name='Solar Power', stackgroup='one',
-        hoverinfo='y+x', hovertemplate=hovertemp)
-
-    fig.add_scatter(x=x, y=df['OffshoreWindPower'], mode='lines', line=dict(color=colors['offshore']),
-        showlegend=False, name='Offshore Wind Power', stackgroup='one',
-        hoverinfo='y+x', hovertemplate=hovertemp)
-
-    fig.add_scatter(x=x, y=df['OnshoreWindPower'], mode='lines', line=dict(color=colors['onshore']),
-        showlegend=False, name='Onshore Wind Power', stackgroup='one',
-        hoverinfo='y+x', hovertemplate=hovertemp)
-
-    # Top level layout
-    fig.update_layout(
-        # Colors
-        plot_bgcolor=colors['plot_background'],
-        paper_bgcolor=colors['background'],
-        font_color=colors['text'],
-        hoverlabel_bgcolor = colors['infobox'],
-        # Graph
-        title="<b>Current Production with the Sources of Electricity</b>",
-        xaxis_title="<b>Time</b>",
-        yaxis_title="<b>Production</b> (MWh/h)",
-        hovermode = 'x unified'
-    )
+    with metrics.phase('transform'):
+        df = rightnow.get()
+
+        hovertemp = '<b>Production: </b> %{y:.2f} MWh/h'+'<br>'+'<b>Time: </b> %{x}'
+
+        df['ProductionPlant'] = df['ProductionGe100MW'] + df['ProductionLt100MW']
+        full = df
+        df = df.sort_values(by='Minutes1DK')
+        stack = df['ProductionPlant'] + df['SolarPower'] + df['OffshoreWindPower'] + df['OnshoreWindPower']
+        df = df.iloc[downsample.select(df['Minutes1DK'], stack, relayout)]
+        x = df['Minutes1DK']
+
+    with metrics.phase('figure'):
+        # Imported on first use, it is only needed once a figure is drawn
+        import plotly.express as px
+        fig = px.area(df, x=x, y=df['ProductionPlant'])
+        fig.update_traces(name='Power Stations', line=dict(color=colors['fossil']), stackgroup='one',
+            hoverinfo='y+x', hovertemplate=hovertemp)
+
+        fig.add_scatter(x=x, y=df['SolarPower'], mode='lines', line=dict(color=colors['solar']),
+            showlegend=False, name='Solar Power', stackgroup='one',
+            hoverinfo='y+x', hovertemplate=hovertemp)
+
+        fig.add_scatter(x=x, y=df['OffshoreWindPower'], mode='lines', line=dict(color=colors['offshore']),
+            showlegend=False, name='Offshore Wind Power', stackgroup='one',
+            hoverinfo='y+x', hovertemplate=hovertemp)
+
+        fig.add_scatter(x=x, y=df['OnshoreWindPower'], mode='lines', line=dict(color=colors['onshore']),
+            showlegend=False, name='Onshore Wind Power', stackgroup='one',
+            hoverinfo='y+x', hovertemplate=hovertemp)
+
+        # Top level layout
+        fig.update_layout(
+            # Colors
+            plot_bgcolor=colors['plot_background'],
+            paper_bgcolor=colors['background'],
+            font_color=colors['text'],
+            hoverlabel_bgcolor = colors['infobox'],
+            # Graph
+            title="<b>Current Production with the Sources of Electricity</b>",
+            xaxis_title="<b>Time</b>",
+            yaxis_title="<b>Production</b> (MWh/h)",
+            hovermode = 'x unified',
+            uirevision='prod-graph'
+        )
 
-    # Pie Chart
-    values = [df['ProductionPlant'].mean(), df['SolarPower'].mean(),
-        df['OffshoreWindPower'].mean(), df['OnshoreWindPower'].mean()]
-    names = ['Power Stations', 'Solar Power', 'Offshore Wind Power', 'Onshore Wind Power']
-    pie = px.pie(values=values, names=names, color=names, hole=0.3,
-        color_discrete_map={'Power Stations': colors['fossil'],
-                            'Solar Power': colors['solar'],
-                            'Offshore Wind Power': colors['offshore'],
-                            'Onshore Wind Power': colors['onshore']})
-
-    pie.update_traces(hoverinfo='label+percent',
-    hovertemplate='<b>%{label}: </b> %{value:.2f} MWh/h', textposition='inside', 
-        textinfo='percent+label', showlegend=False)
-    pie.update_layout(
-        # Colors
-        plot_bgcolor=colors['plot_background'],
-        paper_bgcolor=colors['background'],
-        font_color=colors['text'],
-        hoverlabel_bgcolor = colors['infobox'],
-        # Graph
-        title='<b>Proportion of Average Production the last 24 hours</b>'
-    )
+        # Pie Chart
+        values = [full['ProductionPlant'].mean(), full['SolarPower'].mean(),
+            full['OffshoreWindPower'].mean(), full['OnshoreWindPower'].mean()]
+        names = ['Power Stations', 'Solar Power', 'Offshore Wind Power', 'Onshore Wind Power']
+        pie = px.pie(values=values, names=names, color=names, hole=0.3,
+            color_discrete_map={'Power Stations': colors['fossil'],
+                                'Solar Power': colors['solar'],
+                                'Offshore Wind Power': colors['offshore'],
+                                'Onshore Wind Power': colors['onshore']})
+
+        pie.update_traces(hoverinfo='label+percent',
+        hovertemplate='<b>%{label}: </b> %{value:.2f} MWh/h', textposition='inside', 
+            textinfo='percent+label', showlegend=False)
+        pie.update_layout(
+            # Colors
+            plot_bgcolor=colors['plot_background'],
+            paper_bgcolor=colors['background'],
+            font_color=colors['text'],
+            hoverlabel_bgcolor = colors['infobox'],
+            # Graph
+            title='<b>Proportion of Average Production the last 24 hours</b>'
+        )
 
     return fig, pie
 
 ## CO2 Emission Figure
-def co2_graph():
+def co2_graph(relayout=None):
     '''
     Generates the CO2 Emission and Prognosis Graph.
+    The actual emission is downsampled like the production graph.
     '''
-    act_df = api.sql_to_df("SELECT \"Minutes1DK\", \"Minutes1UTC\", \"CO2Emission\" FROM \"powersystemrightnow\" WHERE \"Minutes1UTC\" >= ((current_timestamp at time zone 'UTC') - INTERVAL '1 day')")
-
-    prog_df = api.sql_to_df("SELECT \"Minutes5UTC\", \"Minutes5DK\", \"PriceArea\", \"CO2Emission\" FROM \"co2emisprog\" WHERE \"Minutes5UTC\" >= (current_timestamp at time zone 'UTC') AND \"Minutes5UTC\" < ((current_timestamp at time zone 'UTC') %2B INTERVAL '6 hours') AND \"PriceArea\" = 'DK1' ORDER BY \"Minutes5DK\" ")
-
-    hovertemp = '<b>CO2 Emission: </b> %{y:.2f} g/kWh'+'<br>'+'<b>Time: </b> %{x}'
-
-    co2_fig = px.line(act_df, x='Minutes1DK', y='CO2Emission')
-    co2_fig.update_traces(name='Actual', hoverinfo='y+x', hovertemplate=hovertemp)
-
-    co2_fig.add_scatter(x=prog_df['Minutes5DK'], y=prog_df['CO2Emission'],
-        mode='lines', showlegend=False, name='Prognosis',
-        hoverinfo='y+x', hovertemplate=hovertemp)
-
-    co2_fig.update_layout(
-        # Colors
-        plot_bgcolor=colors['plot_background'],
-        paper_bgcolor=colors['background'],
-        font_color=colors['text'],
-        # Graph
-        title="<b> Current CO2 Emission from Production including a forecast for the next 9 hours </b>",
-        xaxis_title="<b>Time</b>",
-        yaxis_title="<b>CO2 Emission</b> (g/kWh)",
-        hovermode = 'x unified',
-        hoverlabel_bgcolor = colors['infobox'])
-
-    # CO2 Emission Gauge
-    gauge = go.Figure(go.Indicator(
-        value = act_df['CO2Emission'].iloc[0],
-        delta = {'reference': act_df['CO2Emission'].iloc[1],
-            'increasing': {'color': 'red'}, 'decreasing': {'color': 'green'}},
-        mode = 'gauge+number+delta',
-        title = {'text': '<b>CO2 Emission Intensity from Production (g/kWh)</b>'},
-        gauge = {'axis': {'range': [None, 300]},
-                'steps': [
-                    {'range': [0, 150], 'color': 'green'},
-                    {'range': [150, 225], 'color': 'orange'},
-                    {'range': [225, 300], 'color': 'red'}],
-                'bar': {'color': 'royalblue'},
-                }
-    ))
-    gauge.update_layout(
-        paper_bgcolor=colors['background'],
-        font_color=colors['text']
-    )
+    with metrics.phase('transform'):
+        act_df = rightnow.get()
+        prog_df = co2prog.get()
+
+        hovertemp = '<b>CO2 Emission: </b> %{y:.2f} g/kWh'+'<br>'+'<b>Time: </b> %{x}'
+
+        line_df = act_df.sort_values(by='Minutes1DK')
+        line_df = line_df.iloc[downsample.select(line_df['Minutes1DK'], line_df['CO2Emission'], relayout)]
+
+    with metrics.phase('figure'):
+        import plotly.express as px
+        co2_fig = px.line(line_df, x='Minutes1DK', y='CO2Emission')
+        co2_fig.update_traces(name='Actual', hoverinfo='y+x', hovertemplate=hovertemp)
+
+        co2_fig.add_scatter(x=prog_df['Minutes5DK'], y=prog_df['CO2Emission'],
+            mode='lines', showlegend=False, name='Prognosis',
+            hoverinfo='y+x', hovertemplate=hovertemp)
+
+        co2_fig.update_layout(
+            # Colors
+            plot_bgcolor=colors['plot_background'],
+            paper_bgcolor=colors['background'],
+            font_color=colors['text'],
+            # Graph
+            title="<b> Current CO2 Emission from Production including a forecast for the next 9 hours </b>",
+            xaxis_title="<b>Time</b>",
+            yaxis_title="<b>CO2 Emission</b> (g/kWh)",
+            hovermode = 'x unified',
+            hoverlabel_bgcolor = colors['infobox'],
+            uirevision='co2-graph')
+
+        # CO2 Emission Gauge
+        gauge = go.Figure(go.Indicator(
+            value = act_df['CO2Emission'].iloc[0],
+            delta = {'reference': act_df['CO2Emission'].iloc[1],
+                'increasing': {'color': 'red'}, 'decreasing': {'color': 'green'}},
+            mode = 'gauge+number+delta',
+            title = {'text': '<b>CO2 Emission Intensity from Production (g/kWh)</b>'},
+            gauge = {'axis': {'range': [None, 300]},
+                    'steps': [
+                        {'range': [0, 150], 'color': 'green'},
+                        {'range': [150, 225], 'color': 'orange'},
+                        {'range': [225, 300], 'color': 'red'}],
+                    'bar': {'color': 'royalblue'},
+                    }
+        ))
+        gauge.update_layout(
+            paper_bgcolor=colors['background'],
+            font_color=colors['text']
+        )
 
     return co2_fig, gauge
 
@@ -177,6 +230,7 @@ def popover_desc(btn):
 # Layout
 layout = html.Div(
     [
+        html.Div(id='stale-notice'),
         html.Div(
             [
                 # Energy Balance
@@ -210,6 +264,12 @@ layout = html.Div(
                                 dcc.Graph(
                                     id='bal-graph-1'
                                 ),
+                                dcc.Store(id='balance-store'),
+                                dcc.Interval(
+                                    id='balance-update',
+                                    interval=int(balance.interval * 1000),
+                                    n_intervals=0,
+                                ),
                             ], style={'width': '100%', 'display': 'inline-block'}
                         ),                       
                     ]
@@ -268,19 +328,33 @@ layout = html.Div(
     ]
 )
 
+# Data Age
+@app.callback(
+    Output('stale-notice', 'children'),
+    [Input('prodgraph-update', 'n_intervals')]
+)
+@metrics.timed()
+def upd_stale_notice(interval):
+    return datasets.stale_notice(rightnow, co2prog, balance)
+
 # Production Row
 @app.callback(
     Output("prod-graph-1", "figure"),
-    [Input("prodgraph-update", "n_intervals")]
+    [Input("prodgraph-update", "n_intervals"),
+    Input("prod-graph-1", "relayoutData")]
 )
-def upd_prod_graph(interval):
-    fig, _ = prod_graph()
+@metrics.timed()
+@figures.cached(rightnow, inputs=[1])
+def upd_prod_graph(interval, relayout):
+    fig, _ = prod_graph(relayout)
     return fig
 
 @app.callback(
     Output("prod-pie-1", 'figure'),
     [Input("prodgraph-update", "n_intervals")]
 )
+@metrics.timed()
+@figures.cached(rightnow, inputs=False)
 def prod_pie_graph(interval):
     _, pie = prod_graph()
     return pie
@@ -290,71 +364,51 @@ def prod_pie_graph(interval):
     Output('co2emi-gauge-1', 'figure'),
     [Input('co2gauge-update', 'n_intervals')]
 )
+@metrics.timed()
+@figures.cached(rightnow, co2prog, inputs=False)
 def upd_co2_gauge(interval):
     _, gauge = co2_graph()
     return gauge
 
 @app.callback(
     Output("co2emi-graph-1", "figure"),
-    [Input("co2graph-update", "n_intervals")]
+    [Input("co2graph-update", "n_intervals"),
+    Input("co2emi-graph-1", "relayoutData")]
 )
-def upd_co2_graph(interval):
-    fig, _ = co2_graph()
+@metrics.timed()
+@figures.cached(rightnow, co2prog, inputs=[1])
+def upd_co2_graph(interval, relayout):
+    fig, _ = co2_graph(relayout)
     return fig
 
 # Energy Balance Row
-@app.callback(
-    Output("bal-graph-1", "figure"),
-    [Input('pricearea-dropdown', 'value')]
-)
-def bal_graph(pricearea):
+## Trace name, source column and colour of the balance graph, in stacking order
+balance_traces = [
+    ('Other Renewables', 'Other Renewables', '#00f28d'),
+    ('Fossil Fuel', 'Fossil Fuel', colors['fossil']),
+    ('Solar Power', 'SolarPower', colors['solar']),
+    ('Onshore Wind Power', 'OnshoreWindPower', colors['onshore']),
+    ('Offshore Wind Power', 'OffshoreWindPower', colors['offshore']),
+    ('Waste Fuel', 'Waste', '#072e1e'),
+    ('Total Consumption', 'TotalLoad', '#f29100'),
+]
+
+def bal_template():
     '''
-    Generates the Balance between Consumption and Production Graph.
+    The Balance between Consumption and Production Graph without data.
+    assets/overview.js fills in the series of the selected price area.
     '''
-    pd.options.mode.chained_assignment = None  # SettingWithCopyWarning option
-
-    data = api.sql_to_df("SELECT * FROM \"electricitybalancenonv\" WHERE \"HourUTC\" >= ((current_timestamp at time zone 'UTC') - INTERVAL '7 day') ")
-    data = data.fillna(0)
-
-    if pricearea == 'DK1':
-        df = data[data['PriceArea'] == 'DK1']
-        x = df['HourDK']
-    elif pricearea == 'DK2':
-        df = data[data['PriceArea'] == 'DK2']
-        x = df['HourDK']
-    else:
-        df = data
-        df['HourDK'] = pd.to_datetime(df['HourDK'])
-        df = df.resample('60 min', on='HourDK').sum()
-        x = df.index
-
     hovertemp = '%{y:.2f} MWh/h'+'<br>'+'<b>Time: </b> %{x}'
-    
-    df['Fossil Fuel'] = df['FossilGas'] + df['FossilHardCoal'] + df['FossilOil']
-    df['Other Renewables'] = df['OtherRenewable'] + df['HydroPower'] + df['Biomass']
-
-    fig = px.bar(df, x=x, y='Other Renewables')
-    fig.update_traces(name='Other Renewables', marker=dict(color='#00f28d'),
-        hoverinfo='y+x', hovertemplate=hovertemp)
-    fig.add_bar(x=x, y=df['Fossil Fuel'], marker=dict(color=colors['fossil']),
-        showlegend=True, name='Fossil Fuel',
-        hoverinfo='y+x', hovertemplate=hovertemp)
-    fig.add_bar(x=x, y=df['SolarPower'], marker=dict(color=colors['solar']),
-        showlegend=True, name='Solar Power',
-        hoverinfo='y+x', hovertemplate=hovertemp)    
-    fig.add_bar(x=x, y=df['OnshoreWindPower'], marker=dict(color=colors['onshore']),
-        showlegend=True, name='Onshore Wind Power',
-        hoverinfo='y+x', hovertemplate=hovertemp)
-    fig.add_bar(x=x, y=df['OffshoreWindPower'], marker=dict(color=colors['offshore']),
-        showlegend=True, name='Offshore Wind Power',
-        hoverinfo='y+x', hovertemplate=hovertemp)
-    fig.add_bar(x=x, y=df['Waste'], marker=dict(color='#072e1e'),
-        showlegend=True, name='Waste Fuel',
-        hoverinfo='y+x', hovertemplate=hovertemp)
-
-    fig.add_scatter(x=x, y=df['TotalLoad'], mode='markers+lines', line=dict(color='#f29100'),
-        showlegend=True, name='Total Consumption', hovertemplate=hovertemp)
-    
+
+    fig = go.Figure()
+    for name, _, color in balance_traces[:-1]:
+        fig.add_bar(marker=dict(color=color),
+            showlegend=True, name=name,
+            hoverinfo='y+x', hovertemplate=hovertemp)
+    name, _, color = balance_traces[-1]
+    fig.add_scatter(mode='markers+lines', line=dict(color=color),
+        showlegend=True, name=name, hovertemplate=hovertemp)
+
     fig.update_layout(
         # Colors
         plot_bgcolor=colors['plot_background'],
@@ -365,11 +419,46 @@ def bal_graph(pricearea):
         title="<b>Energy Balance between Production and Consumption (excl. Exchanges)</b>",
         xaxis_title="<b>Time</b>",
         yaxis_title="<b>MWh/h</b>",
-        hovermode='x unified'
+        hovermode='x unified',
+        barmode='relative'
     )
 
     return fig
 
+@app.callback(
+    Output('balance-store', 'data'),
+    [Input('balance-update', 'n_intervals')]
+)
+@metrics.timed()
+@figures.cached(balance, inputs=False)
+def bal_data(interval):
+    '''
+    The 7-day balance of DK1, DK2 and their hourly sum (DK) in a compact
+    column layout, so the price area dropdown is handled in the browser.
+    '''
+    with metrics.phase('transform'):
+        data = balance.get()
+        data = data.fillna(0)
+        data['Fossil Fuel'] = data['FossilGas'] + data['FossilHardCoal'] + data['FossilOil']
+        data['Other Renewables'] = data['OtherRenewable'] + data['HydroPower'] + data['Biomass']
+        columns = [column for _, column, _ in balance_traces]
+
+        areas = {'DK': data.groupby('HourDK', sort=True)[columns].sum()}
+        for pricearea in ['DK1', 'DK2']:
+            areas[pricearea] = data[data['PriceArea'] == pricearea].set_index('HourDK')[columns].sort_index()
+
+    return {'template': serialize(bal_template()),
+            'areas': {area: dict(encoding.time_axis(df.index.tolist()),
+                                 y=[encoding.array(df[column]) for column in columns])
+                      for area, df in areas.items()}}
+
+app.clientside_callback(
+    ClientsideFunction(namespace='overview', function_name='balance_figure'),
+    Output('bal-graph-1', 'figure'),
+    [Input('pricearea-dropdown', 'value'),
+    Input('balance-store', 'data')]
+)
+
 ## Popover
 def toggle_popover(n, is_open):
     if n:
@@ -381,4 +470,4 @@ for src in sources:
         Output(f'popover-{src}', 'is_open'),
         [Input(f'{src}-btn', 'n_clicks')],
         [State(f'popover-{src}', 'is_open')],
-    )(toggle_popover)
+    )(metrics.timed()(toggle_popover))
@@ -0,0 +1,153 @@
+# Imports
+import re
+import copy
+from utils import sql_literal
+
+'''
+Builder for the SELECT statements sent to the energidataservice datastore.
+
+Columns are quoted and values rendered with utils.sql_literal in one
+place, so queries select only the columns a page uses and push filters,
+GROUP BY aggregation and ordering to the datastore, without hand-quoting:
+
+    Query('elspotprices')
+        .select('HourDK', 'PriceArea', 'SpotPriceEUR')
+        .where('HourUTC', '>=', utc_now('-7 days'))
+        .where('PriceArea', 'in', ['DK1', 'DK2'])
+        .order_by('HourDK')
+
+EnergiAPI accepts a Query wherever it accepts an SQL string, and sends
+the statement URL-encoded as the sql parameter.
+'''
+
+# Globals
+OPERATORS = {'=', '!=', '<', '<=', '>', '>=', 'in', 'not in', 'is', 'is not'}
+AGGREGATES = {'sum', 'count', 'min', 'max', 'avg'}
+INTERVAL_PATTERN = re.compile(r'^([+-])\s*(\d+)\s+(minute|hour|day|week|month|year)s?$')
+
+
+class Raw(str):
+    """
+    SQL text inserted into a query as it is, e.g. an expression of the
+    current time. Never build one from user input.
+    """
+
+
+def identifier(name):
+    '''
+    Quotes a column or dataset name.
+    '''
+    return '"' + str(name).replace('"', '""') + '"'
+
+def literal(value):
+    '''
+    Renders a value for a condition: Raw text as it is, None as NULL,
+    lists and tuples as a parenthesized list, anything else as a literal.
+    '''
+    if isinstance(value, Raw):
+        return value
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (list, tuple, set)):
+        return '(' + ', '.join(sql_literal(v) for v in value) + ')'
+    return sql_literal(value)
+
+def utc_now(offset=None):
+    '''
+    The current UTC time of the datastore, optionally shifted by an
+    interval such as '-1 day' or '+6 hours'.
+    '''
+    now = "(current_timestamp at time zone 'UTC')"
+    if offset is None:
+        return Raw(now)
+    match = INTERVAL_PATTERN.match(offset.strip())
+    if match is None:
+        raise ValueError(f'Invalid interval: {offset!r}')
+    sign, amount, unit = match.groups()
+    return Raw(f"({now} {sign} INTERVAL '{amount} {unit}s')")
+
+
+class Query:
+    """
+    SELECT statement on one dataset. Every method returns a new Query, so
+    a base query can be extended, e.g. with the watermark of a refresh.
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.columns = []     # (column, alias)
+        self.aggregates = []  # (alias, column, function)
+        self.groups = []
+        self.conditions = []
+        self.ordering = []
+        self.row_limit = None
+
+    def _extend(self, attribute, items):
+        query = copy.copy(self)
+        setattr(query, attribute, getattr(self, attribute) + list(items))
+        return query
+
+    def select(self, *columns, **aliases):
+        '''
+        Adds columns to the result, by name or as alias=column.
+        '''
+        return self._extend('columns', [(column, None) for column in columns] +
+                            [(column, alias) for alias, column in aliases.items()])
+
+    def group_by(self, *columns):
+        '''
+        Groups by columns, which are also added to the result.
+        '''
+        return self.select(*columns)._extend('groups', columns)
+
+    def agg(self, **aggs):
+        '''
+        Adds aggregated columns, given as alias=(column, function) like in
+        aggregate.RunningAggregate, with function one of sum, count, min,
+        max or avg.
+        '''
+        for alias, (column, func) in aggs.items():
+            if func not in AGGREGATES:
+                raise ValueError(f'Unsupported aggregation: {func}')
+        return self._extend('aggregates', [(alias, column, func) for alias, (column, func) in aggs.items()])
+
+    def where(self, column, op, value):
+        '''
+        Adds a condition on a column; all conditions must hold.
+        '''
+        op = op.lower()
+        if op not in OPERATORS:
+            raise ValueError(f'Unsupported operator: {op}')
+        return self._extend('conditions', [(column, op, value)])
+
+    def order_by(self, *columns, descending=False):
+        return self._extend('ordering', [(column, descending) for column in columns])
+
+    def limit(self, n):
+        query = copy.copy(self)
+        query.row_limit = int(n)
+        return query
+
+    def sql(self):
+        '''
+        The statement as SQL text.
+        '''
+        select = [identifier(column) if alias is None else f'{identifier(column)} AS {identifier(alias)}'
+                  for column, alias in self.columns]
+        select += [f'{func.upper()}({identifier(column)}) AS {identifier(alias)}'
+                   for alias, column, func in self.aggregates]
+        sql = f"SELECT {', '.join(select) or '*'} FROM {identifier(self.dataset)}"
+        if self.conditions:
+            sql += ' WHERE ' + ' AND '.join(f'{identifier(column)} {op.upper()} {literal(v)}'
+                                            for column, op, v in self.conditions)
+        if self.groups:
+            sql += ' GROUP BY ' + ', '.join(identifier(column) for column in self.groups)
+        if self.ordering:
+            sql += ' ORDER BY ' + ', '.join(identifier(column) + (' DESC' if descending else '')
+                                            for column, descending in self.ordering)
+        if self.row_limit is not None:
+            sql += f' LIMIT {self.row_limit}'
+        return sql
+
+    def __str__(self):
+        return self.sql()
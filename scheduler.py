@@ -0,0 +1,187 @@
+# Imports
+import time
+import logging
+import threading
+from collections import namedtuple
+import shared
+from utils import ConcurrentCalls
+from datasets import RETRY_INTERVAL, ServedDataset
+import metrics
+
+# Globals
+logger = logging.getLogger(__name__)
+
+Snapshot = namedtuple('Snapshot', ['data', 'refreshed_at', 'version'])
+
+
+class LiveDataset(ServedDataset):
+    """
+    A frequently updated dataset served from an in-memory snapshot.
+
+    refresh() runs the loader and swaps in a new snapshot in one assignment,
+    so readers always see either the old or the new data, never a mix.
+    A failed refresh keeps serving the last good snapshot, which readers
+    get at once (stale-while-revalidate); its age tells how stale it is.
+    """
+
+    def __init__(self, name, loader, interval):
+        super().__init__(name)
+        self.loader = loader
+        self.interval = interval
+        self.snapshot = None
+        self.next_due = 0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        snapshot = self.snapshot
+        return snapshot.version if snapshot else 0
+
+    # Same readiness interface as datasets.LazyDataset, so pages can show
+    # datasets.loading_layout() for live data as well.
+    @property
+    def ready(self):
+        return self.snapshot is not None
+
+    @property
+    def state(self):
+        if self.snapshot is not None:
+            return 'ready'
+        return 'failed' if self.failures else 'loading'
+
+    @property
+    def loaded_at(self):
+        snapshot = self.snapshot
+        return snapshot.refreshed_at if snapshot else None
+
+    @property
+    def stale_after(self):
+        # Overdue, e.g. because a refresh is hanging on the upstream
+        return 2 * self.interval
+
+    def warm(self):
+        pass
+
+    def refresh(self):
+        '''
+        Loads a new snapshot. Returns True on success.
+        '''
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self):
+        self.next_due = time.monotonic() + self.interval
+        try:
+            data = self.loader()
+        except Exception as e:
+            # Retry sooner than the regular interval for slow moving datasets
+            self._failed(e, min(self.interval, RETRY_INTERVAL))
+            self.next_due = self.retry_at
+            logger.warning('Refreshing %s failed (%d in a row): %r', self.name, self.failures, e)
+            return False
+        self.snapshot = Snapshot(data, time.time(), self.version + 1)
+        self._succeeded()
+        return True
+
+    def get(self):
+        '''
+        Returns a copy of the current data. If no snapshot exists yet, the
+        first one is loaded synchronously.
+        '''
+        snapshot = self.snapshot
+        if snapshot is None:
+            with self._lock:
+                if self.snapshot is None:
+                    self._refresh()
+            snapshot = self.snapshot
+            if snapshot is None:
+                raise RuntimeError(f'{self.name} is not available: {self.last_error}')
+        return snapshot.data.copy()
+
+    def status(self):
+        snapshot = self.snapshot
+        return {'interval': self.interval,
+                'version': self.version,
+                'refreshed_at': snapshot.refreshed_at if snapshot else None,
+                'age': self.age,
+                'stale': self.stale,
+                'failures': self.failures,
+                'last_error': self.last_error,
+                'last_failure': self.last_failure}
+
+
+def _shared_loader(name, loader, max_age):
+    return lambda: shared.frame(name, loader, max_age)
+
+
+class Scheduler:
+    """
+    Refreshes every registered LiveDataset on its own interval from a single
+    background thread, independent of how many browsers are polling.
+    Datasets that are due at the same time are refreshed concurrently.
+    """
+
+    def __init__(self, tick=1.0, calls=None):
+        self.tick = tick
+        self.calls = calls or ConcurrentCalls()
+        self.datasets = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def register(self, name, loader, interval, shared=False):
+        '''
+        Registers a dataset refreshed every interval seconds. With shared,
+        one worker per host runs the loader and the others read its result.
+        '''
+        if shared:
+            loader = _shared_loader(name, loader, interval / 2)
+        dataset = LiveDataset(name, loader, interval)
+        self.datasets[name] = dataset
+        return dataset
+
+    def start(self):
+        '''
+        Starts the refresh thread. Calling start() again is a no-op.
+        '''
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='live-refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        first = True
+        while not self._stop.is_set():
+            now = time.monotonic()
+            due = [dataset for dataset in self.datasets.values() if dataset.next_due <= now]
+            if due:
+                self.refresh(due)
+                if first:
+                    metrics.record_startup('first live refresh', time.monotonic() - now)
+                    first = False
+            self._stop.wait(self.tick)
+
+    def refresh(self, datasets):
+        '''
+        Refreshes datasets concurrently, so a round takes as long as its
+        slowest dataset. A refresh past its deadline keeps running in the
+        background; the dataset lock keeps the next one from overlapping it.
+        '''
+        results = self.calls.run([dataset.refresh for dataset in datasets], return_exceptions=True)
+        for dataset, result in zip(datasets, results):
+            if isinstance(result, Exception):
+                logger.warning('Refreshing %s did not finish: %r', dataset.name, result)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def status(self):
+        return {'running': self.running,
+                'datasets': {name: ds.status() for name, ds in self.datasets.items()}}
+
+
+scheduler = Scheduler()
@@ -0,0 +1,102 @@
+# Imports
+import os
+import numpy as np
+import pandas as pd
+
+'''
+Column types of the energidataservice datasets, applied once when a
+response is decoded (and again when the store merges new rows into old
+ones), so the pages never reparse strings:
+
+- datetime: timestamps parsed in one vectorized pass into datetime64,
+- category: low-cardinality keys such as price areas and industry codes,
+- float32: measurements shown with at most five significant digits; sums
+  are taken in float64 where they matter (see cube.py).
+
+Columns of type timestamp that are not listed are parsed as datetime as
+well. The datastore's own _id and _full_text columns are dropped.
+Set TYPED_SCHEMAS=0 to decode every column as before (strings and float64).
+'''
+
+# Globals
+TYPED_SCHEMAS = os.environ.get("TYPED_SCHEMAS", "1") == "1"
+
+DATETIME = 'datetime'
+CATEGORY = 'category'
+FLOAT32 = 'float32'
+
+# Columns added by the datastore that are never used by the dashboard
+INTERNAL_COLUMNS = ['_id', '_full_text']
+
+## Dataset -> column -> type
+SCHEMAS = {
+    'powersystemrightnow': dict(
+        {'Minutes1UTC': DATETIME, 'Minutes1DK': DATETIME},
+        **dict.fromkeys(['CO2Emission', 'ProductionGe100MW', 'ProductionLt100MW', 'SolarPower',
+                         'OffshoreWindPower', 'OnshoreWindPower'], FLOAT32)),
+    'co2emisprog': {
+        'Minutes5UTC': DATETIME, 'Minutes5DK': DATETIME, 'PriceArea': CATEGORY,
+        'CO2Emission': FLOAT32},
+    'electricitybalancenonv': dict(
+        {'HourUTC': DATETIME, 'HourDK': DATETIME, 'PriceArea': CATEGORY},
+        **dict.fromkeys(['TotalLoad', 'Biomass', 'FossilGas', 'FossilHardCoal', 'FossilOil',
+                         'HydroPower', 'OtherRenewable', 'SolarPower', 'Waste',
+                         'OnshoreWindPower', 'OffshoreWindPower'], FLOAT32)),
+    'elspotprices': {
+        'HourUTC': DATETIME, 'HourDK': DATETIME, 'PriceArea': CATEGORY,
+        'SpotPriceDKK': FLOAT32, 'SpotPriceEUR': FLOAT32},
+    'communityproduction': dict(
+        {'Month': DATETIME},
+        **dict.fromkeys(['OnshoreWindPower', 'OffshoreWindPower', 'SolarPower', 'CentralPower',
+                         'DecentralPower'], FLOAT32)),
+    'consumptionpermunicipalityde35': {
+        'Month': DATETIME, 'Industrycode_DE35': CATEGORY, 'TotalCon': FLOAT32},
+    'industrycodes_de35': {},
+}
+
+
+# Conversion
+def kind(dataset, column, field_type=None):
+    '''
+    Type of a column of a dataset, or None to keep the decoded values.
+    '''
+    if not TYPED_SCHEMAS:
+        return None
+    column_kind = SCHEMAS.get(dataset, {}).get(column)
+    if column_kind is None and field_type == 'timestamp':
+        return DATETIME
+    return column_kind
+
+def convert(values, kind):
+    '''
+    Converts an array or Series of decoded values to a column type.
+    '''
+    if kind == DATETIME:
+        # A plain datetime64 array, as building a DataFrame from a
+        # DatetimeIndex column is about a hundred times slower
+        return pd.to_datetime(values).to_numpy()
+    if kind == CATEGORY:
+        return pd.Categorical(values)
+    if kind == FLOAT32:
+        return np.asarray(values, dtype='float32')
+    return values
+
+def apply(dataset, df, keep=()):
+    '''
+    Drops the internal columns and converts the columns of a DataFrame to
+    the schema of its dataset, e.g. after concatenating stored and new rows.
+    '''
+    df = df.drop(columns=[c for c in INTERNAL_COLUMNS if c not in keep], errors='ignore')
+    for column in df.columns:
+        column_kind = kind(dataset, column)
+        if column_kind is not None and not _is_kind(df[column], column_kind):
+            df[column] = convert(df[column], column_kind)
+    return df
+
+def _is_kind(series, kind):
+    if kind == DATETIME:
+        return pd.api.types.is_datetime64_dtype(series)
+    if kind == CATEGORY:
+        return isinstance(series.dtype, pd.CategoricalDtype)
+    return series.dtype == kind
+
@@ -0,0 +1,134 @@
+# Imports
+import os
+import json
+import time
+import shutil
+import threading
+import numpy as np
+from store import CACHE_DIR, DatasetStore, host_lock
+from cube import Cube
+
+'''
+Datasets shared by all worker processes on a host.
+
+With several workers (e.g. gunicorn -w 4) every worker used to download
+and hold its own copy of each dataset. Here one worker builds a dataset
+under a host-wide lock and the others attach to its result:
+
+- arrays() writes numpy arrays as .npy files that every worker maps
+  read-only (np.load with mmap_mode='r'), so the pages are shared through
+  the OS page cache instead of being copied into each worker,
+- frame() keeps a DataFrame in a host-wide store file, so a live dataset
+  is fetched upstream once per host and interval instead of per worker.
+
+Set SHARED_DATA=0 to build everything in-process.
+'''
+
+# Globals
+SHARED_DATA = os.environ.get("SHARED_DATA", "1") == "1"
+SHARED_DIR = os.path.join(CACHE_DIR, 'shared')
+
+frames = DatasetStore(root=SHARED_DIR)
+
+
+# Arrays
+def _pointer_path(name):
+    return os.path.join(SHARED_DIR, f'{name}.json')
+
+def _read_pointer(name):
+    try:
+        with open(_pointer_path(name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _fresh(pointer, max_age):
+    return pointer is not None and time.time() - pointer['written_at'] < max_age
+
+def _write(name, arrays, meta):
+    '''
+    Writes one generation of arrays into its own directory, then switches
+    the pointer file to it in one rename. Older generations except the
+    previous one are removed; workers that still map them keep their pages.
+    '''
+    generation = f'{name}.{time.time_ns()}'
+    directory = os.path.join(SHARED_DIR, generation)
+    os.makedirs(directory)
+    for key, array in arrays.items():
+        np.save(os.path.join(directory, f'{key}.npy'), np.ascontiguousarray(array))
+
+    pointer = {'generation': generation, 'written_at': time.time(), 'arrays': list(arrays), 'meta': meta}
+    tmp = f'{_pointer_path(name)}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(pointer, f)
+    os.replace(tmp, _pointer_path(name))
+
+    generations = sorted(entry for entry in os.listdir(SHARED_DIR)
+                         if entry.startswith(f'{name}.') and not entry.endswith(('.json', '.tmp')))
+    for old in generations[:-2]:
+        shutil.rmtree(os.path.join(SHARED_DIR, old), ignore_errors=True)
+    return pointer
+
+_attached = {}
+_attached_lock = threading.Lock()
+
+def _attach(name, pointer):
+    with _attached_lock:
+        generation, arrays = _attached.get(name, (None, None))
+        if generation != pointer['generation']:
+            directory = os.path.join(SHARED_DIR, pointer['generation'])
+            arrays = {key: np.load(os.path.join(directory, f'{key}.npy'), mmap_mode='r')
+                      for key in pointer['arrays']}
+            _attached[name] = (pointer['generation'], arrays)
+        return arrays
+
+def arrays(name, build, max_age):
+    '''
+    Returns (arrays, meta) of a dataset built by build() at most once per
+    host every max_age seconds. build returns a dict of numpy arrays and
+    JSON serializable metadata; the arrays are returned as read-only maps.
+    '''
+    if not SHARED_DATA:
+        return build()
+    pointer = _read_pointer(name)
+    if not _fresh(pointer, max_age):
+        with host_lock(f'shared-{name}', SHARED_DIR):
+            pointer = _read_pointer(name)
+            if not _fresh(pointer, max_age):
+                os.makedirs(SHARED_DIR, exist_ok=True)
+                pointer = _write(name, *build())
+    while True:
+        try:
+            return _attach(name, pointer), pointer['meta']
+        except FileNotFoundError:
+            # Two newer generations were written since the pointer was read
+            # and this one was removed; the pointer now names a newer one
+            newer = _read_pointer(name)
+            if newer is None or newer['generation'] == pointer['generation']:
+                raise
+            pointer = newer
+
+def cube(name, build, max_age):
+    '''
+    A Cube built by build() once per host, with its values memory mapped.
+    '''
+    return Cube.from_arrays(*arrays(name, lambda: build().to_arrays(), max_age))
+
+
+# Frames
+def frame(name, load, max_age):
+    '''
+    Returns a DataFrame loaded by load() at most once per host every
+    max_age seconds; other workers read the stored copy.
+    '''
+    if not SHARED_DATA:
+        return load()
+    age = frames.age(name)
+    if age is None or age >= max_age:
+        with host_lock(f'shared-{name}', SHARED_DIR):
+            age = frames.age(name)
+            if age is None or age >= max_age:
+                df = load()
+                frames.save(name, df)
+                return df
+    return frames.load(name)
@@ -0,0 +1,162 @@
+# Imports
+import os
+import time
+import threading
+from contextlib import contextmanager
+import pandas as pd
+from utils import EnergiAPI
+from query import Query
+import schema
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Globals
+CACHE_DIR = os.environ.get("DATA_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache'))
+
+try:
+    import pyarrow  # noqa: F401
+    FORMAT = 'parquet'
+except ImportError:
+    FORMAT = 'pickle'
+
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+@contextmanager
+def host_lock(name, root=CACHE_DIR):
+    '''
+    Exclusive lock held across all worker processes on this host, through
+    flock on a lock file under the cache directory. Where flock is not
+    available (Windows) it only serializes the threads of this process.
+    '''
+    with _thread_locks_guard:
+        lock = _thread_locks.setdefault(name, threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.join(root, 'locks'), exist_ok=True)
+        with open(os.path.join(root, 'locks', f'{name}.lock'), 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def sql_time(value):
+    '''
+    Renders a timestamp (or an ISO timestamp string) for an SQL condition.
+    '''
+    return pd.Timestamp(value).strftime('%Y-%m-%dT%H:%M:%S')
+
+
+class DatasetStore:
+    """
+    Local columnar copy of energidataservice datasets.
+
+    Each dataset is kept in one file under the cache directory (Parquet when
+    pyarrow is installed, pickle otherwise). On refresh only the rows at or
+    after the stored high-water mark are fetched, merged into the stored rows
+    and the result is trimmed to the retention window.
+    """
+
+    def __init__(self, api=None, root=CACHE_DIR):
+        self.api = api or EnergiAPI()
+        self.root = root
+
+    def path(self, dataset):
+        return os.path.join(self.root, f'{dataset}.{FORMAT}')
+
+    def load(self, dataset):
+        '''
+        Returns the stored rows of a dataset, or None if nothing is stored.
+        '''
+        path = self.path(dataset)
+        if not os.path.exists(path):
+            return None
+        if FORMAT == 'parquet':
+            return pd.read_parquet(path)
+        return pd.read_pickle(path)
+
+    def save(self, dataset, df):
+        '''
+        Writes a dataset atomically, so concurrent readers never see a
+        partially written file.
+        '''
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(dataset)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        if FORMAT == 'parquet':
+            df.to_parquet(tmp, index=False)
+        else:
+            df.to_pickle(tmp)
+        os.replace(tmp, path)
+
+    def age(self, dataset):
+        '''
+        Seconds since the dataset was last written, or None if not stored.
+        '''
+        path = self.path(dataset)
+        if not os.path.exists(path):
+            return None
+        return time.time() - os.path.getmtime(path)
+
+    def refresh(self, dataset, watermark, retention, max_age=0, query=None):
+        '''
+        Brings the stored copy of a dataset up to date and returns it.
+
+        watermark: timestamp column used as high-water mark, e.g. 'HourUTC'.
+        retention: pd.DateOffset of history to keep, e.g. pd.DateOffset(years=1).
+        max_age: seconds during which a stored copy is served without
+            asking upstream for new rows.
+        query: query.Query on the dataset selecting (or aggregating) the
+            stored columns, including the watermark. Defaults to all columns.
+
+        Workers on the same host refresh one at a time; a worker that waited
+        for another one's refresh serves its result without going upstream.
+        '''
+        age = self.age(dataset)
+        if age is not None and age < max_age:
+            return self.load(dataset)
+        with host_lock(f'store-{dataset}', self.root):
+            return self._refresh(dataset, watermark, retention, max_age, query or Query(dataset))
+
+    def _refresh(self, dataset, watermark, retention, max_age, query):
+        stored = self.load(dataset)
+        age = self.age(dataset)
+        if stored is not None and age is not None and age < max_age:
+            return stored
+
+        cutoff = pd.Timestamp.utcnow().tz_localize(None) - retention
+
+        if stored is None or stored.empty:
+            query = query.where(watermark, '>', sql_time(cutoff))
+        else:
+            # The last stored period is fetched again, as it may have been
+            # only partially published when it was stored.
+            high_water = stored[watermark].max()
+            stored = stored[stored[watermark] < high_water]
+            query = query.where(watermark, '>=', sql_time(high_water))
+
+        # Straight upstream: the delta query repeats until new rows are
+        # published, so a cached or stale answer would hide them
+        delta = self.api.fetch(query)
+        if stored is not None and len(delta.columns):
+            # Follows the query when its columns changed since the last save
+            stored = stored.reindex(columns=delta.columns)
+
+        # Converting after the concat also upgrades copies stored untyped
+        df = pd.concat([stored, delta], ignore_index=True) if stored is not None else delta
+        df = schema.apply(dataset, df)
+        df = df[pd.to_datetime(df[watermark]) > cutoff].sort_values(by=watermark).reset_index(drop=True)
+        self.save(dataset, df)
+        return df
+
+
+store = DatasetStore()
@@ -1,6 +1,1045 @@
 # Imports
-from utils import EnergiAPI
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import requests
+import utils
+import metrics
+from utils import EnergiAPI, AsyncEnergiAPI, QueryCache, SingleFlight, CircuitBreaker, CircuitOpenError
+from query import Query, utc_now
+from aggregate import RunningAggregate, fold_chunks
+from store import DatasetStore, host_lock
+from cube import Cube
+import shared
+from ohlc import OHLCEngine, BUCKETS
+from scheduler import LiveDataset, Scheduler
+from datasets import LazyDataset, RETRY_INTERVAL
+import downsample
+import encoding
+import schema
+from figcache import FigureCache
+import geometry
+import elmarket
+from benchmarks.fixtures import FixtureTransport
 api = EnergiAPI()
 
 
-# geo = requests.get('https://raw.githubusercontent.com/magnuslarsen/geoJSON-Danish-municipalities/master/municipalities/municipalities.geojson').json()
\ No newline at end of file
+# geo = requests.get('https://raw.githubusercontent.com/magnuslarsen/geoJSON-Danish-municipalities/master/municipalities/municipalities.geojson').json()
+
+# Test Helpers
+# Generous upper bound for anything a test waits on; only reached when a test fails
+WAIT = 10
+
+PAYLOAD = json.dumps({'success': True, 'result': {
+    'records': [{'HourDK': '2020-12-15T10:00:00', 'SpotPriceEUR': 30.5}],
+    'fields': [{'id': 'HourDK', 'type': 'timestamp'}, {'id': 'SpotPriceEUR', 'type': 'float8'}]}}).encode()
+
+
+class SlowTransport:
+    """
+    Counts upstream requests and, while its gate is closed, holds each one
+    until the test opens it. Requests held longer than WAIT fail.
+    """
+
+    def __init__(self, fail=False, gate=True):
+        self.fail = fail
+        self.gate = threading.Event()
+        if gate:
+            self.gate.set()
+        self.requests = 0
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        with self._lock:
+            self.requests += 1
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            if not self.gate.wait(WAIT):
+                raise TimeoutError('the test never opened the gate')
+            if self.fail:
+                raise ConnectionError('upstream down')
+            return type('Response', (), {'content': PAYLOAD})()
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+class FakeClock:
+    """
+    Monotonic clock that only moves when the test advances it.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def wait_for(condition, timeout=WAIT):
+    '''
+    Polls condition until it holds or timeout seconds have passed.
+    '''
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            return False
+        time.sleep(0.005)
+    return True
+
+def open_when(condition, transport):
+    '''
+    Opens the gate of transport from another thread once condition holds.
+    '''
+    threading.Thread(target=lambda: wait_for(condition) and transport.gate.set(), daemon=True).start()
+
+
+# Single-flight Coalescing
+class SingleFlightTest(unittest.TestCase):
+
+    N = 16
+
+    def run_concurrently(self, api, func):
+        '''
+        Runs func from N threads at once and holds the upstream requests
+        until every caller has joined a flight.
+        '''
+        start = threading.Barrier(self.N)
+        open_when(lambda: api.flights.calls + api.flights.coalesced >= self.N, api.transport)
+
+        def call(i):
+            start.wait()
+            return func(i)
+
+        with ThreadPoolExecutor(self.N) as pool:
+            return [f.result() if f.exception() is None else f.exception()
+                    for f in [pool.submit(call, i) for i in range(self.N)]]
+
+    def test_concurrent_callers_share_one_request(self):
+        transport = SlowTransport(gate=False)
+        api = EnergiAPI(transport=transport, cache=QueryCache(), flights=SingleFlight())
+        results = self.run_concurrently(api, lambda i: api.sql_to_df('SELECT * FROM "elspotprices"'))
+        self.assertEqual(transport.requests, 1)
+        self.assertEqual(api.flights.coalesced, self.N - 1)
+        for df in results:
+            self.assertEqual(df['SpotPriceEUR'].tolist(), [30.5])
+        # Every caller gets its own copy
+        results[0]['SpotPriceEUR'] = 0
+        self.assertEqual(results[1]['SpotPriceEUR'].tolist(), [30.5])
+
+    def test_callers_mutating_their_result_do_not_affect_others(self):
+        transport = SlowTransport(gate=False)
+        api = EnergiAPI(transport=transport, cache=False, flights=SingleFlight())
+
+        def call(i):
+            # Like mapview.load_indust, every caller renames its frame in place
+            df = api.sql_to_df('SELECT * FROM "elspotprices"')
+            seen = (df.columns.tolist(), df['SpotPriceEUR'].tolist())
+            df.rename(columns={'SpotPriceEUR': 'Price'}, inplace=True)
+            df['Price'] = 0.0
+            return seen
+
+        results = self.run_concurrently(api, call)
+        self.assertEqual(transport.requests, 1)
+        self.assertEqual(results, [(['HourDK', 'SpotPriceEUR'], [30.5])] * self.N)
+
+    def test_coalescing_without_cache(self):
+        transport = SlowTransport(gate=False)
+        api = EnergiAPI(transport=transport, cache=False, flights=SingleFlight())
+        self.run_concurrently(api, lambda i: api.sql_to_df('SELECT * FROM "elspotprices"'))
+        self.assertEqual(transport.requests, 1)
+
+    def test_normalized_queries_are_coalesced(self):
+        transport = SlowTransport(gate=False)
+        api = EnergiAPI(transport=transport, cache=False, flights=SingleFlight())
+        queries = ['SELECT * FROM "elspotprices"', '  SELECT *\n    FROM "elspotprices" ']
+        self.run_concurrently(api, lambda i: api.sql_to_df(queries[i % 2]))
+        self.assertEqual(transport.requests, 1)
+
+    def test_different_queries_are_not_coalesced(self):
+        transport = SlowTransport(gate=False)
+        api = EnergiAPI(transport=transport, cache=False, flights=SingleFlight())
+        self.run_concurrently(api, lambda i: api.sql_to_df(f'SELECT * FROM "elspotprices" LIMIT {i % 4 + 1}'))
+        self.assertEqual(transport.requests, 4)
+
+    def test_errors_reach_every_caller_and_are_not_kept(self):
+        transport = SlowTransport(fail=True, gate=False)
+        api = EnergiAPI(transport=transport, cache=QueryCache(), flights=SingleFlight())
+        results = self.run_concurrently(api, lambda i: api.sql_to_df('SELECT * FROM "elspotprices"'))
+        self.assertEqual(transport.requests, 1)
+        self.assertTrue(all(isinstance(r, ConnectionError) for r in results))
+
+        # The next call goes upstream again and succeeds
+        transport.fail = False
+        self.assertEqual(len(api.sql_to_df('SELECT * FROM "elspotprices"')), 1)
+        self.assertEqual(transport.requests, 2)
+        self.assertEqual(api.flights.stats()['in_flight'], 0)
+
+
+# Query Builder
+class QueryTest(unittest.TestCase):
+
+    def test_values_and_names_are_escaped(self):
+        sql = Query('elspotprices').select('PriceArea').where('PriceArea', '=', "DK1' OR '1'='1").sql()
+        self.assertEqual(sql, 'SELECT "PriceArea" FROM "elspotprices" WHERE "PriceArea" = \'DK1\'\' OR \'\'1\'\'=\'\'1\'')
+        self.assertEqual(Query('a"b').sql(), 'SELECT * FROM "a""b"')
+
+    def test_aggregation_is_pushed_down(self):
+        sql = (Query('consumptionpermunicipalityde35')
+               .group_by('Month', 'MunicipalityNo')
+               .agg(TotalCon=('TotalCon', 'sum'))
+               .where('Month', '>=', '2020-01-01')
+               .order_by('Month', descending=True)
+               .limit(10).sql())
+        self.assertEqual(sql, 'SELECT "Month", "MunicipalityNo", SUM("TotalCon") AS "TotalCon" '
+                              'FROM "consumptionpermunicipalityde35" WHERE "Month" >= \'2020-01-01\' '
+                              'GROUP BY "Month", "MunicipalityNo" ORDER BY "Month" DESC LIMIT 10')
+
+    def test_builder_methods_return_new_queries(self):
+        base = Query('elspotprices').select('HourUTC')
+        base.where('HourUTC', '>', '2020-01-01')
+        self.assertEqual(base.sql(), 'SELECT "HourUTC" FROM "elspotprices"')
+
+    def test_invalid_input_is_rejected(self):
+        with self.assertRaises(ValueError):
+            Query('elspotprices').where('PriceArea', '; DROP', 'DK1')
+        with self.assertRaises(ValueError):
+            utc_now("-1 day'); DROP TABLE x; --")
+
+    def test_sql_is_sent_url_encoded(self):
+        sent = []
+
+        class Transport:
+            def get(self, url, **kwargs):
+                sent.append(requests.Request('GET', url, params=kwargs['params']).prepare().url)
+                return type('Response', (), {'content': PAYLOAD})()
+
+        api = EnergiAPI(transport=Transport(), cache=False, flights=SingleFlight())
+        api.fetch(Query('co2emisprog').where('Minutes5UTC', '<', utc_now('+6 hours')))
+        self.assertIn('%2B+INTERVAL', sent[0])
+
+# Concurrent Queries
+class AsyncEnergiAPITest(unittest.TestCase):
+
+    def test_batch_runs_queries_concurrently_within_limit(self):
+        transport = SlowTransport(gate=False)
+        api = AsyncEnergiAPI(EnergiAPI(transport=transport, cache=False, flights=SingleFlight()), limit=4)
+        # Only opened once limit requests run at the same time
+        open_when(lambda: transport.active >= 4, transport)
+        dfs = api.batch([f'SELECT * FROM "elspotprices" LIMIT {i + 1}' for i in range(8)])
+        self.assertEqual([len(df) for df in dfs], [1] * 8)
+        self.assertEqual(transport.requests, 8)
+        self.assertEqual(transport.peak, 4)
+
+    def test_deadline_gives_up_on_slow_queries(self):
+        transport = SlowTransport(gate=False)
+        self.addCleanup(transport.gate.set)
+        api = AsyncEnergiAPI(EnergiAPI(transport=transport, cache=False, flights=SingleFlight()))
+        results = api.batch(['SELECT * FROM "elspotprices"'], deadline=0.1, return_exceptions=True)
+        self.assertIsInstance(results[0], TimeoutError)
+        # Given up while the request is still held upstream
+        self.assertEqual(transport.active, 1)
+
+
+# Upstream Failures
+class UpstreamFailureTest(unittest.TestCase):
+
+    QUERY = 'SELECT * FROM "elspotprices"'
+
+    def test_breaker_fails_fast_and_probes_after_reset_timeout(self):
+        transport = SlowTransport(fail=True)
+        clock = FakeClock()
+        breaker = CircuitBreaker('test', failures=3, reset_timeout=30, clock=clock)
+        api = EnergiAPI(transport=transport, cache=False, flights=SingleFlight(), breaker=breaker)
+        for _ in range(3):
+            self.assertRaises(ConnectionError, api.sql_to_df, self.QUERY)
+        self.assertEqual(breaker.state, 'open')
+
+        # Open: nothing is sent upstream
+        self.assertRaises(CircuitOpenError, api.sql_to_df, self.QUERY)
+        self.assertEqual(transport.requests, 3)
+
+        # Half-open: a failed probe opens it again, a good one closes it
+        clock.advance(31)
+        self.assertRaises(ConnectionError, api.sql_to_df, self.QUERY)
+        self.assertEqual(breaker.state, 'open')
+        self.assertRaises(CircuitOpenError, api.sql_to_df, self.QUERY)
+        clock.advance(31)
+        transport.fail = False
+        self.assertEqual(len(api.sql_to_df(self.QUERY)), 1)
+        self.assertEqual(breaker.state, 'closed')
+        self.assertEqual(transport.requests, 5)
+
+    def test_rejected_queries_do_not_open_the_breaker(self):
+        response = requests.Response()
+        response.status_code = 409
+        breaker = CircuitBreaker('test', failures=1)
+        for _ in range(3):
+            self.assertRaises(requests.HTTPError, breaker.call, response.raise_for_status)
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_expired_results_are_served_while_refreshed(self):
+        transport = SlowTransport()
+        clock = FakeClock()
+        cache = QueryCache(ttls={'elspotprices': 60}, stale_ttl=3600, clock=clock)
+        api = EnergiAPI(transport=transport, cache=cache, flights=SingleFlight(), breaker=CircuitBreaker('test'),
+                        stale=True)
+        api.sql_to_df(self.QUERY)
+        clock.advance(61)
+
+        # Expired: returned while the one background refresh is held upstream
+        transport.gate.clear()
+        for _ in range(5):
+            self.assertEqual(len(api.sql_to_df(self.QUERY)), 1)
+        self.assertEqual(cache.stats()['stale_hits'], 5)
+        self.assertTrue(wait_for(lambda: transport.active == 1))
+        transport.gate.set()
+        self.assertTrue(wait_for(lambda: not utils._revalidating))
+        self.assertEqual(transport.requests, 2)
+        self.assertEqual(len(cache.get(self.QUERY)), 1)
+
+        # A failed refresh keeps the expired result
+        clock.advance(61)
+        transport.fail = True
+        self.assertEqual(len(api.sql_to_df(self.QUERY)), 1)
+        self.assertTrue(wait_for(lambda: not utils._revalidating))
+        self.assertEqual(transport.requests, 3)
+        self.assertEqual(len(api.sql_to_df(self.QUERY)), 1)
+
+
+# Dataset Store
+class PublishingTransport:
+    """
+    Upstream of elspotprices rows that answers the watermark condition of
+    a store refresh; publish() adds rows between refreshes. With areas,
+    every hour has a row per price area.
+    """
+
+    CONDITION = re.compile(r'"HourUTC" (>=|>) \'([^\']+)\'')
+    TYPES = {'HourUTC': 'timestamp', 'HourDK': 'timestamp', 'PriceArea': 'text', 'SpotPriceEUR': 'float8'}
+
+    def __init__(self, hours, areas=()):
+        self.rows = []
+        self.hours = 0
+        self.areas = areas
+        self.requests = 0
+        self.start = pd.Timestamp.utcnow().tz_localize(None).floor('h') - pd.Timedelta(hours=hours)
+        self.publish(hours)
+
+    def publish(self, hours):
+        for i in range(self.hours, self.hours + hours):
+            hour = self.start + pd.Timedelta(hours=i)
+            row = {'HourUTC': hour.isoformat(), 'SpotPriceEUR': float(i)}
+            if not self.areas:
+                self.rows.append(row)
+            for area in self.areas:
+                self.rows.append(dict(row, HourDK=(hour + pd.Timedelta(hours=1)).isoformat(), PriceArea=area))
+        self.hours += hours
+
+    def get(self, url, **kwargs):
+        self.requests += 1
+        op, value = self.CONDITION.search(kwargs['params']['sql']).groups()
+        value = pd.Timestamp(value)
+        records = [row for row in self.rows if (pd.Timestamp(row['HourUTC']) >= value if op == '>='
+                                                else pd.Timestamp(row['HourUTC']) > value)]
+        fields = [{'id': column, 'type': self.TYPES[column]} for column in (self.rows[0] if self.rows else {})]
+        content = json.dumps({'success': True, 'result': {'records': records, 'fields': fields}}).encode()
+        return type('Response', (), {'content': content})()
+
+
+class DatasetStoreTest(unittest.TestCase):
+
+    def make_store(self, transport, **api):
+        api = EnergiAPI(transport=transport, flights=SingleFlight(), breaker=CircuitBreaker('test'), **api)
+        return DatasetStore(api=api, root=tempfile.mkdtemp(prefix='store-test-'))
+
+    def refresh(self, store):
+        return store.refresh('elspotprices', 'HourUTC', pd.DateOffset(days=30))
+
+    def test_rows_published_between_refreshes_arrive(self):
+        transport = PublishingTransport(46)
+        store = self.make_store(transport, cache=QueryCache())
+        self.assertEqual(len(self.refresh(store)), 46)
+        # Nothing new: the same delta query as the next refresh sends
+        self.assertEqual(len(self.refresh(store)), 46)
+
+        transport.publish(3)
+        df = self.refresh(store)
+        self.assertEqual(transport.requests, 3)
+        self.assertEqual(df['SpotPriceEUR'].tolist(), list(range(49)))
+        self.assertEqual(len(store.load('elspotprices')), 49)
+
+    def test_expired_delta_is_never_saved_as_fresh(self):
+        transport = PublishingTransport(46)
+        cache = QueryCache(ttls={'elspotprices': 0}, stale_ttl=3600)
+        store = self.make_store(transport, cache=cache, stale=True)
+        self.refresh(store)
+        self.refresh(store)
+        transport.publish(3)
+
+        # An expired delta of the stale-serving path would be written with a new mtime
+        df = self.refresh(store)
+        self.assertEqual(len(df), 49)
+        self.assertEqual(transport.requests, 3)
+        self.assertEqual(cache.stats()['stale_hits'] + cache.stats()['hits'], 0)
+
+    def test_stored_copy_is_served_within_max_age(self):
+        transport = PublishingTransport(10)
+        store = self.make_store(transport, cache=False)
+        store.refresh('elspotprices', 'HourUTC', pd.DateOffset(days=30), max_age=3600)
+        transport.publish(2)
+        df = store.refresh('elspotprices', 'HourUTC', pd.DateOffset(days=30), max_age=3600)
+        self.assertEqual((len(df), transport.requests), (10, 1))
+
+    def test_prices_refreshed_at_every_scheduler_tick(self):
+        transport = PublishingTransport(48, areas=('DK1', 'DK2'))
+        store = self.make_store(transport, cache=False)
+        prices = LiveDataset('elspotprices', elmarket.load_prices, elmarket.PRICES_INTERVAL)
+        path = store.path('elspotprices')
+        with unittest.mock.patch.object(elmarket, 'store', store):
+            for tick in range(4):
+                self.assertTrue(prices.refresh())
+                self.assertEqual(transport.requests, tick + 1)
+                # The next tick comes exactly one interval after this refresh
+                # started, so a little less than that after its save
+                mtime = os.path.getmtime(path) - (elmarket.PRICES_INTERVAL - 1)
+                os.utime(path, (mtime, mtime))
+                transport.publish(1)
+        self.assertEqual(len(store.load('elspotprices')), 2 * 51)
+
+
+# Paged Queries
+class PagedQueryTest(unittest.TestCase):
+
+    # 200 rows of the 600 in the fixture
+    QUERY = (Query('elspotprices').select('_id', 'HourUTC', 'PriceArea', 'SpotPriceEUR')
+             .where('PriceArea', 'in', ['DK1', 'DK2']))
+    ORDER = '"HourUTC", "PriceArea"'
+
+    def setUp(self):
+        self.transport = FixtureTransport(sizes={'elspotprices': 100})
+        self.api = EnergiAPI(transport=self.transport, cache=False, flights=SingleFlight(),
+                             breaker=CircuitBreaker('test'))
+
+    def one_shot(self):
+        df = self.api.sql_to_df(self.QUERY)
+        return df.sort_values(['HourUTC', 'PriceArea']).reset_index(drop=True)
+
+    def assert_pages(self, pages, sizes, key=None):
+        self.assertEqual([len(page) for page in pages], sizes)
+        df = pd.concat(pages, ignore_index=True)
+        if key is not None:
+            self.assertTrue(df[key].is_monotonic_increasing)
+            df = df.drop(columns=[key]).sort_values(['HourUTC', 'PriceArea']).reset_index(drop=True)
+        # Each page has the categories of its own rows
+        pd.testing.assert_frame_equal(df, self.one_shot(), check_dtype=False, check_categorical=False)
+
+    def test_offset_pages_equal_one_query(self):
+        self.assert_pages(list(self.api.iter_sql(self.QUERY, order_by=self.ORDER, chunksize=64)),
+                          [64, 64, 64, 8])
+
+    def test_keyset_pages_equal_one_query(self):
+        pages = list(self.api.iter_sql(self.QUERY, key='_id', chunksize=64))
+        self.assert_pages(pages, [64, 64, 64, 8], key='_id')
+
+    def test_full_last_page_ends_on_an_empty_one(self):
+        pages = list(self.api.iter_sql(self.QUERY, order_by=self.ORDER, chunksize=100))
+        self.assertEqual(self.transport.requests, 3)
+        self.assert_pages(pages, [100, 100])
+
+    def test_empty_results_yield_no_pages(self):
+        query = Query('elspotprices').where('PriceArea', '=', 'XX')
+        self.assertEqual(list(self.api.iter_sql(query, order_by=self.ORDER)), [])
+        with self.assertRaises(ValueError):
+            next(self.api.iter_sql(query))
+
+    def test_running_aggregate_matches_groupby_across_pages(self):
+        aggs = {'Mean': ('SpotPriceEUR', 'mean'), 'Count': ('SpotPriceEUR', 'count'),
+                'Low': ('SpotPriceEUR', 'min'), 'High': ('SpotPriceEUR', 'max'),
+                'First': ('HourUTC', 'first'), 'Last': ('HourUTC', 'last')}
+        # Pages of 7 rows split the groups at every page boundary
+        result = fold_chunks(self.api.iter_sql(self.QUERY, order_by=self.ORDER, chunksize=7), ['PriceArea'], aggs)
+        expected = self.one_shot().groupby('PriceArea').agg(**aggs).reset_index()
+        # The folded mean is computed in float64 from float32 prices
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False, check_exact=False)
+
+    def test_running_aggregate_of_no_rows(self):
+        agg = RunningAggregate(['PriceArea'], {'Mean': ('SpotPriceEUR', 'mean')})
+        agg.update(self.one_shot().iloc[:0])
+        result = agg.result()
+        self.assertTrue(result.empty)
+        self.assertEqual(result.columns.tolist(), ['PriceArea', 'Mean'])
+        with self.assertRaises(ValueError):
+            RunningAggregate(['PriceArea'], {'Median': ('SpotPriceEUR', 'median')})
+
+
+# Column Types
+class SchemaTest(unittest.TestCase):
+
+    def test_columns_are_converted_to_the_schema(self):
+        df = pd.DataFrame({'_id': [1, 2], '_full_text': ['a', 'b'],
+                           'HourUTC': ['2021-01-01T00:00:00', '2021-01-01T01:00:00'],
+                           'PriceArea': ['DK1', 'DK2'], 'SpotPriceEUR': ['30.5', '31.25'], 'Note': ['x', 'y']})
+        typed = schema.apply('elspotprices', df)
+        # Internal columns dropped, listed columns missing from the frame not added
+        self.assertEqual(typed.columns.tolist(), ['HourUTC', 'PriceArea', 'SpotPriceEUR', 'Note'])
+        self.assertEqual({column: str(dtype) for column, dtype in typed.dtypes.items()},
+                         {'HourUTC': 'datetime64[ns]', 'PriceArea': 'category',
+                          'SpotPriceEUR': 'float32', 'Note': 'object'})
+        self.assertEqual(typed['HourUTC'].iloc[1], pd.Timestamp('2021-01-01 01:00'))
+        self.assertEqual(typed['SpotPriceEUR'].tolist(), [30.5, 31.25])
+        self.assertEqual(typed['PriceArea'].cat.categories.tolist(), ['DK1', 'DK2'])
+        self.assertEqual(schema.apply('elspotprices', df, keep=('_id',)).columns[0], '_id')
+
+    def test_merged_rows_are_converted_again(self):
+        stored = schema.apply('elspotprices', pd.DataFrame({'PriceArea': ['DK1'], 'SpotPriceEUR': [1.0]}))
+        delta = schema.apply('elspotprices', pd.DataFrame({'PriceArea': ['DK2'], 'SpotPriceEUR': [2.0]}))
+        # Categoricals with different categories concatenate to object
+        merged = pd.concat([stored, delta], ignore_index=True)
+        self.assertEqual(merged['PriceArea'].dtype, object)
+        typed = schema.apply('elspotprices', merged)
+        self.assertEqual(typed['PriceArea'].cat.categories.tolist(), ['DK1', 'DK2'])
+        self.assertEqual(typed['SpotPriceEUR'].dtype, 'float32')
+
+    def test_column_kinds(self):
+        self.assertEqual(schema.kind('elspotprices', 'PriceArea'), schema.CATEGORY)
+        self.assertEqual(schema.kind('industrycodes_de35', 'Updated', 'timestamp'), schema.DATETIME)
+        self.assertIsNone(schema.kind('industrycodes_de35', 'ind_code', 'text'))
+        with unittest.mock.patch.object(schema, 'TYPED_SCHEMAS', False):
+            self.assertIsNone(schema.kind('elspotprices', 'PriceArea'))
+            df = pd.DataFrame({'PriceArea': ['DK1'], 'SpotPriceEUR': [1.0]})
+            self.assertEqual(schema.apply('elspotprices', df).dtypes.tolist(), [object, 'float64'])
+
+    def test_convert(self):
+        self.assertEqual(schema.convert(['2021-01-01T00:00:00'], schema.DATETIME).dtype, 'datetime64[ns]')
+        self.assertEqual(schema.convert(np.array([1, 2]), schema.FLOAT32).dtype, 'float32')
+        self.assertEqual(list(schema.convert(['b', 'a', 'b'], schema.CATEGORY).categories), ['a', 'b'])
+        values = ['kept']
+        self.assertIs(schema.convert(values, None), values)
+
+
+# Query Cache
+class QueryCacheTest(unittest.TestCase):
+
+    PRICES = 'SELECT * FROM "elspotprices"'
+    OTHER = 'SELECT * FROM "co2emis"'
+
+    def frame(self, rows=1):
+        return pd.DataFrame({'SpotPriceEUR': np.arange(rows, dtype='float64')})
+
+    def test_entries_expire_after_the_ttl_of_their_dataset(self):
+        clock = FakeClock()
+        cache = QueryCache(ttls={'elspotprices': 60}, default_ttl=10, stale_ttl=0, clock=clock)
+        cache.put(self.PRICES, self.frame())
+        cache.put(self.OTHER, self.frame())
+        clock.advance(30)
+        self.assertIsNotNone(cache.get(self.PRICES))
+        self.assertIsNone(cache.get(self.OTHER))
+        clock.advance(31)
+        self.assertIsNone(cache.get(self.PRICES))
+        self.assertEqual({k: cache.stats()[k] for k in ('entries', 'hits', 'misses')},
+                         {'entries': 0, 'hits': 1, 'misses': 2})
+
+    def test_expired_entries_are_served_stale_within_the_window(self):
+        clock = FakeClock()
+        cache = QueryCache(ttls={'elspotprices': 60}, stale_ttl=30, clock=clock)
+        cache.put(self.PRICES, self.frame())
+        self.assertFalse(cache.get_stale(self.PRICES)[1])
+        clock.advance(61)
+        self.assertIsNone(cache.get(self.PRICES))
+        df, expired = cache.get_stale(self.PRICES)
+        self.assertEqual((len(df), expired), (1, True))
+        clock.advance(30)
+        self.assertEqual(cache.get_stale(self.PRICES), (None, False))
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        nbytes = int(self.frame(100).memory_usage(deep=True).sum())
+        cache = QueryCache(max_bytes=int(2.5 * nbytes), clock=FakeClock())
+        cache.put('a', self.frame(100))
+        cache.put('b', self.frame(100))
+        cache.get('a')
+        cache.put('c', self.frame(100))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual((cache.stats()['evictions'], cache.stats()['bytes']), (1, 2 * nbytes))
+        # Larger than the whole cache: never stored
+        cache.put('d', self.frame(1000))
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual(cache.stats()['entries'], 2)
+
+    def test_shared_cache_counters_are_on_metrics(self):
+        misses = utils.default_cache.stats()['misses']
+        utils.default_cache.get('SELECT * FROM "not_cached"')
+        rendered = metrics.render().splitlines()
+        self.assertIn(f'dashboard_query_cache_lookups_total{{result="miss"}} {misses + 1}', rendered)
+        self.assertIn('# TYPE dashboard_query_cache_evictions_total counter', rendered)
+
+    def test_cached_frames_are_copies(self):
+        cache = QueryCache(clock=FakeClock())
+        df = self.frame()
+        cache.put(self.PRICES, df)
+        df['SpotPriceEUR'] = 5.0
+        cache.get(self.PRICES)['SpotPriceEUR'] = 7.0
+        self.assertEqual(cache.get(self.PRICES)['SpotPriceEUR'].tolist(), [0.0])
+
+
+# Shared Data
+def generation(k):
+    '''
+    Builder of shared arrays whose every value and metadata is k.
+    '''
+    return lambda: ({'a': np.full(1000, k), 'b': np.full(1000, k)}, {'k': k})
+
+
+class SharedDataTest(unittest.TestCase):
+
+    def setUp(self):
+        root = tempfile.mkdtemp(prefix='shared-test-')
+        self.addCleanup(shutil.rmtree, root, True)
+        for patch in (unittest.mock.patch.object(shared, 'SHARED_DIR', root),
+                      unittest.mock.patch.object(shared, 'SHARED_DATA', True),
+                      unittest.mock.patch.object(shared, 'frames', DatasetStore(root=root)),
+                      unittest.mock.patch.dict(shared._attached, clear=True)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_arrays_are_built_once_and_mapped_read_only(self):
+        builds = []
+        build = lambda: builds.append(1) or generation(1)()
+        shared.arrays('test', build, max_age=3600)
+        arrays, meta = shared.arrays('test', build, max_age=3600)
+        self.assertEqual((len(builds), meta), (1, {'k': 1}))
+        self.assertIsInstance(arrays['a'], np.memmap)
+        self.assertFalse(arrays['a'].flags.writeable)
+        self.assertEqual(arrays['b'].tolist(), [1] * 1000)
+
+    def test_republishing_swaps_generations(self):
+        first, _ = shared.arrays('test', generation(1), max_age=0)
+        pointer = shared._read_pointer('test')
+
+        # A reader holding the old pointer still maps the old generation
+        arrays, meta = shared.arrays('test', generation(2), max_age=0)
+        self.assertEqual((arrays['a'][0], meta), (2, {'k': 2}))
+        shared._attached.clear()
+        self.assertEqual(shared._attach('test', pointer)['a'][0], 1)
+
+        # Older generations are removed; workers mapping them keep their pages
+        shared.arrays('test', generation(3), max_age=0)
+        generations = [entry for entry in os.listdir(shared.SHARED_DIR) if entry.startswith('test.')
+                       and not entry.endswith('.json')]
+        self.assertEqual(len(generations), 2)
+        self.assertNotIn(pointer['generation'], generations)
+        self.assertEqual(first['a'].tolist(), [1] * 1000)
+        self.assertEqual(shared.arrays('test', generation(4), max_age=3600)[1], {'k': 3})
+
+    def test_readers_see_one_generation_during_swaps(self):
+        shared.arrays('test', generation(0), max_age=0)
+        stop = threading.Event()
+        seen = []
+        errors = []
+
+        def read():
+            while not stop.is_set():
+                shared._attached.clear()
+                try:
+                    arrays, meta = shared.arrays('test', generation(-1), max_age=3600)
+                except Exception as e:
+                    errors.append(e)
+                    return
+                seen.append((int(arrays['a'][0]), int(arrays['b'][-1]), meta['k']))
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        try:
+            for k in range(1, 50):
+                shared.arrays('test', generation(k), max_age=0)
+        finally:
+            stop.set()
+            reader.join(WAIT)
+        self.assertEqual(errors, [])
+        self.assertTrue(seen)
+        self.assertTrue(all(a == b == k for a, b, k in seen))
+
+    def test_cube_is_shared_as_a_memory_map(self):
+        df = pd.DataFrame({'Mun': ['101', '101', '147'], 'Month': ['2021-01', '2021-02', '2021-01'],
+                           'Wind': [1.0, 2.0, 3.0], 'Solar': [4.0, np.nan, 6.0]})
+        built = Cube.from_wide(df, 'Mun', ['Wind', 'Solar'], 'Month')
+        cube = shared.cube('cube-test', lambda: built, max_age=3600)
+        self.assertIsInstance(cube.values, np.memmap)
+        np.testing.assert_array_equal(cube.values, built.values)
+        self.assertEqual((cube.municipalities, cube.categories, cube.months),
+                         (['101', '147'], ['Wind', 'Solar'], ['2021-01', '2021-02']))
+
+    def test_frames_are_loaded_once_per_max_age(self):
+        load = FlakyLoader()
+        self.assertEqual(shared.frame('test', load, max_age=3600)['Value'].tolist(), [1])
+        self.assertEqual(shared.frame('test', load, max_age=3600)['Value'].tolist(), [1])
+        self.assertEqual(shared.frame('test', load, max_age=0)['Value'].tolist(), [2])
+        self.assertEqual(load.calls, 2)
+
+    def test_host_lock_excludes_other_processes(self):
+        code = ('import sys; from store import host_lock; print("waiting", flush=True); '
+                'lock = host_lock("test", sys.argv[1]); lock.__enter__(); print("locked", flush=True)')
+        with host_lock('test', shared.SHARED_DIR):
+            child = subprocess.Popen([sys.executable, '-c', code, shared.SHARED_DIR],
+                                     stdout=subprocess.PIPE, text=True)
+            self.addCleanup(child.kill)
+            self.assertEqual(child.stdout.readline().strip(), 'waiting')
+            self.assertRaises(subprocess.TimeoutExpired, child.wait, 0.5)
+        self.assertEqual(child.stdout.readline().strip(), 'locked')
+        self.assertEqual(child.wait(WAIT), 0)
+        child.stdout.close()
+
+
+# Municipality Cubes
+class CubeTest(unittest.TestCase):
+
+    MUNICIPALITIES = ['101', '147', '151', '999']
+    MONTHS = ['2021-01', '2021-02']
+
+    # Duplicate rows, a NaN value, a NaN-only cell, a missing industry and a municipality without data
+    LONG = pd.DataFrame({
+        'Mun': ['101', '101', '101', '101', '147', '147', '147', '151', '151'],
+        'Industry': ['Farming', 'Farming', 'Retail', 'Retail', 'Farming', None, 'Retail', 'Retail', 'Farming'],
+        'Month': ['2021-01', '2021-01', '2021-01', '2021-02', '2021-02', '2021-01', '2021-01', '2021-02', '2021-02'],
+        'Con': [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, np.nan, 7.0, np.nan]})
+
+    def expected(self, df, keys):
+        '''
+        The baseline: pandas sums, NaN where no row has a value.
+        '''
+        return df.dropna(subset=['Industry', 'Con']).groupby(keys)['Con'].sum()
+
+    def test_long_frames_sum_duplicates_and_skip_missing_values(self):
+        cube = Cube.from_long(self.LONG, 'Mun', 'Industry', 'Month', 'Con', municipalities=self.MUNICIPALITIES)
+        self.assertEqual((cube.municipalities, cube.categories, cube.months),
+                         (self.MUNICIPALITIES, ['Farming', 'Retail'], self.MONTHS))
+        expected = self.expected(self.LONG, ['Mun', 'Industry', 'Month'])
+        for mun in self.MUNICIPALITIES:
+            for industry in cube.categories:
+                for month in self.MONTHS:
+                    value = cube.slice(industry, month)[cube.municipalities.index(mun)]
+                    np.testing.assert_equal(value, expected.get((mun, industry, month), np.nan))
+
+    def test_total_and_drill_down_match_groupby(self):
+        cube = Cube.from_long(self.LONG, 'Mun', 'Industry', 'Month', 'Con', municipalities=self.MUNICIPALITIES)
+        for month in self.MONTHS:
+            rows = self.LONG[self.LONG['Month'] == month]
+            total = self.expected(rows, 'Mun').reindex(self.MUNICIPALITIES)
+            np.testing.assert_array_equal(cube.total(month), total.to_numpy())
+            by_category = self.expected(rows, 'Industry').reindex(cube.categories, fill_value=0)
+            np.testing.assert_array_equal(cube.by_category(month), by_category.to_numpy())
+            for mun in self.MUNICIPALITIES:
+                drill = self.expected(rows[rows['Mun'] == mun], 'Industry').reindex(cube.categories)
+                np.testing.assert_array_equal(cube.by_category(month, mun), drill.to_numpy())
+
+    def test_wide_frames_match_their_long_form(self):
+        wide = pd.DataFrame({'Mun': ['101', '101', '147'], 'Month': ['2021-01', '2021-02', '2021-02'],
+                             'Wind': [1.0, 2.0, 3.0], 'Solar': [4.0, np.nan, 6.0]})
+        cube = Cube.from_wide(wide, 'Mun', ['Wind', 'Solar'], 'Month', municipalities=self.MUNICIPALITIES)
+        long = wide.melt(id_vars=['Mun', 'Month'], var_name='Industry', value_name='Con')
+        expected = Cube.from_long(long, 'Mun', 'Industry', 'Month', 'Con', municipalities=self.MUNICIPALITIES)
+        self.assertEqual(cube.categories, ['Wind', 'Solar'])
+        for source in cube.categories:
+            for month in self.MONTHS:
+                np.testing.assert_array_equal(cube.slice(source, month), expected.slice(source, month))
+        np.testing.assert_array_equal(cube.series('101'), [5.0, 2.0])
+        np.testing.assert_array_equal(cube.series('147', 'Solar'), [np.nan, 6.0])
+        # Months out of range pick the latest
+        np.testing.assert_array_equal(cube.total(99), cube.total('2021-02'))
+
+
+# Downsampling
+def day_candles(days):
+    values = np.arange(days, dtype='float64')
+    return pd.DataFrame({'Date': pd.date_range('2025-10-17', periods=days, freq='D'),
+                         'Open': values, 'Close': values + 1, 'High': values + 2, 'Low': values - 1})
+
+class CandleTest(unittest.TestCase):
+
+    def test_a_year_of_day_candles_is_not_merged(self):
+        df = day_candles(366)
+        self.assertIs(downsample.candles(df), df)
+
+    def test_merged_candles_name_their_period(self):
+        merged = downsample.candles(day_candles(12), budget=6)
+        self.assertEqual(len(merged), 6)
+        self.assertEqual(merged['Period'].iloc[0], '2 candles, 2025-10-17 to 2025-10-18')
+        self.assertEqual(merged[['Open', 'Close', 'High', 'Low']].iloc[0].tolist(), [0, 2, 3, -1])
+
+
+class LTTBTest(unittest.TestCase):
+
+    def test_picks_n_increasing_points_with_both_ends(self):
+        x = np.arange(1000)
+        index = downsample.lttb(x, np.sin(x / 20), 100)
+        self.assertEqual(len(index), 100)
+        self.assertEqual((index[0], index[-1]), (0, 999))
+        self.assertTrue((np.diff(index) > 0).all())
+
+    def test_keeps_spikes(self):
+        y = np.zeros(1000)
+        y[537] = 100
+        self.assertIn(537, downsample.lttb(np.arange(1000), y, 50))
+
+    def test_short_series_are_kept_whole(self):
+        x = np.arange(10)
+        np.testing.assert_array_equal(downsample.lttb(x, x, 20), x)
+        np.testing.assert_array_equal(downsample.lttb(x, x, 2), x)
+
+
+# Price Candles
+def hourly_prices(hours, areas=('DK1', 'DK2')):
+    rng = np.random.default_rng(7)
+    times = pd.date_range('2025-10-17', periods=hours, freq='h')
+    return pd.DataFrame({'HourDK': np.repeat(times, len(areas)), 'PriceArea': list(areas) * hours,
+                         'SpotPriceEUR': rng.uniform(0, 100, hours * len(areas))})
+
+class OHLCTest(unittest.TestCase):
+
+    def test_last_hour_published_in_two_parts(self):
+        full = hourly_prices(24 * 9 + 5)
+        # The last hour first arrives for DK1 only, later for both areas with a revised DK1 price
+        partial = full.iloc[:-1].copy()
+        partial.iloc[-1, partial.columns.get_loc('SpotPriceEUR')] = 1000.0
+        for size in BUCKETS:
+            engine = OHLCEngine(size)
+            engine.update(full.iloc[:-24])
+            engine.update(partial)
+            engine.update(full)
+            expected = OHLCEngine(size)
+            expected.update(full)
+            pd.testing.assert_frame_equal(engine.candles(), expected.candles())
+
+
+# Figure Cache
+class FigureCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loader = FlakyLoader()
+        self.dataset = LiveDataset('prices', self.loader, interval=60)
+        self.dataset.refresh()
+        self.builds = []
+
+    def callback(self, cache, **kwargs):
+        @cache.cached(self.dataset, **kwargs)
+        def figure(*args):
+            self.builds.append(args)
+            return {'data': [{'y': self.dataset.get()['Value'].tolist()}], 'layout': {'title': str(args)}}
+        return figure
+
+    def test_same_inputs_and_version_are_served_from_the_cache(self):
+        figure = self.callback(FigureCache())
+        self.assertIs(figure('DK1', 'day'), figure('DK1', 'day'))
+        self.assertEqual(len(self.builds), 1)
+
+    def test_other_inputs_build_another_figure(self):
+        figure = self.callback(FigureCache())
+        first = figure('DK1', 'day')
+        self.assertEqual(figure('DK2', 'day')['layout']['title'], "('DK2', 'day')")
+        self.assertEqual(figure('DK1', 'week')['layout']['title'], "('DK1', 'week')")
+        self.assertIs(figure('DK1', 'day'), first)
+        self.assertEqual(len(self.builds), 3)
+
+    def test_dataset_refresh_invalidates_the_figure(self):
+        figure = self.callback(FigureCache())
+        self.assertEqual(figure('DK1')['data'][0]['y'], [1])
+        self.dataset.refresh()
+        self.assertEqual(figure('DK1')['data'][0]['y'], [2])
+        # A failed refresh keeps the version and so the figure
+        self.loader.fail = True
+        self.dataset.refresh()
+        self.assertEqual(figure('DK1')['data'][0]['y'], [2])
+        self.assertEqual(len(self.builds), 2)
+
+    def test_keyed_inputs_only(self):
+        cache = FigureCache()
+        ticks = self.callback(cache, inputs=False)
+        self.assertIs(ticks(1), ticks(2))
+        area = self.callback(cache, inputs=[0])
+        self.assertIs(area('DK1', 1), area('DK1', 2))
+        self.assertIsNot(area('DK1', 1), area('DK2', 1))
+        self.assertEqual(len(self.builds), 3)
+
+    def test_least_recently_used_figures_are_dropped(self):
+        figure = self.callback(FigureCache(max_entries=2))
+        figure('DK1')
+        figure('DK2')
+        figure('DK1')
+        figure('SE3')
+        figure('DK1')
+        figure('DK2')
+        self.assertEqual(self.builds, [('DK1',), ('DK2',), ('SE3',), ('DK2',)])
+
+
+# Encoding
+class EncodingTest(unittest.TestCase):
+
+    def test_values_keep_the_displayed_decimals(self):
+        self.assertEqual(encoding.round_array([1234.5678, 10.1, None]), [1234.57, 10.1, None])
+        self.assertEqual(encoding.round_array([0.000123456]), [0.00012346])
+        self.assertEqual(encoding.round_array([3.0, 4.0]), [3, 4])
+
+    def test_template_format_sets_the_decimals(self):
+        figure = {'data': [{'type': 'pie', 'values': [1234.5678], 'hovertemplate': '%{value:.3f} MWh/h'},
+                           {'type': 'bar', 'y': [12345.678, 1.0], 'hovertemplate': '%{y:.1f}'}]}
+        encoding.compact_figure(figure)
+        self.assertEqual(figure['data'][0]['values'], [1234.568])
+        self.assertEqual(figure['data'][1]['y'], [12345.7, 1.0])
+
+
+ENCODING_JS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets', 'encoding.js')
+
+@unittest.skipUnless(shutil.which('node'), 'needs node to run the clientside code')
+class ClientsideEncodingTest(unittest.TestCase):
+
+    def run_js(self, code):
+        script = (f'global.window = {{}}; require({json.dumps(ENCODING_JS)}); '
+                  f'var encoding = window.dash_clientside.encoding; console.log(JSON.stringify({code}));')
+        result = subprocess.run(['node', '-e', script], capture_output=True, text=True, check=True)
+        return json.loads(result.stdout)
+
+    def test_even_axis_replaces_the_template_axis(self):
+        trace = self.run_js("encoding.trace({type: 'bar', name: 'Solar', x: [], y: []}, "
+                            "{x0: '2020-12-15T10:00', dx: 3600000}, [1, 2])")
+        self.assertNotIn('x', trace)
+        self.assertEqual((trace['x0'], trace['dx'], trace['y'], trace['name']),
+                         ('2020-12-15T10:00', 3600000, [1, 2], 'Solar'))
+
+    def test_explicit_axis_replaces_the_template_axis(self):
+        trace = self.run_js("encoding.trace({type: 'bar', x0: 0, dx: 1}, {x: ['a', 'b']}, [1, 2])")
+        self.assertNotIn('x0', trace)
+        self.assertEqual(trace['x'], ['a', 'b'])
+
+
+# Live Data
+class FlakyLoader:
+    """
+    Loader returning a new one-row DataFrame per call, or failing while fail is set.
+    """
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError('upstream down')
+        return pd.DataFrame({'Value': [self.calls]})
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_first_get_loads_synchronously(self):
+        dataset = LiveDataset('prices', FlakyLoader(), interval=300)
+        self.assertEqual((dataset.state, dataset.age), ('loading', None))
+        self.assertEqual(dataset.get()['Value'].tolist(), [1])
+        self.assertEqual((dataset.version, dataset.stale), (1, False))
+
+    def test_get_fails_without_a_snapshot(self):
+        dataset = LiveDataset('prices', FlakyLoader(fail=True), interval=300)
+        self.assertRaises(RuntimeError, dataset.get)
+        self.assertEqual(dataset.state, 'failed')
+
+    def test_failed_refresh_keeps_serving_the_last_snapshot(self):
+        loader = FlakyLoader()
+        dataset = LiveDataset('prices', loader, interval=300)
+        self.assertTrue(dataset.refresh())
+        loader.fail = True
+        self.assertFalse(dataset.refresh())
+        self.assertEqual(dataset.get()['Value'].tolist(), [1])
+        self.assertEqual((dataset.version, dataset.failures, dataset.stale), (1, 1, True))
+        self.assertIn('upstream down', dataset.last_error)
+        # Retried sooner than the regular interval
+        self.assertLessEqual(dataset.next_due, time.monotonic() + RETRY_INTERVAL)
+
+        loader.fail = False
+        self.assertTrue(dataset.refresh())
+        self.assertEqual(dataset.get()['Value'].tolist(), [3])
+        self.assertEqual((dataset.version, dataset.failures, dataset.stale), (2, 0, False))
+
+    def test_refresh_runs_every_dataset(self):
+        scheduler = Scheduler()
+        good = scheduler.register('good', FlakyLoader(), interval=60)
+        bad = scheduler.register('bad', FlakyLoader(fail=True), interval=60)
+        scheduler.refresh(list(scheduler.datasets.values()))
+        self.assertEqual((good.version, good.failures), (1, 0))
+        self.assertEqual((bad.version, bad.failures), (0, 1))
+
+
+class LazyDatasetTest(unittest.TestCase):
+
+    def test_failed_reload_keeps_serving_the_loaded_value(self):
+        loader = FlakyLoader()
+        dataset = LazyDataset('codes', loader, max_age=3600)
+        self.assertEqual(dataset.get()['Value'].tolist(), [1])
+        loader.fail = True
+        self.assertRaises(ConnectionError, dataset.reload)
+        self.assertEqual((dataset.state, dataset.version, dataset.failures, dataset.stale), ('ready', 1, 1, True))
+        self.assertEqual(dataset.get()['Value'].tolist(), [1])
+        self.assertLessEqual(dataset.retry_at, time.monotonic() + RETRY_INTERVAL)
+
+        loader.fail = False
+        self.assertEqual(dataset.reload()['Value'].tolist(), [3])
+        self.assertEqual((dataset.version, dataset.failures, dataset.error, dataset.stale), (2, 0, None, False))
+
+    def test_expired_value_is_reloaded_in_the_background(self):
+        loader = FlakyLoader()
+        dataset = LazyDataset('codes', loader, max_age=60)
+        dataset.get()
+        dataset.loaded_at -= 61
+        self.assertTrue(dataset.stale)
+        # Served at once, replaced once the background reload is done
+        self.assertEqual(dataset.get()['Value'].tolist(), [1])
+        self.assertTrue(wait_for(lambda: dataset.version == 2))
+        self.assertEqual((dataset.get()['Value'].tolist(), dataset.stale), ([2], False))
+
+    def test_first_load_failure(self):
+        dataset = LazyDataset('codes', FlakyLoader(fail=True))
+        self.assertRaises(ConnectionError, dataset.get)
+        self.assertEqual((dataset.state, dataset.age, dataset.stale), ('failed', None, False))
+        self.assertIn('upstream down', dataset.last_error)
+
+
+# Startup
+class StartupTest(unittest.TestCase):
+
+    BUDGET = float(os.environ.get('STARTUP_BUDGET', 3.0))
+
+    def test_labels_match_the_built_features(self):
+        features = geometry.build('low')['features']
+        self.assertEqual(geometry.build_labels(),
+                         [(str(f['id']), f['properties']['name']) for f in features])
+
+    def test_import_within_budget(self):
+        env = dict(os.environ, DATA_CACHE_DIR=tempfile.mkdtemp(prefix='startup-test-'),
+                   ENERGIDATASERVICE_URL='http://127.0.0.1:9')
+        code = 'import time; start = time.perf_counter(); import index; print(time.perf_counter() - start)'
+        result = subprocess.run([sys.executable, '-W', 'ignore', '-c', code], env=env,
+                                capture_output=True, text=True, check=True)
+        seconds = float(result.stdout.split()[-1])
+        self.assertLess(seconds, self.BUDGET, f'import index took {seconds:.2f}s')
+
+
+if __name__ == '__main__':
+    unittest.main()
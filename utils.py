@@ -1,8 +1,495 @@
 # Parser
+import os
+import re
+import time
+import logging
+import random
+import asyncio
+import functools
+import threading
+import contextlib
 import requests
 import json
+import numpy as np
 import pandas as pd
-from collections import defaultdict
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import metrics
+import schema
+
+# Transport Settings
+API_BASE_URL = os.environ.get("ENERGIDATASERVICE_URL", "https://www.energidataservice.dk")
+CONNECT_TIMEOUT = float(os.environ.get("API_CONNECT_TIMEOUT", 3.05))
+READ_TIMEOUT = float(os.environ.get("API_READ_TIMEOUT", 20))
+MAX_RETRIES = int(os.environ.get("API_MAX_RETRIES", 3))
+BACKOFF_FACTOR = float(os.environ.get("API_BACKOFF_FACTOR", 0.3))
+POOL_CONNECTIONS = int(os.environ.get("API_POOL_CONNECTIONS", 4))
+POOL_MAXSIZE = int(os.environ.get("API_POOL_MAXSIZE", 16))
+CHUNK_SIZE = int(os.environ.get("API_CHUNK_SIZE", 32000))
+
+# Circuit Breaker Settings
+BREAKER_FAILURES = int(os.environ.get("API_BREAKER_FAILURES", 5))
+BREAKER_RESET_TIMEOUT = float(os.environ.get("API_BREAKER_RESET_TIMEOUT", 30))
+
+# Concurrency Settings
+ASYNC_LIMIT = int(os.environ.get("API_ASYNC_LIMIT", POOL_CONNECTIONS))
+ASYNC_DEADLINE = float(os.environ.get("API_ASYNC_DEADLINE", 60))
+
+# Cache Settings
+CACHE_MAX_BYTES = int(os.environ.get("API_CACHE_MAX_BYTES", 256 * 1024 ** 2))
+DEFAULT_TTL = 60
+## Only sql_to_df results are cached. The live datasets and the store deltas
+## go through fetch() on their own schedules, so they need no TTL here.
+DATASET_TTL = {
+    'industrycodes_de35': 24 * 3600,
+}
+## Serve expired results for up to STALE_MAX_AGE seconds while they are refreshed in the background
+STALE_WHILE_REVALIDATE = os.environ.get("API_STALE_WHILE_REVALIDATE", "1") == "1"
+STALE_MAX_AGE = float(os.environ.get("API_STALE_MAX_AGE", 24 * 3600))
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+try:
+    import brotli  # noqa: F401  (lets urllib3 decode 'br' responses)
+    ACCEPT_ENCODING = "br, gzip, deflate"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+
+class JitteredRetry(Retry):
+    """
+    urllib3 Retry with "full jitter" on the exponential backoff, so that
+    workers retrying the same failed upstream call do not do so in lockstep.
+    """
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        if backoff <= 0:
+            return 0
+        return random.uniform(0, backoff)
+
+
+class Transport:
+    """
+    Pooled HTTP transport shared by every EnergiAPI instance.
+
+    One HTTPAdapter (and thereby one urllib3 connection pool per host) is
+    shared between threads, while each thread gets its own requests.Session
+    mounted on that adapter, as a Session itself is not thread-safe.
+    """
+
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 retries=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR,
+                 pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE):
+        self.timeout = (connect_timeout, read_timeout)
+        retry = JitteredRetry(total=retries, connect=retries, read=retries,
+            backoff_factor=backoff_factor, status_forcelist=(429, 500, 502, 503, 504),
+            raise_on_status=False)
+        self.adapter = HTTPAdapter(pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize, max_retries=retry, pool_block=False)
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('https://', self.adapter)
+            session.mount('http://', self.adapter)
+            session.headers.update({'Accept-Encoding': ACCEPT_ENCODING,
+                                    'Connection': 'keep-alive'})
+            self._local.session = session
+        return session
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        response = self.session.get(url, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+# Circuit Breaker
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised instead of sending a request while the circuit breaker of the
+    upstream is open.
+    """
+
+
+def is_upstream_failure(error):
+    '''
+    True for errors that say the upstream is down or overloaded: connection
+    errors, timeouts and 429/5xx responses. Rejected queries (4xx) are not.
+    '''
+    if isinstance(error, requests.HTTPError):
+        response = error.response
+        return response is None or response.status_code == 429 or response.status_code >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError))
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to an upstream that keeps failing.
+
+    closed: requests pass; after `failures` upstream failures in a row it opens.
+    open: requests fail at once with CircuitOpenError, for reset_timeout
+        seconds, instead of each waiting out the timeouts and retries.
+    half-open: the next request is let through as a probe while the others
+        still fail fast; its success closes the breaker, its failure opens
+        it for another reset_timeout.
+    """
+
+    def __init__(self, name='upstream', failures=BREAKER_FAILURES, reset_timeout=BREAKER_RESET_TIMEOUT,
+                 clock=time.monotonic):
+        self.name = name
+        self.clock = clock
+        self.failure_threshold = failures
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opens = 0
+        self.rejected = 0
+        self.last_error = None
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+        metrics.circuit_state.set(0, upstream=name)
+
+    def retry_in(self):
+        '''
+        Seconds until the next probe is let through while open.
+        '''
+        if self.state != OPEN:
+            return 0
+        return max(0, self.opened_at + self.reset_timeout - self.clock())
+
+    def allow(self):
+        '''
+        Raises CircuitOpenError unless a request may be sent now.
+        '''
+        with self._lock:
+            if self.state == OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self._set(HALF_OPEN)
+            if self.state == CLOSED:
+                return
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            self.rejected += 1
+        raise CircuitOpenError(f'{self.name} is unavailable ({self.last_error}), '
+                               f'next probe in {self.retry_in():.0f}s')
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state != CLOSED:
+                logger.info('Circuit of %s closed', self.name)
+                self._set(CLOSED)
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = repr(error)
+            self._probing = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.opened_at = self.clock()
+                self.opens += 1
+                logger.warning('Circuit of %s opened after %d failures: %r', self.name, self.failures, error)
+                self._set(OPEN)
+
+    def _set(self, state):
+        self.state = state
+        metrics.circuit_state.set({CLOSED: 0, HALF_OPEN: 1, OPEN: 2}[state], upstream=self.name)
+
+    def call(self, func, *args, **kwargs):
+        '''
+        Runs func(*args, **kwargs) through the breaker.
+        '''
+        self.allow()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if is_upstream_failure(e):
+                self.record_failure(e)
+            else:
+                self.record_success()
+            raise
+        self.record_success()
+        return result
+
+    def status(self):
+        with self._lock:
+            return {'state': self.state, 'failures': self.failures, 'opens': self.opens,
+                    'rejected': self.rejected, 'last_error': self.last_error,
+                    'retry_in': round(self.retry_in(), 1)}
+
+
+default_breaker = CircuitBreaker()
+
+
+# Decoding
+INT_TYPES = {'int2', 'int4', 'int8'}
+FLOAT_TYPES = {'float4', 'float8', 'numeric'}
+
+def decode_column(values, field_type):
+    '''
+    Converts one column of raw JSON values into a typed numpy array,
+    using the datastore type of the field. Missing values become NaN.
+    '''
+    if field_type in FLOAT_TYPES:
+        return np.array(values, dtype='float64')
+    if field_type in INT_TYPES:
+        if None in values:
+            return np.array(values, dtype='float64')
+        return np.array(values, dtype='int64')
+    return np.array(values, dtype=object)
+
+def decode_response(content, dataset=None, keep=()):
+    '''
+    Decodes the raw bytes of a datastore_search_sql response into a
+    DataFrame. Columns are built one at a time from the "fields" metadata,
+    so each column is a single pass over the records, and converted to
+    the schema of the dataset (see schema.py). The internal _id and
+    _full_text columns are dropped unless listed in keep.
+    '''
+    result = json_loads(content)["result"]
+    records = result["records"]
+    fields = result.get("fields")
+    if not fields:
+        fields = [{'id': key, 'type': 'text'} for key in (records[0] if records else [])]
+    fields = [field for field in fields
+              if field['id'] not in schema.INTERNAL_COLUMNS or field['id'] in keep]
+
+    columns = {}
+    for field in fields:
+        name = field['id']
+        values = decode_column([record.get(name) for record in records], field['type'])
+        columns[name] = schema.convert(values, schema.kind(dataset, name, field['type']))
+    return pd.DataFrame(columns, columns=[field['id'] for field in fields])
+
+
+# Caching
+DATASET_PATTERN = re.compile(r'\bFROM\s+"?(\w+)"?', re.IGNORECASE)
+
+def normalize_sql(query):
+    '''
+    Collapses whitespace, so that the same query written across several
+    lines or with trailing spaces maps to the same cache entry.
+    '''
+    return ' '.join(query.split())
+
+def sql_literal(value):
+    '''
+    Renders a Python value as an SQL literal, doubling embedded quotes.
+    '''
+    if isinstance(value, (bool, np.bool_)):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return repr(value.item() if hasattr(value, 'item') else value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+def dataset_of(query):
+    '''
+    Returns the name of the first dataset a query selects from, or None.
+    '''
+    match = DATASET_PATTERN.search(query)
+    return match.group(1) if match else None
+
+
+class QueryCache:
+    """
+    Thread-safe result cache for SQL queries.
+
+    Entries expire after the TTL of the dataset they were read from, and the
+    least recently used entries are evicted once the total (deep) size of the
+    cached DataFrames exceeds max_bytes. Expired entries are kept for another
+    stale_ttl seconds, to be served by get_stale() while they are refreshed.
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, ttls=None, default_ttl=DEFAULT_TTL, stale_ttl=None,
+                 clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.ttls = dict(DATASET_TTL if ttls is None else ttls)
+        self.default_ttl = default_ttl
+        if stale_ttl is None:
+            stale_ttl = STALE_MAX_AGE if STALE_WHILE_REVALIDATE else 0
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()  # key -> (expires, nbytes, df)
+        self._lock = threading.Lock()
+
+    def ttl(self, query):
+        return self.ttls.get(dataset_of(query), self.default_ttl)
+
+    def get(self, key):
+        '''
+        Returns a copy of the cached DataFrame for key, or None on a miss.
+        '''
+        return self._get(key, stale=False)[0]
+
+    def get_stale(self, key):
+        '''
+        Returns (DataFrame, expired): a copy of the cached DataFrame for key,
+        also once expired within the stale window, or (None, False) on a miss.
+        '''
+        return self._get(key, stale=True)
+
+    def _get(self, key, stale):
+        with self._lock:
+            entry = self._entries.get(key)
+            now = self.clock()
+            expired = entry is not None and entry[0] <= now
+            if expired and entry[0] + self.stale_ttl <= now:
+                self._discard(key)
+                entry = None
+            if entry is None or (expired and not stale):
+                self.misses += 1
+                return None, False
+            self._entries.move_to_end(key)
+            if expired:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+            return entry[2].copy(), expired
+
+    def put(self, key, df):
+        nbytes = int(df.memory_usage(deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = (self.clock() + self.ttl(key), nbytes, df.copy())
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _discard(self, key):
+        _, nbytes, _ = self._entries.pop(key)
+        self.nbytes -= nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.nbytes, 'hits': self.hits,
+                    'stale_hits': self.stale_hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+default_cache = QueryCache()
+
+## Counters of the shared cache on /metrics
+metrics.collect('dashboard_query_cache_lookups_total', 'Lookups in the shared query cache by result.', 'counter',
+                lambda: {result: default_cache.stats()[key]
+                         for result, key in [('hit', 'hits'), ('stale', 'stale_hits'), ('miss', 'misses')]},
+                labelname='result')
+metrics.collect('dashboard_query_cache_evictions_total', 'Entries evicted from the shared query cache.', 'counter',
+                lambda: default_cache.stats()['evictions'])
+metrics.collect('dashboard_query_cache_entries', 'Entries in the shared query cache.', 'gauge',
+                lambda: default_cache.stats()['entries'])
+metrics.collect('dashboard_query_cache_bytes', 'Deep size of the DataFrames in the shared query cache.', 'gauge',
+                lambda: default_cache.stats()['bytes'])
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the
+    call, later callers wait for it and receive the same result, or the
+    same exception if it failed. The key is free again as soon as the call
+    finishes, so a failed call is retried by the next caller.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._flights = {}  # key -> [done event, result, error, waiters]
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        '''
+        Returns (result, shared), where shared is True when other callers
+        got the same result object, i.e. for callers that waited on another
+        caller's call and for a caller whose call others waited on.
+        '''
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = [threading.Event(), None, None, 0]
+                self.calls += 1
+            else:
+                flight[3] += 1
+                self.coalesced += 1
+
+        if not leader:
+            flight[0].wait()
+            if flight[2] is not None:
+                raise flight[2]
+            return flight[1], True
+
+        try:
+            flight[1] = func()
+        except Exception as e:
+            flight[2] = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight[0].set()
+        # No caller joins once the key is free, so the count is final
+        return flight[1], flight[3] > 0
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'coalesced': self.coalesced, 'in_flight': len(self._flights)}
+
+
+default_flights = SingleFlight()
+
+## Queries whose stale cache entry is being refreshed in the background
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+
+
+_default_transport = None
+_transport_lock = threading.Lock()
+
+def default_transport():
+    '''
+    Returns the process wide transport, creating it on first use.
+    '''
+    global _default_transport
+    if _default_transport is None:
+        with _transport_lock:
+            if _default_transport is None:
+                _default_transport = Transport()
+    return _default_transport
+
 
 class EnergiAPI:
     """
@@ -10,23 +497,192 @@ class EnergiAPI:
     The functions returns a pandas dataframe of the parsed SQL Query.
     """
 
-    def __init__(self):
-        self.sqlurl = "https://www.energidataservice.dk/proxy/api/datastore_search_sql?sql="
-   
+    def __init__(self, transport=None, cache=None, flights=None, breaker=None, stale=STALE_WHILE_REVALIDATE):
+        self.sqlurl = API_BASE_URL + "/proxy/api/datastore_search_sql"
+        self.transport = transport or default_transport()
+        self.cache = default_cache if cache is None else cache
+        self.flights = default_flights if flights is None else flights
+        self.breaker = default_breaker if breaker is None else breaker
+        self.stale = stale
+
 
     def sql_to_df(self, query):
         """
         Example Query:
         " SELECT column1, column2 FROM dataset WHERE column2 >= Y "
-        Some queries might require backslash for escaping characters.
+        or a query.Query building the same statement.
+        Results are shared through the query cache; pass cache=False to
+        the constructor to always go upstream. Concurrent calls of the
+        same query share a single upstream request. With stale, an expired
+        result is returned at once and refreshed in the background.
         """
 
-        response = requests.get(self.sqlurl + query)
-        raw = json.loads(response.content)
-        records = raw["result"]["records"]
-        _dict = defaultdict(list)
-        for record in records:
-            for key in list(records[0].keys()):
-                _dict[key].append(record[key])
-        return pd.DataFrame.from_dict(_dict)
+        query = str(query)
+        key = normalize_sql(query)
+        if self.cache:
+            if self.stale:
+                df, expired = self.cache.get_stale(key)
+                if expired:
+                    self._revalidate(query, key)
+            else:
+                df = self.cache.get(key)
+            if df is not None:
+                return df
+
+        df, shared = self.flights.do((self.sqlurl, key), lambda: self._fetch_and_cache(query, key))
+        # Each caller of a shared result gets its own copy, the one that ran the query included
+        return df.copy() if shared else df
+
+    def _fetch_and_cache(self, query, key):
+        df = self.fetch(query)
+        if self.cache:
+            self.cache.put(key, df)
+        return df
+
+    def _revalidate(self, query, key):
+        '''
+        Refreshes an expired cache entry in a background thread, one at a
+        time per query. While it runs, callers keep getting the expired entry.
+        '''
+        flight = (self.sqlurl, key)
+        with _revalidating_lock:
+            if flight in _revalidating:
+                return
+            _revalidating.add(flight)
+        threading.Thread(target=self._revalidate_entry, args=(query, key), name='revalidate',
+                         daemon=True).start()
+
+    def _revalidate_entry(self, query, key):
+        flight = (self.sqlurl, key)
+        try:
+            self.flights.do(flight, lambda: self._fetch_and_cache(query, key))
+        except Exception as e:
+            logger.warning('Refreshing a stale result of %s failed: %r', dataset_of(query), e)
+        finally:
+            with _revalidating_lock:
+                _revalidating.discard(flight)
+
+    def fetch(self, query, keep=()):
+        '''
+        Runs a query upstream, bypassing the cache and so never answered
+        stale, e.g. for the watermark deltas of store.DatasetStore. keep
+        lists internal columns (_id, _full_text) to keep in the result.
+        Fails at once with CircuitOpenError while the upstream is down.
+        '''
+        query = str(query)
+        dataset = dataset_of(query)
+        start = time.perf_counter()
+        # Passed as a parameter, so requests URL-encodes it ('+' included)
+        response = self.breaker.call(self.transport.get, self.sqlurl, params={'sql': query})
+        network = time.perf_counter() - start
+        df = decode_response(response.content, dataset, keep)
+        metrics.observe_query(dataset, query, network, time.perf_counter() - start - network,
+                              len(df), len(response.content))
+        return df
+
+    def iter_sql(self, query, order_by=None, chunksize=CHUNK_SIZE, key=None):
+        '''
+        Runs a query page by page and yields one DataFrame per page, so only
+        a single page is held in memory at a time. Pages bypass the cache.
+
+        order_by: ORDER BY clause giving the pages a stable order for
+            LIMIT/OFFSET paging, e.g. '"HourUTC", "PriceArea"'.
+        key: unique, increasing column selected by the query (such as "_id").
+            When given, pages are fetched by keyset instead of OFFSET, which
+            keeps deep pages as cheap as the first one.
+        '''
+        if order_by is None and key is None:
+            raise ValueError('iter_sql needs either order_by or key for a stable page order')
+
+        offset = 0
+        last = None
+        while True:
+            if key is None:
+                page = (f"SELECT * FROM ({query}) AS page ORDER BY {order_by} "
+                        f"LIMIT {chunksize} OFFSET {offset}")
+            else:
+                where = f"WHERE \"{key}\" > {sql_literal(last)} " if last is not None else ""
+                page = (f"SELECT * FROM ({query}) AS page {where}"
+                        f"ORDER BY \"{key}\" LIMIT {chunksize}")
+            df = self.fetch(page, keep=(key,) if key else ())
+            if df.empty:
+                return
+            yield df
+            if len(df) < chunksize:
+                return
+            offset += len(df)
+            if key is not None:
+                last = df[key].iloc[-1]
+
+
+# Concurrency
+class ConcurrentCalls:
+    """
+    Runs blocking calls concurrently from an asyncio event loop. Each call
+    runs in a thread of a pool of its own, at most limit at a time, and is
+    given up with a TimeoutError once it has run longer than its deadline.
+    A call that is given up keeps its thread until it returns (bounded by
+    the transport timeouts), as threads cannot be cancelled.
+    """
+
+    def __init__(self, limit=ASYNC_LIMIT, deadline=ASYNC_DEADLINE):
+        self.limit = limit
+        self.deadline = deadline
+        self._executor = ThreadPoolExecutor(limit, thread_name_prefix='concurrent-call')
+
+    async def call(self, func, *args, deadline=None, semaphore=None):
+        '''
+        Runs func(*args) in the pool and returns its result.
+        '''
+        loop = asyncio.get_running_loop()
+        async with semaphore or contextlib.nullcontext():
+            return await asyncio.wait_for(loop.run_in_executor(self._executor, func, *args),
+                                          deadline or self.deadline)
+
+    async def gather_calls(self, funcs, deadline=None, return_exceptions=False):
+        '''
+        Runs every callable of funcs and returns their results in order.
+        The deadline of each call starts when it starts, not when it is queued.
+        '''
+        semaphore = asyncio.Semaphore(self.limit)
+        return await asyncio.gather(*(self.call(func, deadline=deadline, semaphore=semaphore)
+                                      for func in funcs), return_exceptions=return_exceptions)
+
+    def run(self, funcs, deadline=None, return_exceptions=False):
+        '''
+        gather_calls() for synchronous code, such as callbacks and the
+        scheduler thread: takes as long as the slowest call.
+        '''
+        return asyncio.run(self.gather_calls(funcs, deadline, return_exceptions))
+
+
+class AsyncEnergiAPI(ConcurrentCalls):
+    """
+    asyncio variant of EnergiAPI for batches of queries, e.g.:
+
+        prod, codes = AsyncEnergiAPI().batch([prod_query, codes_query])
+
+    Queries go through the given EnergiAPI, so they share its transport,
+    query cache and single-flight coalescing.
+    """
+
+    def __init__(self, api=None, limit=ASYNC_LIMIT, deadline=ASYNC_DEADLINE):
+        super().__init__(limit, deadline)
+        self.api = api or EnergiAPI()
+
+    async def sql_to_df(self, query, deadline=None):
+        return await self.call(self.api.sql_to_df, query, deadline=deadline)
+
+    async def gather(self, queries, deadline=None, return_exceptions=False):
+        '''
+        Runs a batch of queries concurrently and returns their DataFrames
+        in the order of the queries.
+        '''
+        return await self.gather_calls([functools.partial(self.api.sql_to_df, query) for query in queries],
+                                       deadline, return_exceptions)
 
+    def batch(self, queries, deadline=None, return_exceptions=False):
+        '''
+        gather() for synchronous code.
+        '''
+        return asyncio.run(self.gather(queries, deadline, return_exceptions))